@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Benchmark assíncrono para o proxy Gemini-OpenAI
+
+Gera carga em malha fechada (N clientes concorrentes) ou aberta (chegadas
+Poisson a uma taxa fixa) e mede TTFT, latência entre tokens, latência
+ponta a ponta (p50/p95/p99), vazão e taxa de erros. Os resultados podem
+ser salvos em JSON/CSV e comparados entre duas execuções.
+
+Exemplos:
+    python bench.py --mode closed --concurrency 32 --requests 500
+    python bench.py --mode open --rate 20 --duration 60 --stream-ratio 0.5
+    python bench.py --prompt-dist uniform:100-20000 --output run.json --csv run.csv
+    python bench.py --compare base.json run.json --threshold 0.1
+
+Dependência: pip install httpx  (e h2 para --http2)
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from test_proxy import ProxyTester
+
+WORDS = "o rápido proxy encaminha cada pedido ao gemini e devolve tokens ao cliente".split()
+
+# métricas onde menor é melhor / maior é melhor, para o modo de comparação
+LOWER_IS_BETTER = [
+    "e2e_p50", "e2e_p95", "e2e_p99",
+    "ttft_p50", "ttft_p95", "ttft_p99",
+    "itl_p50", "itl_p95", "itl_p99",
+]
+HIGHER_IS_BETTER = ["throughput_rps", "output_tokens_per_s"]
+
+
+@dataclass
+class Result:
+    """Medições de uma requisição (tempos em segundos)"""
+    start: float
+    stream: bool
+    prompt_tokens: int
+    status: int = 0
+    error: str = ""
+    e2e: float = 0.0
+    ttft: Optional[float] = None
+    completion_tokens: int = 0
+    valid: Optional[bool] = None
+    itl: List[float] = field(default_factory=list)
+
+
+# ------------------------------------------------------------------ #
+# Geração de prompts
+# ------------------------------------------------------------------ #
+def parse_dist(spec: str):
+    """fixed:N | uniform:A-B | choice:a,b,c  ➞ função que sorteia um tamanho"""
+    kind, _, arg = spec.partition(":")
+    if kind == "fixed":
+        n = int(arg)
+        return lambda rnd: n
+    if kind == "uniform":
+        lo, hi = (int(x) for x in arg.split("-"))
+        return lambda rnd: rnd.randint(lo, hi)
+    if kind == "choice":
+        sizes = [int(x) for x in arg.split(",")]
+        return lambda rnd: rnd.choice(sizes)
+    raise argparse.ArgumentTypeError(f"distribuição inválida: {spec}")
+
+
+def make_prompt(rnd: random.Random, tokens: int, unique: bool) -> str:
+    """~1 token por palavra; um prefixo único evita cache e coalescência"""
+    words = [rnd.choice(WORDS) for _ in range(max(1, tokens))]
+    prefix = f"[{rnd.getrandbits(48):x}] " if unique else ""
+    return prefix + " ".join(words)
+
+
+# ------------------------------------------------------------------ #
+# Uma requisição
+# ------------------------------------------------------------------ #
+async def one_request(client: httpx.AsyncClient, args, rnd: random.Random,
+                      tester: ProxyTester) -> Result:
+    stream = rnd.random() < args.stream_ratio
+    size = args.prompt_size(rnd)
+    payload = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": make_prompt(rnd, size, not args.same_prompt)}],
+        "max_tokens": args.max_tokens,
+        "temperature": 0.7,
+        "stream": stream,
+    }
+    if stream:
+        payload["stream_options"] = {"include_usage": True}
+
+    res = Result(start=time.perf_counter(), stream=stream, prompt_tokens=size)
+    try:
+        if stream:
+            await stream_request(client, payload, res)
+        else:
+            response = await client.post("/v1/chat/completions", json=payload)
+            res.status = response.status_code
+            res.e2e = res.ttft = time.perf_counter() - res.start
+            if response.status_code == 200:
+                data = response.json()
+                res.completion_tokens = data.get("usage", {}).get("completion_tokens", 0)
+                if rnd.random() < args.validate_rate:
+                    res.valid = tester._validate_openai_response(data)
+            else:
+                res.error = response.text[:200]
+    except Exception as e:  # timeout, conexão recusada, ...
+        res.error = f"{type(e).__name__}: {e}"
+        res.e2e = time.perf_counter() - res.start
+    return res
+
+
+async def stream_request(client: httpx.AsyncClient, payload: Dict[str, Any], res: Result):
+    last = None
+    async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+        res.status = response.status_code
+        if response.status_code != 200:
+            res.error = (await response.aread()).decode(errors="replace")[:200]
+            res.e2e = time.perf_counter() - res.start
+            return
+        chunks = 0
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if "error" in event:
+                res.error = str(event["error"].get("message", event["error"]))[:200]
+                break
+            if event.get("usage"):
+                res.completion_tokens = event["usage"].get("completion_tokens", 0)
+            delta = (event.get("choices") or [{}])[0].get("delta", {})
+            if delta.get("content") or delta.get("tool_calls"):
+                now = time.perf_counter()
+                if last is None:
+                    res.ttft = now - res.start
+                else:
+                    res.itl.append(now - last)
+                last = now
+                chunks += 1
+        if not res.completion_tokens:
+            res.completion_tokens = chunks
+    res.e2e = time.perf_counter() - res.start
+
+
+# ------------------------------------------------------------------ #
+# Modos de carga
+# ------------------------------------------------------------------ #
+async def closed_loop(client, args, tester) -> List[Result]:
+    """N clientes, cada um envia a próxima requisição assim que recebe a resposta"""
+    results: List[Result] = []
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = args.requests
+
+    async def worker(wid: int):
+        nonlocal remaining
+        rnd = random.Random(args.seed * 1000 + wid)
+        while True:
+            if deadline and time.perf_counter() >= deadline:
+                return
+            if not deadline:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            results.append(await one_request(client, args, rnd, tester))
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    return results
+
+
+async def open_loop(client, args, tester) -> List[Result]:
+    """Chegadas Poisson a --rate req/s, independentes da latência do servidor"""
+    rnd = random.Random(args.seed)
+    tasks = []
+    began = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - began
+        if args.duration and elapsed >= args.duration:
+            break
+        if not args.duration and sent >= args.requests:
+            break
+        req_rnd = random.Random(rnd.getrandbits(64))
+        tasks.append(asyncio.create_task(one_request(client, args, req_rnd, tester)))
+        sent += 1
+        await asyncio.sleep(rnd.expovariate(args.rate))
+    return list(await asyncio.gather(*tasks))
+
+
+# ------------------------------------------------------------------ #
+# Estatísticas
+# ------------------------------------------------------------------ #
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(results: List[Result], wall: float) -> Dict[str, Any]:
+    ok = [r for r in results if r.status == 200 and not r.error]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r not in ok:
+            key = str(r.status) if r.status else "exception"
+            errors[key] = errors.get(key, 0) + 1
+
+    e2e = [r.e2e for r in ok]
+    ttft = [r.ttft for r in ok if r.ttft is not None]
+    itl = [gap for r in ok for gap in r.itl]
+    validated = [r.valid for r in results if r.valid is not None]
+    summary: Dict[str, Any] = {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "wall_s": wall,
+        "throughput_rps": len(ok) / wall if wall else 0.0,
+        "output_tokens_per_s": sum(r.completion_tokens for r in ok) / wall if wall else 0.0,
+        "validated": len(validated),
+        "invalid": validated.count(False),
+    }
+    for name, values in (("e2e", e2e), ("ttft", ttft), ("itl", itl)):
+        for p in (50, 95, 99):
+            summary[f"{name}_p{p}"] = percentile(values, p)
+        summary[f"{name}_mean"] = statistics.fmean(values) if values else None
+    return summary
+
+
+def fmt(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value * 1000:.1f} ms" if value < 60 else f"{value:.1f}"
+    return str(value)
+
+
+def print_summary(s: Dict[str, Any]):
+    print(f"\n📊 {s['requests']} requisições | {s['ok']} ok | erros: {s['errors'] or 0} "
+          f"({s['error_rate']:.1%})")
+    print(f"   vazão: {s['throughput_rps']:.2f} req/s | {s['output_tokens_per_s']:.1f} tokens/s "
+          f"| validadas: {s['validated']} (inválidas: {s['invalid']})")
+    print(f"   {'':6} {'p50':>12} {'p95':>12} {'p99':>12}")
+    for name in ("e2e", "ttft", "itl"):
+        print(f"   {name:6} " + " ".join(f"{fmt(s[f'{name}_p{p}']):>12}" for p in (50, 95, 99)))
+
+
+# ------------------------------------------------------------------ #
+# Comparação entre execuções
+# ------------------------------------------------------------------ #
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    with open(base_path) as f:
+        base = json.load(f)["summary"]
+    with open(new_path) as f:
+        new = json.load(f)["summary"]
+
+    regressions = 0
+    print(f"{'métrica':22} {'base':>12} {'nova':>12} {'Δ':>8}")
+    for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER + ["error_rate"]:
+        b, n = base.get(metric), new.get(metric)
+        if b is None or n is None:
+            continue
+        delta = (n - b) / b if b else 0.0
+        if metric == "error_rate":
+            bad = n > b + 0.01
+        elif metric in LOWER_IS_BETTER:
+            bad = delta > threshold
+        else:
+            bad = delta < -threshold
+        regressions += bad
+        mark = "❌ REGRESSÃO" if bad else ""
+        print(f"{metric:22} {b:12.4f} {n:12.4f} {delta:+8.1%} {mark}")
+
+    if regressions:
+        print(f"\n⚠️  {regressions} métrica(s) pioraram mais de {threshold:.0%}")
+        return 1
+    print("\n✅ Nenhuma regressão")
+    return 0
+
+
+# ------------------------------------------------------------------ #
+# Execução
+# ------------------------------------------------------------------ #
+async def run(args) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency if args.mode == "closed" else None,
+                          max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout, connect=10)
+    tester = ProxyTester(args.url)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout,
+                                 http2=args.http2) as client:
+        if args.warmup:
+            rnd = random.Random(-1)
+            await asyncio.gather(*(one_request(client, args, rnd, tester)
+                                   for _ in range(args.warmup)))
+        began = time.perf_counter()
+        loop = closed_loop if args.mode == "closed" else open_loop
+        results = await loop(client, args, tester)
+        wall = time.perf_counter() - began
+
+    summary = summarize(results, wall)
+    config = {k: v for k, v in vars(args).items() if k not in ("prompt_size", "compare")}
+    return {"config": config, "summary": summary, "results": results}
+
+
+def write_outputs(args, report: Dict[str, Any]):
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": report["config"], "summary": report["summary"]}, f, indent=2)
+        print(f"💾 Resumo salvo em {args.output}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            columns = ["start", "stream", "prompt_tokens", "status", "error", "e2e",
+                       "ttft", "completion_tokens", "valid", "itl_mean"]
+            writer.writerow(columns)
+            for r in report["results"]:
+                row = asdict(r)
+                row["itl_mean"] = statistics.fmean(r.itl) if r.itl else None
+                writer.writerow([row[c] for c in columns])
+        print(f"💾 Requisições salvas em {args.csv}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark do proxy Gemini-OpenAI")
+    parser.add_argument("--url", default="http://localhost:11434")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: N clientes concorrentes; open: chegadas Poisson")
+    parser.add_argument("--concurrency", type=int, default=8, help="clientes (modo closed)")
+    parser.add_argument("--rate", type=float, default=5.0, help="req/s (modo open)")
+    parser.add_argument("--requests", type=int, default=100, help="total de requisições")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="segundos de carga (substitui --requests)")
+    parser.add_argument("--stream-ratio", type=float, default=0.5,
+                        help="fração de requisições com stream")
+    parser.add_argument("--prompt-dist", dest="prompt_size", type=parse_dist,
+                        default=parse_dist("fixed:50"),
+                        help="fixed:N | uniform:A-B | choice:a,b,c (tokens)")
+    parser.add_argument("--same-prompt", action="store_true",
+                        help="não tornar os prompts únicos (exercita cache/coalescência)")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--validate-rate", type=float, default=0.1,
+                        help="fração de respostas validadas com ProxyTester")
+    parser.add_argument("--warmup", type=int, default=0, help="requisições de aquecimento")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--http2", action="store_true", help="usar HTTP/2 (requer h2)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="arquivo JSON com configuração e resumo")
+    parser.add_argument("--csv", help="arquivo CSV com uma linha por requisição")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NOVA"),
+                        help="comparar dois resumos JSON e sinalizar regressões")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="piora relativa tolerada no modo --compare")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    print(f"🚀 Benchmark em {args.url} | modo {args.mode} | "
+          + (f"{args.concurrency} clientes" if args.mode == "closed" else f"{args.rate} req/s"))
+    report = asyncio.run(run(args))
+    print_summary(report["summary"])
+    write_outputs(args, report)
+    sys.exit(1 if report["summary"]["ok"] == 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
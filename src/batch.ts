@@ -0,0 +1,673 @@
+// src/batch.ts
+/* ------------------------------------------------------------------ */
+/*  OpenAI Batch API (/v1/files + /v1/batches) – local JSONL runner   */
+/* ------------------------------------------------------------------ */
+import http from 'http';
+import { randomBytes } from 'crypto';
+import { createReadStream, mkdirSync } from 'fs';
+import fs from 'fs/promises';
+import path from 'path';
+import { readBody } from './body';
+import { sendJSON } from './transport';
+import { errorStatus, isRetryable, retryDelayMs, sleep } from './retry';
+import { publish, subscribe } from './cluster';
+import { count } from './stats';
+import { log } from './logger';
+
+const BATCH_DIR = path.resolve(process.env.BATCH_DIR ?? 'batches');
+const CONCURRENCY = Math.max(1, Number(process.env.BATCH_CONCURRENCY ?? 4));
+const RPM = Number(process.env.BATCH_RPM ?? 0);                  // 0 = unpaced
+const MAX_ATTEMPTS = Number(process.env.BATCH_MAX_ATTEMPTS ?? 8); // per request, on 429/5xx
+const MAX_FILE_BYTES = Number(process.env.BATCH_MAX_FILE_BYTES ?? 200 * 1024 * 1024);
+const MAX_REQUESTS = Number(process.env.BATCH_MAX_REQUESTS ?? 50_000);
+const CHECKPOINT_MS = 1_000;
+const HEARTBEAT_MS = 5_000;          // owners touch their lock files this often
+const STALE_LOCK_MS = 15_000;        // …and a lock untouched for this long is orphaned
+const ENDPOINTS = ['/v1/chat/completions'];
+
+const FILES_DIR = path.join(BATCH_DIR, 'files');
+const JOBS_DIR = path.join(BATCH_DIR, 'batches');
+
+export class BatchApiError extends Error {
+  constructor(public status: number, message: string) {
+    super(message);
+  }
+}
+
+const now = () => Math.floor(Date.now() / 1000);
+const newId = (prefix: string) => `${prefix}${randomBytes(12).toString('hex')}`;
+
+/* ------------------------------------------------------------------ */
+/* 1.  Files                                                           */
+/* ------------------------------------------------------------------ */
+interface FileObject {
+  id: string;
+  object: 'file';
+  bytes: number;
+  created_at: number;
+  filename: string;
+  purpose: string;
+}
+
+const contentPath = (id: string) => path.join(FILES_DIR, `${id}.jsonl`);
+const metaPath = (id: string) => path.join(FILES_DIR, `${id}.json`);
+
+// ids end up in paths, so only accept the shapes we hand out
+const validId = (id: string) => /^[\w-]+$/.test(id);
+
+/** Write to a temp file and rename, so readers never see half a file. */
+async function writeAtomic(file: string, data: string) {
+  const tmp = `${file}.${process.pid}.tmp`;
+  await fs.writeFile(tmp, data);
+  await fs.rename(tmp, file);
+}
+
+async function readJSONFile<T>(file: string): Promise<T | undefined> {
+  try {
+    return JSON.parse(await fs.readFile(file, 'utf8'));
+  } catch (err: any) {
+    if (err.code === 'ENOENT') return undefined;
+    throw err;
+  }
+}
+
+async function getFile(id: string): Promise<FileObject> {
+  const file = validId(id) ? await readJSONFile<FileObject>(metaPath(id)) : undefined;
+  if (!file) throw new BatchApiError(404, `No such file: ${id}`);
+  return file;
+}
+
+async function publishFile(id: string, filename: string, purpose: string) {
+  const { size } = await fs.stat(contentPath(id));
+  const file: FileObject = { id, object: 'file', bytes: size, created_at: now(), filename, purpose };
+  await writeAtomic(metaPath(id), JSON.stringify(file));
+  return file;
+}
+
+/**
+ * The `file` and `purpose` fields of a multipart/form-data upload. Good
+ * enough for what SDKs send; not a general multipart parser.
+ */
+function parseMultipart(raw: Buffer, contentType: string) {
+  const m = /boundary=(?:"([^"]+)"|([^;]+))/i.exec(contentType);
+  if (!m) throw new BatchApiError(400, 'Missing multipart boundary');
+  const delimiter = Buffer.from(`--${m[1] ?? m[2]}`);
+  const fields: Record<string, { filename?: string; data: Buffer }> = {};
+
+  let start = raw.indexOf(delimiter);
+  while (start !== -1) {
+    start += delimiter.length;
+    if (raw[start] === 0x2d && raw[start + 1] === 0x2d) break;     // closing "--"
+    const next = raw.indexOf(delimiter, start);
+    if (next === -1) break;
+    const part = raw.subarray(start + 2, next - 2);                // CRLF on both sides
+    const headerEnd = part.indexOf('\r\n\r\n');
+    const headers = part.subarray(0, headerEnd).toString('utf8');
+    const name = /\bname="([^"]*)"/i.exec(headers)?.[1];
+    if (name) {
+      fields[name] = {
+        filename: /\bfilename="([^"]*)"/i.exec(headers)?.[1],
+        data: part.subarray(headerEnd + 4),
+      };
+    }
+    start = next;
+  }
+  return fields;
+}
+
+/** multipart/form-data like the OpenAI SDKs, or a raw JSONL body with ?purpose= */
+async function uploadFile(req: http.IncomingMessage, url: URL) {
+  const raw = await readBody(req, MAX_FILE_BYTES);
+  const type = String(req.headers['content-type'] ?? '');
+  let data = raw;
+  let purpose = url.searchParams.get('purpose') ?? 'batch';
+  let filename = url.searchParams.get('filename') ?? 'upload.jsonl';
+  if (/^multipart\/form-data/i.test(type)) {
+    const fields = parseMultipart(raw, type);
+    if (!fields.file) throw new BatchApiError(400, "Missing 'file' field");
+    data = fields.file.data;
+    filename = fields.file.filename ?? filename;
+    purpose = fields.purpose?.data.toString('utf8').trim() ?? purpose;
+  }
+  if (purpose !== 'batch') throw new BatchApiError(400, `Unsupported purpose: ${purpose}`);
+
+  const id = newId('file-');
+  await fs.writeFile(contentPath(id), data);
+  return publishFile(id, filename, purpose);
+}
+
+async function listFiles(): Promise<FileObject[]> {
+  const names = await fs.readdir(FILES_DIR);
+  const files = await Promise.all(
+    names.filter((n) => n.endsWith('.json')).map((n) => readJSONFile<FileObject>(path.join(FILES_DIR, n))),
+  );
+  return files.filter((f): f is FileObject => !!f).sort((a, b) => b.created_at - a.created_at);
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Batch objects                                                   */
+/* ------------------------------------------------------------------ */
+type BatchStatus =
+  | 'validating' | 'failed' | 'in_progress' | 'finalizing'
+  | 'completed' | 'expired' | 'cancelling' | 'cancelled';
+
+interface Batch {
+  id: string;
+  object: 'batch';
+  endpoint: string;
+  errors: { object: 'list'; data: { code: string; message: string; line?: number }[] } | null;
+  input_file_id: string;
+  completion_window: string;
+  status: BatchStatus;
+  output_file_id: string | null;
+  error_file_id: string | null;
+  created_at: number;
+  in_progress_at: number | null;
+  expires_at: number;
+  finalizing_at: number | null;
+  completed_at: number | null;
+  failed_at: number | null;
+  expired_at: number | null;
+  cancelling_at: number | null;
+  cancelled_at: number | null;
+  request_counts: { total: number; completed: number; failed: number };
+  metadata: Record<string, string> | null;
+}
+
+interface BatchLine {
+  custom_id: string;
+  method: string;
+  url: string;
+  body: any;
+}
+
+/** A batch this process is running; everything on disk is in `batch`. */
+interface Job {
+  batch: Batch;
+  controller: AbortController;
+  saving: Promise<void>;
+  savedAt: number;
+}
+
+const jobs = new Map<string, Job>();
+const jobPath = (id: string) => path.join(JOBS_DIR, `${id}.json`);
+const lockPath = (id: string) => path.join(JOBS_DIR, `${id}.lock`);
+const UNFINISHED: BatchStatus[] = ['validating', 'in_progress', 'finalizing', 'cancelling'];
+
+/** Checkpoints are serialised per job and written at most once per CHECKPOINT_MS. */
+function save(job: Job, force = false) {
+  if (!force && Date.now() - job.savedAt < CHECKPOINT_MS) return job.saving;
+  job.savedAt = Date.now();
+  const snapshot = JSON.stringify(job.batch);
+  job.saving = job.saving
+    .then(() => writeAtomic(jobPath(job.batch.id), snapshot))
+    .catch((err) => log.error('Batch checkpoint failed', { err, batch: job.batch.id }));
+  return job.saving;
+}
+
+async function getBatch(id: string): Promise<Batch> {
+  // batches run by another worker are read from their last checkpoint
+  const batch = jobs.get(id)?.batch ?? (validId(id) ? await readJSONFile<Batch>(jobPath(id)) : undefined);
+  if (!batch) throw new BatchApiError(404, `No such batch: ${id}`);
+  return batch;
+}
+
+async function listBatches(): Promise<Batch[]> {
+  const names = await fs.readdir(JOBS_DIR);
+  const batches = await Promise.all(
+    names.filter((n) => n.endsWith('.json')).map((n) => getBatch(n.slice(0, -5)).catch(() => undefined)),
+  );
+  return batches.filter((b): b is Batch => !!b).sort((a, b) => b.created_at - a.created_at);
+}
+
+/** Parse and check every line up front, like upstream's "validating" step. */
+async function readLines(fileId: string) {
+  const text = await fs.readFile(contentPath(fileId), 'utf8');
+  const lines: BatchLine[] = [];
+  const errors: { code: string; message: string; line: number }[] = [];
+  const ids = new Set<string>();
+  text.split('\n').forEach((raw, i) => {
+    if (!raw.trim() || errors.length >= 100) return;
+    const line = i + 1;
+    let item: BatchLine;
+    try {
+      item = JSON.parse(raw);
+    } catch {
+      errors.push({ code: 'invalid_json_line', message: 'Line is not valid JSON', line });
+      return;
+    }
+    if (typeof item.custom_id !== 'string' || ids.has(item.custom_id)) {
+      errors.push({ code: 'invalid_custom_id', message: 'custom_id must be a unique string', line });
+    } else if (item.method !== 'POST' || !ENDPOINTS.includes(item.url)) {
+      errors.push({ code: 'invalid_url', message: `Only POST ${ENDPOINTS.join(', ')} is supported`, line });
+    } else if (!item.body || typeof item.body !== 'object') {
+      errors.push({ code: 'missing_body', message: 'Request body must be an object', line });
+    } else {
+      ids.add(item.custom_id);
+      lines.push(item);
+    }
+  });
+  if (lines.length > MAX_REQUESTS) {
+    errors.push({ code: 'too_many_requests', message: `At most ${MAX_REQUESTS} requests per batch`, line: 0 });
+  }
+  return { lines, errors };
+}
+
+async function createBatch(body: any): Promise<Batch> {
+  const endpoint = body.endpoint ?? '/v1/chat/completions';
+  if (!ENDPOINTS.includes(endpoint)) throw new BatchApiError(400, `Unsupported endpoint: ${endpoint}`);
+  const window = /^(\d+)h$/.exec(body.completion_window ?? '24h');
+  if (!window) throw new BatchApiError(400, 'completion_window must look like "24h"');
+  const input = await getFile(String(body.input_file_id ?? ''));
+
+  const created = now();
+  const batch: Batch = {
+    id: newId('batch_'),
+    object: 'batch',
+    endpoint,
+    errors: null,
+    input_file_id: input.id,
+    completion_window: window[0],
+    status: 'validating',
+    output_file_id: newId('file-'),
+    error_file_id: newId('file-'),
+    created_at: created,
+    in_progress_at: null,
+    expires_at: created + Number(window[1]) * 3600,
+    finalizing_at: null,
+    completed_at: null,
+    failed_at: null,
+    expired_at: null,
+    cancelling_at: null,
+    cancelled_at: null,
+    request_counts: { total: 0, completed: 0, failed: 0 },
+    metadata: body.metadata ?? null,
+  };
+
+  const { lines, errors } = await readLines(input.id);
+  batch.request_counts.total = lines.length;
+  if (errors.length || !lines.length) {
+    if (!lines.length && !errors.length) {
+      errors.push({ code: 'empty_file', message: 'The input file has no requests', line: 0 });
+    }
+    Object.assign(batch, {
+      status: 'failed', failed_at: now(), output_file_id: null, error_file_id: null,
+      errors: { object: 'list', data: errors },
+    });
+    await writeAtomic(jobPath(batch.id), JSON.stringify(batch));
+    return batch;
+  }
+
+  // lock first: another worker's resume() scan may see the job file as
+  // soon as it exists, and must find it already owned
+  const owned = await claim(batch.id);
+  await writeAtomic(jobPath(batch.id), JSON.stringify(batch));
+  if (owned) enqueue(batch);
+  return batch;
+}
+
+function cancelBatch(id: string) {
+  const job = jobs.get(id);
+  if (!job || !UNFINISHED.includes(job.batch.status)) return false;
+  job.batch.status = 'cancelling';
+  job.batch.cancelling_at = now();
+  job.controller.abort();
+  save(job, true);
+  return true;
+}
+
+// cancellation reaches the worker that owns the batch
+subscribe('batch-cancel', ({ id }) => cancelBatch(id));
+
+/* ------------------------------------------------------------------ */
+/* 3.  Ownership – one process runs each batch, restarts resume it     */
+/* ------------------------------------------------------------------ */
+// A pid alone cannot tell a dead owner apart: after a container restart
+// the new process often gets the old pid. Owners keep their lock fresh.
+async function stale(id: string) {
+  try {
+    const [pid, { mtimeMs }] = await Promise.all([
+      fs.readFile(lockPath(id), 'utf8'),
+      fs.stat(lockPath(id)),
+    ]);
+    return Number(pid) === process.pid || Date.now() - mtimeMs > STALE_LOCK_MS;
+  } catch {
+    return true;
+  }
+}
+
+/** Take the batch's lock file unless a live process already holds it. */
+async function claim(id: string): Promise<boolean> {
+  try {
+    await fs.writeFile(lockPath(id), String(process.pid), { flag: 'wx' });
+    return true;
+  } catch (err: any) {
+    if (err.code !== 'EEXIST') throw err;
+  }
+  return (await stale(id)) && takeOver(id);
+}
+
+/**
+ * Replace an orphaned lock. Creating the `.takeover` directory is atomic,
+ * so only one process at a time re-checks the lock and renames its own
+ * over it; without it two workers could each delete the other's new lock.
+ */
+async function takeOver(id: string): Promise<boolean> {
+  const guard = `${lockPath(id)}.takeover`;
+  try {
+    await fs.mkdir(guard);
+  } catch (err: any) {
+    if (err.code !== 'EEXIST') throw err;
+    // a process that died mid-takeover leaves its guard behind
+    const { mtimeMs } = await fs.stat(guard).catch(() => ({ mtimeMs: Date.now() }));
+    if (Date.now() - mtimeMs > STALE_LOCK_MS) await fs.rm(guard, { recursive: true, force: true });
+    return false;
+  }
+  try {
+    if (!(await stale(id))) return false;   // someone else took it meanwhile
+    const tmp = `${lockPath(id)}.${process.pid}.tmp`;
+    await fs.writeFile(tmp, String(process.pid));
+    await fs.rename(tmp, lockPath(id));
+    return true;
+  } finally {
+    await fs.rmdir(guard).catch(() => undefined);
+  }
+}
+
+/** Keep our locks fresh and adopt batches whose owner went away. */
+async function heartbeat() {
+  const at = new Date();
+  for (const id of jobs.keys()) await fs.utimes(lockPath(id), at, at).catch(() => undefined);
+  await resume();
+}
+
+let scanning = false;
+
+async function resume() {
+  if (scanning) return;               // startup scan and heartbeat must not overlap
+  scanning = true;
+  try {
+    for (const batch of await listBatches()) {
+      if (!UNFINISHED.includes(batch.status) || jobs.has(batch.id)) continue;
+      if (!(await claim(batch.id))) continue;
+      log.info('Resuming batch', { batch: batch.id, status: batch.status, counts: batch.request_counts });
+      enqueue(batch);
+    }
+  } finally {
+    scanning = false;
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 4.  Runner                                                          */
+/* ------------------------------------------------------------------ */
+/** Maps, admits and sends one chat request; returns the completion body. */
+export type BatchRequestRunner = (body: any, signal: AbortSignal) => Promise<any>;
+
+let runRequest: BatchRequestRunner | undefined;
+const queue: Job[] = [];
+let draining = false;
+
+// shared by all workers of the runner: RPM spacing and 429 back-off
+let nextSlot = 0;
+let pausedUntil = 0;
+
+function enqueue(batch: Batch) {
+  const job: Job = { batch, controller: new AbortController(), saving: Promise.resolve(), savedAt: 0 };
+  jobs.set(batch.id, job);
+  queue.push(job);
+  if (batch.status === 'cancelling') job.controller.abort();
+  drain();
+}
+
+// batches run one after another, each with BATCH_CONCURRENCY requests in flight
+async function drain() {
+  if (draining || !runRequest) return;
+  draining = true;
+  while (queue.length) {
+    const job = queue.shift()!;
+    try {
+      await runJob(job);
+    } catch (err) {
+      log.error('Batch failed', { err, batch: job.batch.id });
+      Object.assign(job.batch, {
+        status: 'failed', failed_at: now(),
+        errors: { object: 'list', data: [{ code: 'runner_error', message: String((err as any)?.message) }] },
+      });
+    }
+    await save(job, true);
+    await fs.rm(lockPath(job.batch.id), { force: true });
+    jobs.delete(job.batch.id);
+  }
+  draining = false;
+}
+
+/** Wait for the next RPM slot and for any back-off after a 429. */
+async function pace(signal: AbortSignal) {
+  for (;;) {
+    const wait = Math.max(pausedUntil, nextSlot) - Date.now();
+    if (wait <= 0) break;
+    await sleep(wait, signal);
+  }
+  if (RPM > 0) nextSlot = Math.max(Date.now(), nextSlot) + 60_000 / RPM;
+}
+
+/**
+ * Append-only result log. Lines written before a crash are kept; a torn
+ * last line is dropped, and its request simply runs again.
+ */
+async function openLog(id: string) {
+  const file = contentPath(id);
+  const ids = new Set<string>();
+  const kept: string[] = [];
+  let torn = false;
+  const text = await fs.readFile(file, 'utf8').catch(() => '');
+  for (const raw of text.split('\n')) {
+    if (!raw) continue;
+    try {
+      ids.add(JSON.parse(raw).custom_id);
+      kept.push(raw);
+    } catch {
+      torn = true;
+    }
+  }
+  if (torn) await fs.writeFile(file, kept.map((l) => `${l}\n`).join(''));
+  const handle = await fs.open(file, 'a');
+  return {
+    ids,
+    write: (entry: object) => handle.write(`${JSON.stringify(entry)}\n`),
+    close: () => handle.close(),
+  };
+}
+
+async function runJob(job: Job) {
+  const { batch } = job;
+  const signal = job.controller.signal;
+  const { lines } = await readLines(batch.input_file_id);
+  const output = await openLog(batch.output_file_id!);
+  const errors = await openLog(batch.error_file_id!);
+
+  // what is already in the result logs is done, whatever the checkpoint said
+  const pending = lines.filter((l) => !output.ids.has(l.custom_id) && !errors.ids.has(l.custom_id));
+  batch.request_counts = { total: lines.length, completed: output.ids.size, failed: errors.ids.size };
+  if (batch.status === 'validating') {
+    batch.status = 'in_progress';
+    batch.in_progress_at = now();
+  }
+  await save(job, true);
+
+  const attempts = new Map<string, number>();
+  const failed = (item: BatchLine, status: number, message: string) => {
+    batch.request_counts.failed++;
+    count('batch_requests_failed');
+    return errors.write({
+      id: newId('batch_req_'),
+      custom_id: item.custom_id,
+      response: { status_code: status, request_id: newId('req_'), body: { error: { message } } },
+      error: null,
+    });
+  };
+
+  const worker = async () => {
+    while (pending.length && !signal.aborted && now() < batch.expires_at) {
+      await pace(signal).catch(() => undefined);
+      const item = pending.shift();
+      if (!item || signal.aborted) break;
+      try {
+        const body = await runRequest!(item.body, signal);
+        await output.write({
+          id: newId('batch_req_'),
+          custom_id: item.custom_id,
+          response: { status_code: 200, request_id: newId('req_'), body },
+          error: null,
+        });
+        batch.request_counts.completed++;
+        count('batch_requests_completed');
+      } catch (err: any) {
+        if (signal.aborted) break;           // not logged, so a resume would redo it
+        const tries = (attempts.get(item.custom_id) ?? 0) + 1;
+        if (isRetryable(err) && tries < MAX_ATTEMPTS) {
+          // quota or overload: back the whole runner off, then try again later
+          attempts.set(item.custom_id, tries);
+          pending.push(item);
+          pausedUntil = Math.max(pausedUntil, Date.now() + (retryDelayMs(err) ?? 1_000 * 2 ** Math.min(tries, 6)));
+          count('batch_backoffs');
+          continue;
+        }
+        await failed(item, errorStatus(err) ?? 500, err.message);
+      }
+      save(job);
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(CONCURRENCY, pending.length) }, worker));
+
+  if (signal.aborted) {
+    batch.status = 'cancelled';
+    batch.cancelled_at = now();
+  } else if (pending.length) {
+    for (const item of pending) await failed(item, 408, 'The batch expired before this request ran');
+    batch.status = 'expired';
+    batch.expired_at = now();
+  } else {
+    batch.status = 'finalizing';
+    batch.finalizing_at = now();
+    await save(job, true);
+  }
+  await output.close();
+  await errors.close();
+
+  // results become downloadable files; an empty log has no file
+  for (const key of ['output_file_id', 'error_file_id'] as const) {
+    const id = batch[key]!;
+    const { size } = await fs.stat(contentPath(id));
+    if (size) await publishFile(id, `${batch.id}_${key.replace('_file_id', '')}.jsonl`, 'batch_output');
+    else {
+      await fs.rm(contentPath(id), { force: true });
+      batch[key] = null;
+    }
+  }
+  if (batch.status === 'finalizing') {
+    batch.status = 'completed';
+    batch.completed_at = now();
+  }
+  log.info('Batch finished', { batch: batch.id, status: batch.status, counts: batch.request_counts });
+}
+
+/**
+ * Start running batches (new ones and unfinished ones from before a
+ * restart). Called once the server listens, from each serving process.
+ */
+export function startBatchRunner(run: BatchRequestRunner) {
+  mkdirSync(FILES_DIR, { recursive: true });
+  mkdirSync(JOBS_DIR, { recursive: true });
+  runRequest = run;
+  resume().catch((err) => log.error('Resuming batches failed', { err }));
+  setInterval(() => {
+    heartbeat().catch((err) => log.error('Batch heartbeat failed', { err }));
+  }, HEARTBEAT_MS).unref();
+}
+
+export function batchStatus() {
+  const running = [...jobs.values()].map((j) => ({ id: j.batch.id, ...j.batch.request_counts }));
+  return { queued: queue.length, running, paused_ms: Math.max(0, pausedUntil - Date.now()) };
+}
+
+/* ------------------------------------------------------------------ */
+/* 5.  Routes                                                          */
+/* ------------------------------------------------------------------ */
+async function readJSONBody(req: http.IncomingMessage) {
+  const raw = await readBody(req);
+  try {
+    return raw.length ? JSON.parse(raw.toString('utf8')) : {};
+  } catch {
+    throw new BatchApiError(400, 'Malformed JSON body');
+  }
+}
+
+function page<T extends { id: string }>(items: T[], url: URL) {
+  const limit = Math.min(100, Number(url.searchParams.get('limit') ?? 20) || 20);
+  const after = url.searchParams.get('after');
+  const start = after ? items.findIndex((i) => i.id === after) + 1 : 0;
+  const data = items.slice(start, start + limit);
+  return {
+    object: 'list',
+    data,
+    first_id: data[0]?.id ?? null,
+    last_id: data[data.length - 1]?.id ?? null,
+    has_more: start + limit < items.length,
+  };
+}
+
+async function route(req: http.IncomingMessage, res: http.ServerResponse, url: URL) {
+  const [, , kind, id, action] = url.pathname.split('/');      // '', 'v1', kind, id?, action?
+  const method = req.method;
+  const reply = (json: unknown) => sendJSON(req, res, 200, JSON.stringify(json));
+
+  if (kind === 'files') {
+    if (!id && method === 'POST') return reply(await uploadFile(req, url));
+    if (!id && method === 'GET') return reply(page(await listFiles(), url));
+    if (id && !action && method === 'GET') return reply(await getFile(id));
+    if (id && action === 'content' && method === 'GET') {
+      const file = await getFile(id);
+      res.writeHead(200, { 'Content-Type': 'application/octet-stream', 'Content-Length': file.bytes });
+      createReadStream(contentPath(id)).pipe(res);
+      return;
+    }
+    if (id && !action && method === 'DELETE') {
+      await getFile(id);
+      await fs.rm(metaPath(id), { force: true });
+      await fs.rm(contentPath(id), { force: true });
+      return reply({ id, object: 'file', deleted: true });
+    }
+  }
+
+  if (kind === 'batches') {
+    if (!id && method === 'POST') return reply(await createBatch(await readJSONBody(req)));
+    if (!id && method === 'GET') return reply(page(await listBatches(), url));
+    if (id && !action && method === 'GET') return reply(await getBatch(id));
+    if (id && action === 'cancel' && method === 'POST') {
+      const batch = await getBatch(id);
+      if (!UNFINISHED.includes(batch.status)) {
+        throw new BatchApiError(409, `Batch ${id} is already ${batch.status}`);
+      }
+      if (!cancelBatch(id)) publish('batch-cancel', { id });
+      return reply({ ...(await getBatch(id)), status: 'cancelling' });
+    }
+  }
+
+  throw new BatchApiError(404, `Unknown route: ${method} ${url.pathname}`);
+}
+
+/** Serve /v1/files… and /v1/batches…; errors become OpenAI-style JSON. */
+export async function handleBatchApi(req: http.IncomingMessage, res: http.ServerResponse) {
+  try {
+    await route(req, res, new URL(req.url ?? '/', 'http://localhost'));
+  } catch (err: any) {
+    const status = errorStatus(err) ?? 500;
+    if (status >= 500) log.error('Batch API error', { err });
+    if (!res.headersSent) {
+      res.writeHead(status, { 'Content-Type': 'application/json' });
+      res.end(JSON.stringify({ error: { message: err.message } }));
+    }
+  }
+}
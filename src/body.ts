@@ -0,0 +1,121 @@
+// src/body.ts
+/* ------------------------------------------------------------------ */
+/*  Request body reader – size-limited, Buffer-based, decompressing   */
+/* ------------------------------------------------------------------ */
+import http from 'http';
+import zlib from 'zlib';
+import { Readable } from 'stream';
+
+const MAX_BODY_BYTES = Number(process.env.MAX_BODY_BYTES ?? 50 * 1024 * 1024);
+
+export class BodyError extends Error {
+  constructor(public status: number, message: string) {
+    super(message);
+  }
+}
+
+/** Wrap `req` in a decompressor matching its Content-Encoding. */
+function decoded(req: http.IncomingMessage, encoding: string): Readable {
+  switch (encoding) {
+  case 'identity':
+    return req;
+  case 'gzip':
+  case 'x-gzip':
+    return req.pipe(zlib.createGunzip());
+  case 'deflate':
+    return req.pipe(zlib.createInflate());
+  case 'br':
+    return req.pipe(zlib.createBrotliDecompress());
+  case 'zstd': {
+    // only in recent Node releases
+    const createZstd = (zlib as any).createZstdDecompress;
+    if (typeof createZstd === 'function') return req.pipe(createZstd());
+    break;
+  }
+  }
+  throw new BodyError(415, `Unsupported Content-Encoding: ${encoding}`);
+}
+
+/**
+ * Read the whole body into one Buffer. The limit applies to the decoded
+ * size, so a small gzip bomb is rejected as early as a huge plain body.
+ */
+export function readBody(
+  req: http.IncomingMessage,
+  maxBytes = MAX_BODY_BYTES,
+): Promise<Buffer> {
+  const encoding = String(req.headers['content-encoding'] ?? 'identity').trim().toLowerCase();
+  const declared = Number(req.headers['content-length']);
+  const known = encoding === 'identity' && Number.isFinite(declared);
+
+  if (known && declared > maxBytes) {
+    return Promise.reject(new BodyError(413, `Request body exceeds ${maxBytes} bytes`));
+  }
+
+  return new Promise((resolve, reject) => {
+    let source: Readable;
+    try {
+      source = decoded(req, encoding);
+    } catch (err) {
+      return reject(err);
+    }
+
+    // with a known length the bytes land in one allocation, no concat
+    const target = known ? Buffer.allocUnsafe(declared) : undefined;
+    const chunks: Buffer[] = [];
+    let size = 0;
+    let failed = false;
+
+    const fail = (err: BodyError) => {
+      if (failed) return;
+      failed = true;
+      if (source !== req) source.destroy();
+      req.unpipe();
+      reject(err);
+    };
+
+    source.on('data', (chunk: Buffer) => {
+      if (failed) return;
+      if (size + chunk.length > maxBytes) {
+        return fail(new BodyError(413, `Request body exceeds ${maxBytes} bytes`));
+      }
+      if (target && size + chunk.length <= target.length) chunk.copy(target, size);
+      else chunks.push(chunk);
+      size += chunk.length;
+    });
+    source.on('error', () => fail(new BodyError(400, `Malformed ${encoding} request body`)));
+    req.on('aborted', () => fail(new BodyError(400, 'Request body aborted')));
+    source.on('end', () => {
+      if (failed) return;
+      resolve(target && !chunks.length ? target.subarray(0, size) : Buffer.concat(chunks, size));
+    });
+  });
+}
+
+/** Parse a JSON body; on failure answer the request and resolve null. */
+export async function readJSON(
+  req: http.IncomingMessage,
+  res: http.ServerResponse,
+): Promise<any | null> {
+  let raw: Buffer;
+  try {
+    raw = await readBody(req);
+  } catch (err: any) {
+    const status = err instanceof BodyError ? err.status : 400;
+    if (status === 413) {
+      // stop reading the rest of an oversized upload
+      if (req.httpVersionMajor < 2) res.setHeader('Connection', 'close');
+      res.on('finish', () => req.destroy());
+    }
+    res.writeHead(status, { 'Content-Type': 'application/json' });
+    res.end(JSON.stringify({ error: { message: err.message } }));
+    return null;
+  }
+
+  try {
+    return raw.length ? JSON.parse(raw.toString('utf8')) : {};
+  } catch {
+    res.writeHead(400).end(); // malformed JSON
+    return null;
+  }
+}
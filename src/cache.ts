@@ -0,0 +1,99 @@
+// src/cache.ts
+/* ------------------------------------------------------------------ */
+/*  Bounded LRU cache with TTL + canonical request hashing            */
+/* ------------------------------------------------------------------ */
+import { createHash } from 'crypto';
+
+/* ------------------------------------------------------------------ */
+/* 1.  Canonical key                                                   */
+/* ------------------------------------------------------------------ */
+/** JSON with sorted object keys, so equal requests hash equally. */
+export function canonicalJSON(value: unknown): string {
+  if (value === null || typeof value !== 'object') {
+    return JSON.stringify(value) ?? 'null';
+  }
+  if (Array.isArray(value)) {
+    return `[${value.map(canonicalJSON).join(',')}]`;
+  }
+  const obj = value as Record<string, unknown>;
+  const keys = Object.keys(obj).filter((k) => obj[k] !== undefined).sort();
+  return `{${keys.map((k) => `${JSON.stringify(k)}:${canonicalJSON(obj[k])}`).join(',')}}`;
+}
+
+export function canonicalKey(value: unknown): string {
+  return createHash('sha256').update(canonicalJSON(value)).digest('hex');
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  LRU cache                                                       */
+/* ------------------------------------------------------------------ */
+export interface LruOptions {
+  maxEntries: number;
+  maxBytes: number;        // 0 = no byte bound
+  ttlMs: number;           // 0 = entries never expire
+}
+
+interface Entry<V> {
+  value: V;
+  size: number;
+  expires: number;
+}
+
+export class LruCache<V> {
+  private map = new Map<string, Entry<V>>();   // oldest first
+  private bytes = 0;
+
+  constructor(
+    private readonly opts: LruOptions,
+    private readonly onEvict?: (key: string, value: V) => void,
+  ) {}
+
+  get size() {
+    return this.map.size;
+  }
+
+  get byteSize() {
+    return this.bytes;
+  }
+
+  get(key: string): V | undefined {
+    const entry = this.map.get(key);
+    if (!entry) return undefined;
+    if (entry.expires && entry.expires <= Date.now()) {
+      this.remove(key, entry);
+      return undefined;
+    }
+    this.map.delete(key);          // move to the most-recent end
+    this.map.set(key, entry);
+    return entry.value;
+  }
+
+  set(key: string, value: V, size = 0, ttlMs = this.opts.ttlMs) {
+    if (this.opts.maxBytes && size > this.opts.maxBytes) return;
+    const old = this.map.get(key);
+    if (old) this.remove(key, old, false);
+    this.map.set(key, { value, size, expires: ttlMs ? Date.now() + ttlMs : 0 });
+    this.bytes += size;
+
+    for (const [k, e] of this.map) {
+      if (
+        this.map.size <= this.opts.maxEntries &&
+        (!this.opts.maxBytes || this.bytes <= this.opts.maxBytes)
+      ) {
+        break;
+      }
+      this.remove(k, e);
+    }
+  }
+
+  delete(key: string) {
+    const entry = this.map.get(key);
+    if (entry) this.remove(key, entry);
+  }
+
+  private remove(key: string, entry: Entry<V>, notify = true) {
+    this.map.delete(key);
+    this.bytes -= entry.size;
+    if (notify) this.onEvict?.(key, entry.value);
+  }
+}
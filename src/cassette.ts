@@ -0,0 +1,150 @@
+// src/cassette.ts
+/* ------------------------------------------------------------------ */
+/*  Record / replay of upstream exchanges (JSONL cassettes)           */
+/* ------------------------------------------------------------------ */
+import { createWriteStream, readFileSync, WriteStream } from 'fs';
+import { canonicalKey } from './cache';
+import { sleep } from './retry';
+import { log } from './logger';
+
+const RECORD_PATH = process.env.RECORD_CASSETTE || undefined;
+const REPLAY_PATH = process.env.REPLAY_CASSETTE || undefined;
+// 1 = original timing, 10 = ten times faster, 0 = no delays at all
+const SPEED = Number(process.env.REPLAY_SPEED ?? 1);
+
+export const recording = !!RECORD_PATH && !REPLAY_PATH;
+export const replaying = !!REPLAY_PATH;
+
+/** The replayed cassette has no exchange for this request. */
+export class CassetteMissError extends Error {
+  status = 404;
+  constructor(key: string) {
+    super(`No recorded upstream exchange for this request (cassette key ${key.slice(0, 12)})`);
+  }
+}
+
+/**
+ * One line of a cassette: the mapped request and what upstream answered,
+ * with `t` in ms since the call started (per chunk for streams).
+ */
+interface Exchange {
+  key: string;
+  model: string;
+  stream: boolean;
+  request: { contents: any[]; generationConfig: Record<string, unknown> };
+  response?: { t: number; data: any };
+  chunks?: { t: number; data: any }[];
+}
+
+/** Requests match on model, contents and config, streamed or not. */
+function keyOf(model: string, contents: any[], config: Record<string, unknown>, stream: boolean) {
+  return canonicalKey({ model, contents, config, stream });
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Record                                                          */
+/* ------------------------------------------------------------------ */
+let out: WriteStream | undefined;
+
+function append(exchange: Exchange) {
+  if (!out) {
+    out = createWriteStream(RECORD_PATH!, { flags: 'a' });
+    out.on('error', (err) => log.error('Cassette write failed', { err, path: RECORD_PATH }));
+    log.info(`Recording upstream exchanges to ${RECORD_PATH}`);
+  }
+  // GenerateContentResponse instances serialise to their plain fields
+  out.write(`${JSON.stringify(exchange)}\n`);
+}
+
+/**
+ * Start taping one call. Feed it every chunk (or the single response)
+ * and call end() once upstream finished; failed calls are never written.
+ */
+export function tape(model: string, contents: any[], config: Record<string, unknown>, stream: boolean) {
+  const started = Date.now();
+  const chunks: { t: number; data: any }[] = [];
+  return {
+    chunk(data: any) {
+      chunks.push({ t: Date.now() - started, data });
+    },
+    end() {
+      const exchange: Exchange = {
+        key: keyOf(model, contents, config, stream),
+        model,
+        stream,
+        request: { contents, generationConfig: config },
+      };
+      if (stream) exchange.chunks = chunks;
+      else exchange.response = chunks[0];
+      append(exchange);
+    },
+  };
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Replay                                                          */
+/* ------------------------------------------------------------------ */
+// key ➞ recorded exchanges; repeated requests cycle through them in order
+let library: Map<string, { exchanges: Exchange[]; next: number }> | undefined;
+
+function load() {
+  library = new Map();
+  let lines = 0;
+  for (const line of readFileSync(REPLAY_PATH!, 'utf8').split('\n')) {
+    if (!line.trim()) continue;
+    const exchange: Exchange = JSON.parse(line);
+    let slot = library.get(exchange.key);
+    if (!slot) library.set(exchange.key, (slot = { exchanges: [], next: 0 }));
+    slot.exchanges.push(exchange);
+    lines++;
+  }
+  log.info(`Replaying ${lines} upstream exchanges from ${REPLAY_PATH}`, {
+    requests: library.size,
+    speed: SPEED,
+  });
+  return library;
+}
+
+function lookup(model: string, contents: any[], config: Record<string, unknown>, stream: boolean) {
+  const key = keyOf(model, contents, config, stream);
+  const slot = (library ?? load()).get(key);
+  if (!slot) throw new CassetteMissError(key);
+  return slot.exchanges[slot.next++ % slot.exchanges.length];
+}
+
+function wait(ms: number, signal?: AbortSignal) {
+  return SPEED > 0 && ms > 0 ? sleep(ms / SPEED, signal) : Promise.resolve();
+}
+
+/** Recorded answer to a non-streaming call, after its recorded latency. */
+export async function replay(
+  model: string,
+  contents: any[],
+  config: Record<string, unknown>,
+  signal?: AbortSignal,
+) {
+  const exchange = lookup(model, contents, config, false);
+  await wait(exchange.response!.t, signal);
+  return exchange.response!.data;
+}
+
+/** Recorded chunk sequence of a streaming call, with its inter-chunk gaps. */
+export async function* replayStream(
+  model: string,
+  contents: any[],
+  config: Record<string, unknown>,
+  signal?: AbortSignal,
+) {
+  const exchange = lookup(model, contents, config, true);
+  let last = 0;
+  for (const { t, data } of exchange.chunks!) {
+    await wait(t - last, signal);
+    last = t;
+    yield data;
+  }
+}
+
+/** Load the cassette now, so a bad file fails at startup, not per request. */
+export function loadCassette() {
+  if (replaying && !library) load();
+}
@@ -1,86 +1,516 @@
 // src/chatwrapper.ts
-import {
-  AuthType,
-  createContentGeneratorConfig,
-  createContentGenerator,
-} from '@google/gemini-cli-core/dist/src/core/contentGenerator.js';
+import type { AuthType } from '@google/gemini-cli-core/dist/src/core/contentGenerator.js';
+import { DEFAULT_GEMINI_MODEL } from '@google/gemini-cli-core/dist/src/config/models.js';
+import { Credential, GeneratorPool, parseCredentials } from './pool';
+import { LatencyTracker, RetryOptions, errorStatus, hedged, withRetry } from './retry';
+import { log } from './logger';
+import { recordUsage, upstreamTtfbSeconds } from './metrics';
+import { publish, subscribe } from './cluster';
+import { withContextCache } from './contextcache';
+import { loadCassette, recording, replay, replayStream, replaying, tape } from './cassette';
 
 const authType = process.env.AUTH_TYPE ?? 'gemini-api-key';
-const authTypeEnum = authType as AuthType;
 
-console.log(`Auth type: ${authType}`);
+log.info(`Auth type: ${authType}`);
 
-const model = process.env.MODEL ?? undefined;
+const model = process.env.MODEL || undefined;
 
 if (model) {
-  console.log(`Model override: ${model}`);
+  log.info(`Model override: ${model}`);
 }
 
 /* ------------------------------------------------------------------ */
-/* 1.  Build the ContentGenerator exactly like the CLI does           */
+/* 1.  Model registry                                                  */
 /* ------------------------------------------------------------------ */
-let modelName: string;
-const generatorPromise = (async () => {
-  // Pass undefined for model so the helper falls back to DEFAULT_GEMINI_MODEL
-  const cfg = await createContentGeneratorConfig(
-    model, // let default model be used
-    authTypeEnum
+// Default model when the client sends none (or one we do not serve)
+const defaultModel = model ?? DEFAULT_GEMINI_MODEL;
+
+// Models clients may pick with `body.model`; generators are created lazily
+const models = [
+  ...new Set([
+    defaultModel,
+    ...(process.env.MODELS ?? 'gemini-2.5-pro,gemini-2.5-flash')
+      .split(',')
+      .map((m) => m.trim())
+      .filter(Boolean),
+  ]),
+];
+
+log.info(`Serving models: ${models.join(', ')}`);
+
+/** Map the client's `model` field onto one of the served models. */
+export function resolveModel(requested?: string): string {
+  if (!requested) return defaultModel;
+  if (models.includes(requested)) return requested;
+  // tolerate suffixed aliases such as "gemini-2.5-pro-latest"
+  const base = models.find((m) => requested.startsWith(`${m}-`));
+  return base ?? defaultModel;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Build the ContentGenerator exactly like the CLI does           */
+/* ------------------------------------------------------------------ */
+
+// gemini-cli-core reads the key / creds path from process.env, so
+// generators are created one at a time with that credential's env.
+let creation: Promise<unknown> = Promise.resolve();
+
+function withCredentialEnv<T>(cred: Credential, fn: () => Promise<T>): Promise<T> {
+  const run = async () => {
+    const saved = {
+      GEMINI_API_KEY: process.env.GEMINI_API_KEY,
+      GOOGLE_APPLICATION_CREDENTIALS: process.env.GOOGLE_APPLICATION_CREDENTIALS,
+    };
+    if (cred.apiKey) process.env.GEMINI_API_KEY = cred.apiKey;
+    if (cred.credsFile) process.env.GOOGLE_APPLICATION_CREDENTIALS = cred.credsFile;
+    try {
+      return await fn();
+    } finally {
+      for (const [k, v] of Object.entries(saved)) {
+        if (v === undefined) delete process.env[k];
+        else process.env[k] = v;
+      }
+    }
+  };
+  const result = creation.then(run, run);
+  creation = result.catch(() => undefined);
+  return result;
+}
+
+async function createGenerator(cred: Credential, modelName: string) {
+  // offline fake backend for tests and benchmarks
+  if (cred.authType === 'mock') {
+    const { MockGenerator } = await import('./mockgen');
+    return new MockGenerator(modelName);
+  }
+  // the generator stack is most of gemini-cli-core: load it on first use,
+  // not at import time, so the process starts listening quickly
+  const { createContentGeneratorConfig, createContentGenerator } = await import(
+    '@google/gemini-cli-core/dist/src/core/contentGenerator.js'
   );
-  modelName = cfg.model;           // remember the actual model string
-  console.log(`Gemini CLI returned model: ${modelName}`);
+  return withCredentialEnv(cred, async () => {
+    const cfg = await createContentGeneratorConfig(
+      modelName,
+      cred.authType as AuthType,
+    );
+    log.info(`Gemini CLI returned model: ${cfg.model}`, { credential: cred.id });
+
+    return await createContentGenerator(cfg, {} as any);
+  });
+}
+
+const pool = new GeneratorPool(
+  parseCredentials(process.env.GEMINI_CREDENTIALS, authType),
+  createGenerator,
+  {
+    rpm: Number(process.env.POOL_RPM ?? 0),
+    tpd: Number(process.env.POOL_TPD ?? 0),
+    cooldownMs: Number(process.env.POOL_COOLDOWN_MS ?? 60_000),
+    publish: (event) => publish('pool', event),
+  },
+);
+subscribe('pool', (event) => pool.applyRemote(event));
+
+log.info(`Credential pool: ${pool.members.map((m) => m.cred.id).join(', ')}`);
+
+/* ------------------------------------------------------------------ */
+/* 3.  Retry / hedging policy                                          */
+/* ------------------------------------------------------------------ */
+const retryOptions: RetryOptions = {
+  maxAttempts: Number(process.env.RETRY_MAX_ATTEMPTS ?? 4),
+  baseDelayMs: Number(process.env.RETRY_BASE_DELAY_MS ?? 500),
+  maxDelayMs: Number(process.env.RETRY_MAX_DELAY_MS ?? 8_000),
+  deadlineMs: Number(process.env.RETRY_DEADLINE_MS ?? 60_000),
+};
 
-  return await createContentGenerator(cfg, {} as any);
-})();
+// Hedging fires a second non-streaming attempt once the first one is
+// slower than the model's recent p95 latency.
+const hedging = process.env.HEDGE === '1' || process.env.HEDGE === 'true';
+const hedgeMinDelayMs = Number(process.env.HEDGE_MIN_DELAY_MS ?? 1_000);
+const latencies = new Map<string, LatencyTracker>();
+
+function latencyFor(model: string) {
+  let tracker = latencies.get(model);
+  if (!tracker) latencies.set(model, (tracker = new LatencyTracker()));
+  return tracker;
+}
 
 /* ------------------------------------------------------------------ */
-/* 2.  Helpers consumed by server.ts                                   */
+/* 4.  Helpers consumed by server.ts                                   */
 /* ------------------------------------------------------------------ */
 type GenConfig = Record<string, unknown>;
 
-export async function sendChat({
-  contents,
-  generationConfig = {},
-}: {
+interface ChatRequest {
+  model?: string;
   contents: any[];
   generationConfig?: GenConfig;
-  tools?: unknown;                // accepted but ignored for now
-}) {
-  const generator: any = await generatorPromise;
-  return await generator.generateContent({
-    model: modelName,
-    contents,
-    config: generationConfig,
-  });
+  signal?: AbortSignal;           // client disconnect / request deadline
 }
 
-export async function* sendChatStream({
+/** One upstream attempt on the least-loaded credential. */
+async function generateOnce(
+  model: string,
+  contents: any[],
+  generationConfig: GenConfig,
+  signal?: AbortSignal,
+) {
+  const lease = pool.acquire(model);
+  const started = Date.now();
+  try {
+    const generator: any = await lease.generator();
+    const resp = await withContextCache(
+      lease.member.cred, generator, model, contents, generationConfig,
+      (c, cfg) => generator.generateContent({
+        model,
+        contents: c,
+        config: { ...cfg, abortSignal: signal },
+      }),
+    );
+    const elapsed = Date.now() - started;
+    latencyFor(model).record(elapsed);
+    upstreamTtfbSeconds.labels(model).observe(elapsed / 1000);
+    recordUsage(model, lease.member.cred.id, resp?.usageMetadata);
+    lease.release({ tokens: resp?.usageMetadata?.totalTokenCount });
+    return resp;
+  } catch (err) {
+    lease.release({ error: err });
+    throw err;
+  }
+}
+
+async function sendOne({
+  model = defaultModel,
   contents,
   generationConfig = {},
-}: {
-  contents: any[];
-  generationConfig?: GenConfig;
-  tools?: unknown;
-}) {
-  const generator: any = await generatorPromise;
-  const stream = await generator.generateContentStream({
-    model: modelName,
-    contents,
-    config: generationConfig,
+  signal,
+}: ChatRequest) {
+  if (replaying) return replay(model, contents, generationConfig, signal);
+  const recorder = recording ? tape(model, contents, generationConfig, false) : undefined;
+  const attempt = (s?: AbortSignal) => generateOnce(model, contents, generationConfig, s);
+  const resp = await withRetry((_, bounded) => {
+    const p95 = hedging ? latencyFor(model).p95() : undefined;
+    return p95 === undefined
+      ? attempt(bounded)
+      : hedged(attempt, Math.max(p95, hedgeMinDelayMs), bounded);
+  }, retryOptions, signal);
+  recorder?.chunk(resp);
+  recorder?.end();
+  return resp;
+}
+
+/** Open a stream and wait for its first chunk, so failures here can be retried. */
+async function openStream(
+  model: string,
+  contents: any[],
+  generationConfig: GenConfig,
+  signal?: AbortSignal,
+) {
+  const lease = pool.acquire(model);
+  const started = Date.now();
+  try {
+    const generator: any = await lease.generator();
+    // the first chunk is awaited inside, so a rejected cache handle
+    // surfaces there and can still fall back to an uncached call
+    const { iterator, first } = await withContextCache(
+      lease.member.cred, generator, model, contents, generationConfig,
+      async (c, cfg) => {
+        const stream = await generator.generateContentStream({
+          model,
+          contents: c,
+          config: { ...cfg, abortSignal: signal },
+        });
+        const it: AsyncIterator<any> = stream[Symbol.asyncIterator]();
+        return { iterator: it, first: await it.next() };
+      },
+    );
+    upstreamTtfbSeconds.labels(model).observe((Date.now() - started) / 1000);
+    return { lease, iterator, first };
+  } catch (err) {
+    lease.release({ error: err });
+    throw err;
+  }
+}
+
+async function* streamOne({
+  model = defaultModel,
+  contents,
+  generationConfig = {},
+  signal,
+}: ChatRequest) {
+  // offline: serve the recorded chunks instead of calling upstream
+  if (replaying) {
+    yield* replayStream(model, contents, generationConfig, signal);
+    return;
+  }
+  const recorder = recording ? tape(model, contents, generationConfig, true) : undefined;
+
+  // Nothing has reached the client until the first chunk is yielded, so
+  // only the stream setup is retried; mid-stream errors propagate.
+  const { lease, iterator, first } = await withRetry(
+    (_, bounded) => openStream(model, contents, generationConfig, bounded),
+    retryOptions,
+    signal,
+  );
+
+  // Rejects as soon as the request is cancelled, even mid-chunk
+  const aborted = signal && new Promise<never>((_, reject) => {
+    if (signal.aborted) reject(signal.reason);
+    signal.addEventListener('abort', () => reject(signal.reason), { once: true });
   });
-  for await (const chunk of stream) yield chunk;
+  aborted?.catch(() => undefined);
+
+  let usage: any;
+  try {
+    for (
+      let r = first;
+      !r.done;
+      r = await (aborted ? Promise.race([iterator.next(), aborted]) : iterator.next())
+    ) {
+      usage = r.value?.usageMetadata ?? usage;
+      recorder?.chunk(r.value);
+      yield r.value;
+    }
+    recorder?.end();
+    lease.release({ tokens: usage?.totalTokenCount });
+  } catch (err) {
+    lease.release({ error: err });
+    throw err;
+  } finally {
+    recordUsage(model, lease.member.cred.id, usage);
+    lease.release({ tokens: usage?.totalTokenCount });     // consumer stopped early
+    // tear the upstream iterator down without waiting on a pending chunk
+    iterator.return?.()?.catch(() => undefined);
+  }
 }
 
 /* ------------------------------------------------------------------ */
-/* 3.  Minimal stubs so server.ts compiles (extend later)              */
+/* 5.  n > 1: candidateCount, or one upstream call per choice          */
+/* ------------------------------------------------------------------ */
+// auto: ask for candidateCount, fall back to fan-out for models that
+// reject or ignore it | candidates: always candidateCount | fanout: never
+const choicesMode = process.env.CHOICES_MODE ?? 'auto';
+const noCandidateCount = new Set<string>();
+
+function useCandidateCount(model: string) {
+  if (choicesMode === 'fanout') return false;
+  return choicesMode === 'candidates' || !noCandidateCount.has(model);
+}
+
+function rejectsCandidateCount(err: any) {
+  return choicesMode === 'auto' && errorStatus(err) === 400 && /candidate/i.test(String(err?.message));
+}
+
+function dropCandidateCount(model: string, reason: string) {
+  if (!noCandidateCount.has(model)) log.info(`${model} ${reason} candidateCount, fanning out instead`);
+  noCandidateCount.add(model);
+}
+
+const range = (n: number) => Array.from({ length: n }, (_, i) => i);
+
+/** Usage of one request that was served by several upstream calls. */
+function mergeUsage(usages: any[]) {
+  const present = usages.filter(Boolean);
+  if (!present.length) return undefined;
+  const sum = (key: string) => present.reduce((n, u) => n + (u[key] ?? 0), 0);
+  // the prompt was sent to every call, but is one prompt to the client
+  const prompt = present[0].promptTokenCount ?? 0;
+  const candidates = sum('candidatesTokenCount');
+  const thoughts = sum('thoughtsTokenCount');
+  return {
+    promptTokenCount: prompt,
+    candidatesTokenCount: candidates,
+    thoughtsTokenCount: thoughts || undefined,
+    cachedContentTokenCount: present[0].cachedContentTokenCount,
+    totalTokenCount: prompt + candidates + thoughts,
+  };
+}
+
+/** Several single-candidate responses as one response with indexed candidates. */
+function mergeResponses(responses: any[], indices = range(responses.length)) {
+  const candidates = responses.flatMap((r, i) =>
+    (r.candidates ?? []).map((c: any, j: number) => ({ ...c, index: indices[i] + j })));
+  return {
+    candidates,
+    promptFeedback: responses[0]?.promptFeedback,
+    usageMetadata: mergeUsage(responses.map((r) => r.usageMetadata)),
+  };
+}
+
+export async function sendChat(req: ChatRequest) {
+  const n = Number(req.generationConfig?.candidateCount ?? 1);
+  if (n <= 1) return sendOne(req);
+  const model = req.model ?? defaultModel;
+  const single = { ...req, generationConfig: { ...req.generationConfig, candidateCount: undefined } };
+  const fanOut = (count: number) => Promise.all(range(count).map(() => sendOne(single)));
+
+  if (!useCandidateCount(model)) return mergeResponses(await fanOut(n));
+  let resp: any;
+  try {
+    resp = await sendOne(req);
+  } catch (err) {
+    if (!rejectsCandidateCount(err)) throw err;
+    dropCandidateCount(model, 'rejects');
+    return mergeResponses(await fanOut(n));
+  }
+  const got = resp?.candidates?.length ?? 0;
+  if (!got || got >= n || choicesMode !== 'auto') return resp;
+  // upstream quietly answered with fewer candidates: fetch the rest
+  dropCandidateCount(model, 'ignores');
+  return mergeResponses([resp, ...(await fanOut(n - got))], [0, ...range(n - got).map((i) => got + i)]);
+}
+
+/**
+ * Interleave several candidate streams as they produce chunks, relabelled
+ * with their choice index. Usage is held back and reported once at the end.
+ */
+async function* interleave(streams: AsyncGenerator<any>[], indices: number[], usages: any[]) {
+  const next = (i: number) => streams[i].next().then((r) => ({ i, r }));
+  const pending = new Map(streams.map((_, i) => [i, next(i)]));
+  try {
+    while (pending.size) {
+      const { i, r } = await Promise.race(pending.values());
+      if (r.done) {
+        pending.delete(i);
+        continue;
+      }
+      pending.set(i, next(i));
+      if (r.value?.usageMetadata) usages[indices[i]] = r.value.usageMetadata;
+      const candidates = (r.value?.candidates ?? []).map((c: any) => ({ ...c, index: indices[i] }));
+      if (candidates.length) yield { candidates };
+    }
+  } finally {
+    // one stream failed or the consumer left: stop the others too
+    for (const stream of streams) stream.return(undefined).catch(() => undefined);
+  }
+}
+
+export async function* sendChatStream(req: ChatRequest) {
+  const n = Number(req.generationConfig?.candidateCount ?? 1);
+  if (n <= 1) {
+    yield* streamOne(req);
+    return;
+  }
+  const model = req.model ?? defaultModel;
+  const single = { ...req, generationConfig: { ...req.generationConfig, candidateCount: undefined } };
+  const usages: any[] = [];        // per choice index, from fanned-out calls
+  let usage: any;                  // a candidateCount call covers all its candidates
+  const fanOut = (indices: number[]) =>
+    interleave(indices.map(() => streamOne(single)), indices, usages);
+
+  if (!useCandidateCount(model)) {
+    yield* fanOut(range(n));
+  } else {
+    const seen = new Set<number>();
+    try {
+      for await (const chunk of streamOne(req)) {
+        usage = chunk?.usageMetadata ?? usage;
+        for (const c of chunk?.candidates ?? []) seen.add(c.index ?? 0);
+        yield { candidates: chunk?.candidates ?? [] };
+      }
+    } catch (err) {
+      if (seen.size || !rejectsCandidateCount(err)) throw err;
+      dropCandidateCount(model, 'rejects');
+    }
+    const missing = range(n).filter((i) => !seen.has(i));
+    if (missing.length && choicesMode === 'auto') {
+      if (seen.size) dropCandidateCount(model, 'ignores');
+      yield* fanOut(missing);
+    }
+  }
+  yield { candidates: [], usageMetadata: mergeUsage([usage, ...usages]) };
+}
+
+/** Exact prompt size from upstream (used near the context limit). */
+export async function countTokens(model: string, contents: any[], systemInstruction?: unknown) {
+  const lease = pool.acquire(model);
+  try {
+    const generator: any = await lease.generator();
+    const resp = await generator.countTokens({
+      model,
+      contents,
+      config: systemInstruction ? { systemInstruction } : undefined,
+    });
+    lease.release();
+    return resp.totalTokens as number;
+  } catch (err) {
+    lease.release({ error: err });
+    throw err;
+  }
+}
+
+// Embedding model for /v1/embeddings; clients naming an OpenAI model get this one
+const embeddingModel = process.env.EMBED_MODEL || 'gemini-embedding-001';
+
+/** Gemini embedding models pass through, anything else (text-embedding-3-small…) maps. */
+export function resolveEmbeddingModel(requested?: string): string {
+  return requested && /^(gemini-embedding|text-embedding-00|embedding-)/.test(requested)
+    ? requested
+    : embeddingModel;
+}
+
+/** One batched embedContent call (one vector per text), with retries. */
+export async function embedTexts(model: string, texts: string[], dimensions?: number): Promise<number[][]> {
+  return withRetry(async (_, signal) => {
+    // quota, budget and cooldown are tracked for the embedding model; the
+    // generator itself is the chat one, since the model is chosen per call
+    const lease = pool.acquire(model);
+    try {
+      const generator: any = await lease.member.getGenerator(defaultModel);
+      const resp = await generator.embedContent({
+        model,
+        contents: texts,
+        config: { abortSignal: signal, ...(dimensions ? { outputDimensionality: dimensions } : {}) },
+      });
+      lease.release();
+      return (resp.embeddings ?? []).map((e: any) => e.values ?? []);
+    } catch (err) {
+      lease.release({ error: err });
+      throw err;
+    }
+  }, retryOptions);
+}
+
+/* ------------------------------------------------------------------ */
+/* 6.  Model listing                                                   */
 /* ------------------------------------------------------------------ */
 export function listModels() {
-  return [{ 
-    id: modelName,
+  return models.map((id) => ({
+    id,
     object: 'model',
     owned_by: 'google'
-  }];
+  }));
 }
 
 export function getModel() {
-  return modelName;
+  return defaultModel;
+}
+
+let ready = false;
+let warming: Promise<boolean> | undefined;
+
+/**
+ * Authenticate every credential up front; called once the server listens.
+ * Ready as soon as one credential works; calling again retries a failed warmup.
+ */
+export function warmup(): Promise<boolean> {
+  // a replayed cassette needs no credentials at all
+  if (replaying) {
+    loadCassette();
+    ready = true;
+    return Promise.resolve(true);
+  }
+  warming ??= pool.warmup(defaultModel).then((ok) => {
+    ready = ok > 0;
+    warming = undefined;
+    return ready;
+  });
+  return warming;
+}
+
+export function isReady() {
+  return ready;
+}
+
+export function poolStatus() {
+  return pool.snapshot();
 }
@@ -0,0 +1,145 @@
+// src/cluster.ts
+/* ------------------------------------------------------------------ */
+/*  Cluster mode – N workers share the port, state syncs over IPC     */
+/* ------------------------------------------------------------------ */
+import cluster, { Worker } from 'cluster';
+import os from 'os';
+import { log } from './logger';
+
+const TAG = 'proxy:shared';
+
+type Handler = (payload: any) => void;
+const handlers = new Map<string, Handler[]>();
+
+/** WORKERS=N, or WORKERS=auto for one worker per core. */
+export function workerCount(): number {
+  const raw = process.env.WORKERS ?? '1';
+  if (raw === 'auto') return os.availableParallelism?.() ?? os.cpus().length;
+  return Math.max(1, Number(raw) || 1);
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Worker side: publish / subscribe                                */
+/* ------------------------------------------------------------------ */
+/**
+ * Tell every other worker about a state change (quota use, cache entry…).
+ * The primary relays it; outside cluster mode this is a no-op.
+ */
+export function publish(channel: string, payload: unknown) {
+  if (cluster.isWorker && process.send) {
+    process.send({ tag: TAG, channel, payload });
+  }
+}
+
+export function subscribe(channel: string, handler: Handler) {
+  const list = handlers.get(channel) ?? [];
+  list.push(handler);
+  handlers.set(channel, list);
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Worker side: gather a value from every worker                   */
+/* ------------------------------------------------------------------ */
+// Per-process state (metrics, /stats) has to be summed over the cluster:
+// the asking worker goes through the primary, which polls every worker.
+const GATHER_TAG = 'proxy:gather';
+const GATHER_TIMEOUT_MS = 1_000;
+
+type Provider = () => unknown;
+const providers = new Map<string, Provider>();
+const gathering = new Map<number, (payloads: any[]) => void>();
+let nextGather = 0;
+
+/** Answer `gather(channel)` calls with this process's value. */
+export function provide(channel: string, provider: Provider) {
+  providers.set(channel, provider);
+}
+
+/**
+ * Every live worker's value for `channel` (workers that do not answer
+ * within a second are left out); just this process outside cluster mode.
+ */
+export function gather<T>(channel: string): Promise<T[]> {
+  const provider = providers.get(channel);
+  if (!cluster.isWorker || !process.send) {
+    return Promise.resolve(provider ? [provider() as T] : []);
+  }
+  const id = ++nextGather;
+  return new Promise((resolve) => {
+    gathering.set(id, resolve);
+    process.send!({ tag: GATHER_TAG, op: 'gather', channel, id });
+  });
+}
+
+if (cluster.isWorker) {
+  process.on('message', (msg: any) => {
+    if (msg?.tag === TAG) {
+      for (const handler of handlers.get(msg.channel) ?? []) handler(msg.payload);
+    } else if (msg?.tag === GATHER_TAG && msg.op === 'collect') {
+      const provider = providers.get(msg.channel);
+      process.send?.({ tag: GATHER_TAG, op: 'collected', round: msg.round, payload: provider?.() });
+    } else if (msg?.tag === GATHER_TAG && msg.op === 'gathered') {
+      gathering.get(msg.id)?.(msg.payloads);
+      gathering.delete(msg.id);
+    }
+  });
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Primary side: fork, relay, gather, respawn                      */
+/* ------------------------------------------------------------------ */
+export function runPrimary(workers: number) {
+  log.info(`Cluster primary ${process.pid} starting ${workers} workers`);
+
+  const spawnedAt = new Map<number, number>();
+  const spawn = () => {
+    const worker = cluster.fork();
+    spawnedAt.set(worker.id, Date.now());
+  };
+  for (let i = 0; i < workers; i++) spawn();
+
+  // relay shared-state messages to every other worker
+  cluster.on('message', (from, msg: any) => {
+    if (msg?.tag !== TAG) return;
+    for (const worker of Object.values(cluster.workers ?? {})) {
+      if (worker && worker !== from && worker.isConnected()) worker.send(msg);
+    }
+  });
+
+  // gather rounds: poll every worker, answer the asker with what came back
+  const rounds = new Map<number, { pending: Set<number>; payloads: unknown[]; finish: () => void }>();
+  let nextRound = 0;
+  cluster.on('message', (from, msg: any) => {
+    if (msg?.tag !== GATHER_TAG) return;
+    if (msg.op === 'collected') {
+      const round = rounds.get(msg.round);
+      if (!round?.pending.delete(from.id)) return;
+      round.payloads.push(msg.payload);
+      if (!round.pending.size) round.finish();
+      return;
+    }
+    if (msg.op !== 'gather') return;
+    const id = ++nextRound;
+    const live = Object.values(cluster.workers ?? {}).filter((w) => w?.isConnected()) as Worker[];
+    const round = {
+      pending: new Set(live.map((w) => w.id)),
+      payloads: [] as unknown[],
+      finish: () => {
+        clearTimeout(timer);
+        rounds.delete(id);
+        if (from.isConnected()) from.send({ tag: GATHER_TAG, op: 'gathered', id: msg.id, payloads: round.payloads });
+      },
+    };
+    const timer = setTimeout(round.finish, GATHER_TIMEOUT_MS);
+    rounds.set(id, round);
+    for (const worker of live) worker.send({ tag: GATHER_TAG, op: 'collect', channel: msg.channel, round: id });
+  });
+
+  cluster.on('exit', (worker, code, signal) => {
+    const uptime = Date.now() - (spawnedAt.get(worker.id) ?? 0);
+    spawnedAt.delete(worker.id);
+    log.warn('Worker exited, respawning', { pid: worker.process.pid, code, signal });
+    // a worker that dies right at boot is probably misconfigured: slow down
+    setTimeout(spawn, uptime < 5_000 ? 1_000 : 0);
+  });
+}
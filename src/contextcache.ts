@@ -0,0 +1,244 @@
+// src/contextcache.ts
+/* ------------------------------------------------------------------ */
+/*  Explicit context caching for large, repeated request prefixes     */
+/* ------------------------------------------------------------------ */
+import { createHash } from 'crypto';
+import { LruCache, canonicalJSON } from './cache';
+import { Credential } from './pool';
+import { classifyError } from './retry';
+import { count } from './stats';
+import { log } from './logger';
+
+const ENABLED = process.env.CONTEXT_CACHE === '1' || process.env.CONTEXT_CACHE === 'true';
+const MIN_TOKENS = Number(process.env.CONTEXT_CACHE_MIN_TOKENS ?? 32_768);
+const MIN_REPEATS = Number(process.env.CONTEXT_CACHE_MIN_REPEATS ?? 2);
+const TTL_MS = Number(process.env.CONTEXT_CACHE_TTL_MS ?? 10 * 60_000);
+const MAX_HANDLES = Number(process.env.CONTEXT_CACHE_MAX_ENTRIES ?? 50);
+
+// rough estimate, good enough to decide what is worth caching
+const CHARS_PER_TOKEN = 4;
+
+/* ------------------------------------------------------------------ */
+/* 1.  Backend – where cached content actually lives                   */
+/* ------------------------------------------------------------------ */
+export interface CachedContentRef {
+  name: string;
+  tokens?: number;         // as reported by upstream, if it says
+}
+
+/**
+ * Upstream cached-content API. Generators may provide their own as a
+ * `caches` property (the mock generator does); API-key credentials fall
+ * back to the Gemini API's caches endpoint.
+ */
+export interface ContextCacheBackend {
+  create(req: {
+    model: string;
+    contents: any[];
+    systemInstruction?: unknown;
+    ttlSeconds: number;
+  }): Promise<CachedContentRef>;
+  update(name: string, ttlSeconds: number): Promise<void>;
+  delete(name: string): Promise<void>;
+}
+
+function genaiBackend(apiKey: string): ContextCacheBackend {
+  let client: Promise<any> | undefined;
+  const genai = () =>
+    (client ??= import('@google/genai').then(({ GoogleGenAI }) => new GoogleGenAI({ apiKey })));
+  return {
+    async create({ model, contents, systemInstruction, ttlSeconds }) {
+      const ai = await genai();
+      const cached: any = await ai.caches.create({
+        model,
+        config: { contents, systemInstruction, ttl: `${ttlSeconds}s` } as any,
+      });
+      return { name: cached.name, tokens: cached.usageMetadata?.totalTokenCount };
+    },
+    async update(name, ttlSeconds) {
+      const ai = await genai();
+      await ai.caches.update({ name, config: { ttl: `${ttlSeconds}s` } });
+    },
+    async delete(name) {
+      const ai = await genai();
+      await ai.caches.delete({ name });
+    },
+  };
+}
+
+const backends = new Map<string, ContextCacheBackend | null>();
+
+function backendFor(cred: Credential, generator: any): ContextCacheBackend | undefined {
+  if (generator?.caches?.create) return generator.caches;
+  let backend = backends.get(cred.id);
+  if (backend === undefined) {
+    // OAuth / Code Assist has no cached-content endpoint
+    backend = cred.authType === 'gemini-api-key' && cred.apiKey ? genaiBackend(cred.apiKey) : null;
+    backends.set(cred.id, backend);
+  }
+  return backend ?? undefined;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Prefix hashing                                                  */
+/* ------------------------------------------------------------------ */
+interface Prefix {
+  turns: number;           // contents[0, turns) plus the system instruction
+  hash: string;
+  tokens: number;          // estimated
+}
+
+/**
+ * Hash chain over the turns: prefix k's hash covers the system
+ * instruction and the first k turns, so one pass yields every prefix.
+ */
+function prefixes(contents: any[], systemInstruction: unknown): Prefix[] {
+  const out: Prefix[] = [];
+  let chars = systemInstruction ? canonicalJSON(systemInstruction).length : 0;
+  let hash = createHash('sha256').update(canonicalJSON(systemInstruction ?? null)).digest('hex');
+  if (systemInstruction) out.push({ turns: 0, hash, tokens: chars / CHARS_PER_TOKEN });
+  contents.forEach((turn, i) => {
+    const json = canonicalJSON(turn);
+    chars += json.length;
+    hash = createHash('sha256').update(hash).update(json).digest('hex');
+    out.push({ turns: i + 1, hash, tokens: chars / CHARS_PER_TOKEN });
+  });
+  return out.filter((p) => p.tokens >= MIN_TOKENS);
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Handle registry                                                 */
+/* ------------------------------------------------------------------ */
+interface Handle extends CachedContentRef {
+  key: string;
+  turns: number;
+  backend: ContextCacheBackend;
+  expires: number;
+}
+
+const handles = new LruCache<Handle>(
+  { maxEntries: MAX_HANDLES, maxBytes: 0, ttlMs: TTL_MS },
+  (_key, handle) => {
+    handle.backend.delete(handle.name).catch(() => undefined);
+    count('context_cache_evicted');
+  },
+);
+
+// how often each large prefix was seen, to cache only what repeats
+const seen = new LruCache<number>({ maxEntries: 10_000, maxBytes: 0, ttlMs: TTL_MS });
+const creating = new Set<string>();
+
+// remote entries live a little longer than ours, so a handle we still
+// hold never points at content that already expired upstream
+const remoteTtlSeconds = () => Math.ceil(TTL_MS / 1000) + 60;
+
+function create(key: string, backend: ContextCacheBackend, model: string, prefix: Prefix,
+  contents: any[], systemInstruction: unknown) {
+  if (creating.has(key)) return;
+  creating.add(key);
+  backend
+    .create({
+      model,
+      contents: contents.slice(0, prefix.turns),
+      systemInstruction,
+      ttlSeconds: remoteTtlSeconds(),
+    })
+    .then((ref) => {
+      handles.set(key, {
+        ...ref,
+        tokens: ref.tokens ?? Math.round(prefix.tokens),
+        key,
+        turns: prefix.turns,
+        backend,
+        expires: Date.now() + TTL_MS,
+      });
+      count('context_cache_created');
+      log.info('Context cache created', { model, name: ref.name, tokens: ref.tokens });
+    })
+    .catch((err) => log.warn('Context cache creation failed', { model, err }))
+    .finally(() => creating.delete(key));
+}
+
+function refresh(handle: Handle) {
+  if (handle.expires - Date.now() > TTL_MS / 2) return;
+  handle.expires = Date.now() + TTL_MS;
+  handles.set(handle.key, handle);
+  handle.backend.update(handle.name, remoteTtlSeconds()).catch((err) => {
+    log.warn('Context cache refresh failed', { name: handle.name, err });
+    handles.delete(handle.key);
+  });
+}
+
+/* ------------------------------------------------------------------ */
+/* 4.  Request integration                                             */
+/* ------------------------------------------------------------------ */
+type GenConfig = Record<string, unknown>;
+
+/**
+ * Run one upstream call, replacing a known large prefix with its cached
+ * content handle. Prefixes that repeat get a handle created in the
+ * background for later requests. If upstream rejects a handle (expired,
+ * deleted elsewhere) it is dropped and the call is made uncached.
+ */
+export async function withContextCache<T>(
+  cred: Credential,
+  generator: any,
+  model: string,
+  contents: any[],
+  config: GenConfig,
+  call: (contents: any[], config: GenConfig) => Promise<T>,
+): Promise<T> {
+  // tools/tool config would have to live in the cache too; keep it simple
+  if (!ENABLED || config.cachedContent || config.tools || config.toolConfig) {
+    return call(contents, config);
+  }
+  const backend = backendFor(cred, generator);
+  if (!backend) return call(contents, config);
+
+  const { systemInstruction, ...rest } = config;
+  const candidates = prefixes(contents, systemInstruction);
+  const keyOf = (p: Prefix) => `${cred.id}|${model}|${p.hash}`;
+
+  // longest cached prefix that still leaves at least one turn to send
+  let handle: Handle | undefined;
+  let cachedPrefix: Prefix | undefined;
+  for (let i = candidates.length - 1; i >= 0 && !handle; i--) {
+    if (candidates[i].turns < contents.length) {
+      handle = handles.get(keyOf(candidates[i]));
+      if (handle) cachedPrefix = candidates[i];
+    }
+  }
+
+  // cache the longest prefix that keeps coming back, once it is worth a
+  // handle of its own (a growing chat moves on to longer prefixes)
+  let best: Prefix | undefined;
+  for (const p of candidates) {
+    const n = (seen.get(p.hash) ?? 0) + 1;
+    seen.set(p.hash, n);
+    if (n >= MIN_REPEATS && p.turns < contents.length) best = p;
+  }
+  if (best && (!cachedPrefix || best.tokens - cachedPrefix.tokens >= MIN_TOKENS)) {
+    create(keyOf(best), backend, model, best, contents, systemInstruction);
+  }
+
+  if (!handle) {
+    if (candidates.length) count('context_cache_misses');
+    return call(contents, config);
+  }
+
+  count('context_cache_hits');
+  count('context_cache_saved_tokens', handle.tokens ?? 0);
+  refresh(handle);
+  try {
+    return await call(contents.slice(handle.turns), { ...rest, cachedContent: handle.name });
+  } catch (err) {
+    if (classifyError(err) !== 'client') throw err;
+    log.warn('Cached content rejected, retrying uncached', { name: handle.name, err });
+    handles.delete(handle.key);
+    return call(contents, config);
+  }
+}
+
+export function contextCacheStatus() {
+  return ENABLED ? { handles: handles.size } : undefined;
+}
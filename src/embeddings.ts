@@ -0,0 +1,125 @@
+// src/embeddings.ts
+/* ------------------------------------------------------------------ */
+/*  /v1/embeddings – micro-batching of concurrent inputs              */
+/* ------------------------------------------------------------------ */
+import { count } from './stats';
+import { log } from './logger';
+
+const MAX_BATCH = Math.max(1, Number(process.env.EMBED_MAX_BATCH ?? 100));   // upstream cap is 100
+const MAX_WAIT_MS = Number(process.env.EMBED_MAX_WAIT_MS ?? 5);
+
+export class EmbeddingInputError extends Error {
+  status = 400;
+}
+
+/** One upstream call: embed `texts` in order, one vector per text. */
+export type EmbedFn = (model: string, texts: string[], dimensions?: number) => Promise<number[][]>;
+
+interface Pending {
+  text: string;
+  resolve: (values: number[]) => void;
+  reject: (err: unknown) => void;
+  signal?: AbortSignal;
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Batcher                                                         */
+/* ------------------------------------------------------------------ */
+/**
+ * Collects inputs for up to EMBED_MAX_WAIT_MS (or until EMBED_MAX_BATCH
+ * are waiting) and sends them as one upstream call. Inputs only share a
+ * call with others for the same model and dimensions.
+ */
+export class EmbeddingBatcher {
+  private queues = new Map<string, { model: string; dimensions?: number; items: Pending[]; timer?: NodeJS.Timeout }>();
+
+  constructor(private readonly embed: EmbedFn) {}
+
+  /** Vectors for `texts`, in order; rejects if `signal` aborts while queued. */
+  add(model: string, texts: string[], dimensions?: number, signal?: AbortSignal): Promise<number[][]> {
+    const key = `${model}\n${dimensions ?? ''}`;
+    let queue = this.queues.get(key);
+    if (!queue) this.queues.set(key, (queue = { model, dimensions, items: [] }));
+
+    const vectors = texts.map((text) => new Promise<number[]>((resolve, reject) => {
+      queue!.items.push({ text, resolve, reject, signal });
+    }));
+    signal?.addEventListener('abort', () => this.drop(key, signal), { once: true });
+
+    if (queue.items.length >= MAX_BATCH) this.flush(key);
+    else queue.timer ??= setTimeout(() => this.flush(key), MAX_WAIT_MS);
+    return Promise.all(vectors);
+  }
+
+  /** A cancelled request leaves the queue; calls already sent run to the end. */
+  private drop(key: string, signal: AbortSignal) {
+    const queue = this.queues.get(key);
+    if (!queue) return;
+    queue.items = queue.items.filter((item) => {
+      if (item.signal !== signal) return true;
+      item.reject(signal.reason);
+      return false;
+    });
+  }
+
+  private flush(key: string) {
+    const queue = this.queues.get(key);
+    if (!queue) return;
+    clearTimeout(queue.timer);
+    queue.timer = undefined;
+    // a big request may need several calls: full batches and the remainder all go out now
+    while (queue.items.length >= MAX_BATCH) this.send(queue.model, queue.dimensions, queue.items.splice(0, MAX_BATCH));
+    if (queue.items.length) this.send(queue.model, queue.dimensions, queue.items.splice(0));
+    this.queues.delete(key);
+  }
+
+  private async send(model: string, dimensions: number | undefined, items: Pending[]) {
+    count('embedding_batches');
+    count('embedding_inputs', items.length);
+    try {
+      const vectors = await this.embed(model, items.map((i) => i.text), dimensions);
+      if (vectors.length !== items.length) {
+        throw new Error(`Upstream returned ${vectors.length} embeddings for ${items.length} inputs`);
+      }
+      items.forEach((item, i) => item.resolve(vectors[i]));
+    } catch (err) {
+      log.warn('Embedding batch failed', { err, inputs: items.length });
+      for (const item of items) item.reject(err);
+    }
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  OpenAI request / response                                       */
+/* ------------------------------------------------------------------ */
+/** `input` as a list of strings; token-id inputs have no Gemini equivalent. */
+export function embeddingInputs(body: any): string[] {
+  const input = body?.input;
+  const texts = typeof input === 'string' ? [input] : input;
+  if (!Array.isArray(texts) || !texts.length || !texts.every((t) => typeof t === 'string')) {
+    throw new EmbeddingInputError("'input' must be a string or a non-empty array of strings");
+  }
+  if (texts.some((t) => !t)) throw new EmbeddingInputError("'input' must not contain empty strings");
+  return texts;
+}
+
+/**
+ * The OpenAI response as a JSON string, built by hand: vectors are
+ * joined straight into the output (or sent as base64 float32), not
+ * wrapped in one object per element for JSON.stringify.
+ */
+export function embeddingResponse(
+  vectors: number[][],
+  model: string,
+  promptTokens: number,
+  format: 'float' | 'base64' = 'float',
+): string {
+  const data = vectors.map((values, index) => {
+    const embedding = format === 'base64'
+      ? `"${Buffer.from(Float32Array.from(values).buffer).toString('base64')}"`
+      : `[${values.join(',')}]`;
+    return `{"object":"embedding","index":${index},"embedding":${embedding}}`;
+  });
+  const usage = `{"prompt_tokens":${promptTokens},"total_tokens":${promptTokens}}`;
+  return `{"object":"list","data":[${data.join(',')}],"model":${JSON.stringify(model)},"usage":${usage}}`;
+}
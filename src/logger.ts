@@ -0,0 +1,128 @@
+// src/logger.ts
+/* ------------------------------------------------------------------ */
+/*  Structured, sampled, asynchronous logger                          */
+/* ------------------------------------------------------------------ */
+import fs from 'fs';
+
+type Level = 'debug' | 'info' | 'warn' | 'error';
+const LEVELS: Record<Level, number> = { debug: 10, info: 20, warn: 30, error: 40 };
+
+const minLevel = LEVELS[(process.env.LOG_LEVEL ?? 'info') as Level] ?? LEVELS.info;
+// empty counts as unset, like the blank LOG_FORMAT= in .env.example
+const json = (process.env.LOG_FORMAT || (process.stdout.isTTY ? 'text' : 'json')) === 'json';
+const MAX_STRING = Number(process.env.LOG_MAX_FIELD_CHARS ?? 200);
+const MAX_ARRAY = 20;
+const MAX_DEPTH = 6;
+const MAX_BUFFERED_LINES = 10_000;
+
+/* ------------------------------------------------------------------ */
+/* 1.  Redaction – keep log lines small whatever the payload           */
+/* ------------------------------------------------------------------ */
+const BASE64_KEYS = new Set(['data', 'b64_json', 'base64']);
+
+function sanitize(value: unknown, depth = 0, key = ''): unknown {
+  if (typeof value === 'string') {
+    if (BASE64_KEYS.has(key) && value.length > 64) return `[base64 ${value.length} chars]`;
+    return value.length > MAX_STRING
+      ? `${value.slice(0, MAX_STRING)}…(+${value.length - MAX_STRING} chars)`
+      : value;
+  }
+  if (value instanceof Error) {
+    const err = value as any;
+    return { name: err.name, message: err.message, status: err.status, stack: err.stack };
+  }
+  if (value === null || typeof value !== 'object') return value;
+  if (depth >= MAX_DEPTH) return '[…]';
+  if (Array.isArray(value)) {
+    const out = value.slice(0, MAX_ARRAY).map((v) => sanitize(v, depth + 1));
+    if (value.length > MAX_ARRAY) out.push(`…(+${value.length - MAX_ARRAY} items)`);
+    return out;
+  }
+  const out: Record<string, unknown> = {};
+  for (const [k, v] of Object.entries(value)) out[k] = sanitize(v, depth + 1, k);
+  return out;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Asynchronous sink – one stdout write per event-loop turn        */
+/* ------------------------------------------------------------------ */
+let buffer: string[] = [];
+let scheduled = false;
+let dropped = 0;
+
+function flush() {
+  scheduled = false;
+  if (!buffer.length) return;
+  if (dropped) {
+    buffer.push(format('warn', 'log lines dropped', { dropped }));
+    dropped = 0;
+  }
+  const out = buffer.join('');
+  buffer = [];
+  process.stdout.write(out);
+}
+
+function enqueue(line: string) {
+  if (buffer.length >= MAX_BUFFERED_LINES) {
+    dropped++;
+    return;
+  }
+  buffer.push(line);
+  if (!scheduled) {
+    scheduled = true;
+    setImmediate(flush);
+  }
+}
+
+// whatever is still buffered must not be lost on exit
+process.on('exit', () => {
+  if (buffer.length) fs.writeSync(1, buffer.join(''));
+});
+
+function format(level: Level, msg: string, fields?: Record<string, unknown>) {
+  const clean = fields && (sanitize(fields) as Record<string, unknown>);
+  if (json) {
+    return `${JSON.stringify({ time: new Date().toISOString(), level, msg, ...clean })}\n`;
+  }
+  const extra = clean && Object.keys(clean).length ? ` ${JSON.stringify(clean)}` : '';
+  return `${new Date().toISOString()} ${level.toUpperCase().padEnd(5)} ${msg}${extra}\n`;
+}
+
+function write(level: Level, msg: string, fields?: Record<string, unknown>) {
+  if (LEVELS[level] < minLevel) return;
+  enqueue(format(level, msg, fields));
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Public API                                                      */
+/* ------------------------------------------------------------------ */
+export const log = {
+  debug: (msg: string, fields?: Record<string, unknown>) => write('debug', msg, fields),
+  info: (msg: string, fields?: Record<string, unknown>) => write('info', msg, fields),
+  warn: (msg: string, fields?: Record<string, unknown>) => write('warn', msg, fields),
+  error: (msg: string, fields?: Record<string, unknown>) => write('error', msg, fields),
+  enabled: (level: Level) => LEVELS[level] >= minLevel,
+};
+
+// LOG_SAMPLE="/v1/chat/completions=0.1,/v1/models=0" (default rate 1)
+const sampleRates = new Map<string, number>();
+for (const entry of (process.env.LOG_SAMPLE ?? '').split(',')) {
+  const sep = entry.lastIndexOf('=');
+  if (sep > 0) sampleRates.set(entry.slice(0, sep).trim(), Number(entry.slice(sep + 1)));
+}
+
+export type RequestLog = typeof log;
+
+const silent: RequestLog = {
+  debug: () => undefined,
+  info: () => undefined,
+  warn: log.warn,                  // problems are never sampled away
+  error: log.error,
+  enabled: (level: Level) => (level === 'warn' || level === 'error') && log.enabled(level),
+};
+
+/** Logger for one request: info/debug lines follow the route's sample rate. */
+export function requestLogger(route: string): RequestLog {
+  const rate = sampleRates.get(route) ?? sampleRates.get('default') ?? 1;
+  return rate >= 1 || Math.random() < rate ? log : silent;
+}
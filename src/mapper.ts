@@ -2,38 +2,159 @@
 /*  mapper.ts – OpenAI ⇆ Gemini (with reasoning/1 M context)           */
 /* ------------------------------------------------------------------ */
 import { fetchAndEncode } from './remoteimage';
-import { z } from 'zod';
-import { ToolRegistry } from '@google/gemini-cli-core/dist/src/tools/tool-registry.js';
-import { getModel } from './chatwrapper';
+import { getModel, resolveModel } from './chatwrapper';
+import { log } from './logger';
+import { mapTools, toToolCall } from './tools';
 
 /* ------------------------------------------------------------------ */
-type Part = { text?: string; inlineData?: { mimeType: string; data: string } };
+type Part = {
+  text?: string;
+  inlineData?: { mimeType: string; data: string };
+  functionCall?: { name: string; args: unknown };
+  functionResponse?: { name: string; response: unknown };
+};
+type Content = { role: 'user' | 'model'; parts: Part[] };
 
-/* ------------------------------------------------------------------ */
-async function callLocalFunction(_name: string, _args: unknown) {
-  return { ok: true };
+// Gemini's candidateCount goes up to 8; fan-out honours the same limit
+const MAX_CHOICES = Number(process.env.MAX_CHOICES ?? 8);
+
+export class InvalidRequestError extends Error {
+  status = 400;
 }
 
-/* ================================================================== */
-/* Request mapper: OpenAI ➞ Gemini                                     */
-/* ================================================================== */
-export async function mapRequest(body: any) {
+/* ------------------------------------------------------------------ */
+/*  Messages ➞ contents                                                 */
+/* ------------------------------------------------------------------ */
+// Everything below builds objects with a fixed key order and no optional
+// keys, so the same conversation prefix always serialises to the same
+// bytes and upstream implicit caching can match it.
+
+/** Text / image_url content ➞ parts; images are filled in later. */
+function contentParts(content: any, images: Promise<void>[]): Part[] {
+  if (typeof content === 'string') return content ? [{ text: content }] : [];
+  if (!Array.isArray(content)) return [];
   const parts: Part[] = [];
+  for (const item of content) {
+    if (item.type === 'image_url') {
+      const url = item.image_url?.url;
+      if (typeof url !== 'string') throw new InvalidRequestError("'image_url.url' must be a string");
+      // keep the slot in order, fill it once every image is fetched
+      const part: Part = {};
+      parts.push(part);
+      const fetched = fetchAndEncode(url).then((d) => {
+        part.inlineData = d;
+      });
+      // mapping may still throw before anyone awaits `images`; a failed
+      // fetch must not surface as an unhandled rejection meanwhile
+      fetched.catch(() => {});
+      images.push(fetched);
+    } else if (item.type === 'text' && item.text) {
+      parts.push({ text: item.text });
+    }
+  }
+  return parts;
+}
+
+function parseArgs(raw: unknown) {
+  if (typeof raw !== 'string') return raw ?? {};
+  try {
+    return JSON.parse(raw || '{}');
+  } catch {
+    return { arguments: raw };
+  }
+}
+
+/**
+ * Tool output as a functionResponse payload (always a JSON object).
+ * Only text parts are read; images have no place in a functionResponse.
+ */
+function toolResponse(content: any) {
+  const text = typeof content === 'string'
+    ? content
+    : Array.isArray(content)
+      ? content.map((item) => (item?.type === 'text' && typeof item.text === 'string' ? item.text : '')).join('')
+      : '';
+  try {
+    const parsed = JSON.parse(text);
+    if (parsed && typeof parsed === 'object' && !Array.isArray(parsed)) return parsed;
+  } catch {
+    /* plain text */
+  }
+  return { content: text };
+}
+
+/**
+ * OpenAI messages ➞ Gemini contents + systemInstruction.
+ * user ➞ user, assistant ➞ model (tool_calls ➞ functionCall), tool /
+ * function ➞ functionResponse on a user turn. Leading system/developer
+ * messages become the system instruction; a system message in the middle
+ * of the chat stays in place as user text so earlier turns keep their bytes.
+ */
+function mapMessages(messages: any[], images: Promise<void>[]) {
+  if (!Array.isArray(messages) || !messages.length) {
+    throw new InvalidRequestError('messages must be a non-empty array');
+  }
+  const system: Part[] = [];
+  const contents: Content[] = [];
+  const callNames = new Map<string, string>();   // tool_call_id ➞ function name
 
-  /* ---- convert messages & vision --------------------------------- */
-  for (const m of body.messages) {
-    if (Array.isArray(m.content)) {
-      for (const item of m.content) {
-        if (item.type === 'image_url') {
-          parts.push({ inlineData: await fetchAndEncode(item.image_url.url) });
-        } else if (item.type === 'text') {
-          parts.push({ text: item.text });
-        }
+  const push = (role: Content['role'], parts: Part[]) => {
+    if (!parts.length) return;
+    const last = contents[contents.length - 1];
+    if (last?.role === role) last.parts.push(...parts);   // Gemini wants alternating turns
+    else contents.push({ role, parts });
+  };
+
+  for (const m of messages) {
+    switch (m.role) {
+    case 'system':
+    case 'developer':
+      if (contents.length) push('user', contentParts(m.content, images));
+      else system.push(...contentParts(m.content, images));
+      break;
+    case 'assistant': {
+      const parts = contentParts(m.content, images);
+      for (const call of m.tool_calls ?? []) {
+        callNames.set(call.id, call.function.name);
+        parts.push({
+          functionCall: { name: call.function.name, args: parseArgs(call.function.arguments) },
+        });
       }
-    } else {
-      parts.push({ text: m.content });
+      if (m.function_call) {
+        parts.push({
+          functionCall: { name: m.function_call.name, args: parseArgs(m.function_call.arguments) },
+        });
+      }
+      push('model', parts);
+      break;
+    }
+    case 'tool':
+    case 'function': {
+      const name = m.name ?? callNames.get(m.tool_call_id) ?? 'unknown';
+      push('user', [{ functionResponse: { name, response: toolResponse(m.content) } }]);
+      break;
     }
+    default:
+      push('user', contentParts(m.content, images));
+    }
+  }
+
+  // a system-only request still needs something to answer
+  if (!contents.length) {
+    if (!system.length) throw new InvalidRequestError('messages must contain some content');
+    return { contents: [{ role: 'user', parts: system }] as Content[], systemInstruction: undefined };
   }
+  const systemInstruction = system.length ? { parts: system } : undefined;
+  return { contents, systemInstruction };
+}
+
+/* ================================================================== */
+/* Request mapper: OpenAI ➞ Gemini                                     */
+/* ================================================================== */
+export async function mapRequest(body: any) {
+  const images: Promise<void>[] = [];
+  const { contents, systemInstruction } = mapMessages(body.messages, images);
+  await Promise.all(images);
 
   /* ---- base generationConfig ------------------------------------- */
   const generationConfig: Record<string, unknown> = {
@@ -52,48 +173,51 @@ export async function mapRequest(body: any) {
     generationConfig.thinking = true;
     generationConfig.thinking_budget ??= 2048;
   }
+  /* ---- n choices ➞ candidateCount (chatwrapper may fan out) ------ */
+  const n = body.n ?? 1;
+  if (!Number.isInteger(n) || n < 1 || n > MAX_CHOICES) {
+    throw new InvalidRequestError(`'n' must be an integer from 1 to ${MAX_CHOICES}`);
+  }
+  if (n > 1) generationConfig.candidateCount = n;
+
   generationConfig.maxInputTokens ??= 1_000_000; // lift context cap
+  if (systemInstruction) generationConfig.systemInstruction = systemInstruction;
+  Object.assign(generationConfig, mapTools(body));   // tools + toolConfig
 
   const geminiReq = {
-    contents: [{ role: 'user', parts }],
+    model: resolveModel(body.model),
+    contents,
     generationConfig,
     stream: body.stream,
   };
 
-  console.log('Gemini request:', geminiReq);
-
-  /* ---- Tool / function mapping ----------------------------------- */
-  const tools = new ToolRegistry({} as any);
-
-  if (body.functions?.length) {
-    const reg = tools as any;
-    body.functions.forEach((fn: any) =>
-      reg.registerTool(
-        fn.name,
-        {
-          title: fn.name,
-          description: fn.description ?? '',
-          inputSchema: z.object(fn.parameters?.properties ?? {}),
-        },
-        async (args: unknown) => callLocalFunction(fn.name, args),
-      ),
-    );
-  }
+  log.debug('Gemini request', { geminiReq });
 
-  return { geminiReq, tools };
+  return { geminiReq };
+}
+
+/* ================================================================== */
+/* Usage: Gemini usageMetadata ➞ OpenAI usage                         */
+/* ================================================================== */
+export function mapUsage(usage: any = {}) {
+  return {
+    prompt_tokens: usage.promptTokenCount ?? usage.promptTokens ?? 0,
+    completion_tokens: usage.candidatesTokenCount ?? usage.candidatesTokens ?? 0,
+    total_tokens: usage.totalTokenCount ?? usage.totalTokens ?? 0,
+  };
 }
 
 /* ================================================================== */
 /* Non-stream response: Gemini ➞ OpenAI                                */
 /* ================================================================== */
-export function mapResponse(gResp: any) {
+export function mapResponse(gResp: any, model: string = getModel()) {
   const usage = gResp.usageMetadata ?? {};
-  const hasError = typeof gResp.candidates === 'undefined';
+  const hasError = !gResp.candidates?.length;
 
-  console.log('Received response:', gResp);
+  log.debug('Received response', { response: gResp });
 
   if (hasError) {
-    console.error('No candidates returned.');
+    log.warn('No candidates returned', { promptFeedback: gResp?.promptFeedback });
 
     return {
       error: {
@@ -102,57 +226,116 @@ export function mapResponse(gResp: any) {
     }
   }
   
-  // Extract content from the response structure
-  let content = '';
-  if (gResp.text) {
-    content = gResp.text;
-  } else if (gResp.candidates && gResp.candidates[0]) {
-    const candidate = gResp.candidates[0];
-    if (candidate.content && candidate.content.parts) {
+  // one choice per candidate; the SDK's `text` getter only reads the first
+  const candidates: any[] = gResp.candidates;
+  const choices = candidates.map((candidate, i) => {
+    const parts: any[] = candidate?.content?.parts ?? [];
+    let content = '';
+    if (candidates.length === 1 && gResp.text) {
+      content = gResp.text;
+    } else if (candidate.content && candidate.content.parts) {
       // Concatenate all text parts
-      content = candidate.content.parts
+      content = parts
         .filter((part: any) => part.text)
         .map((part: any) => part.text)
         .join('');
     } else if (candidate.text) {
       content = candidate.text;
     }
-  }
-  
+    const toolCalls = parts
+      .filter((part) => part.functionCall)
+      .map((part) => toToolCall(part.functionCall));
+
+    const message: any = { role: 'assistant', content: content };
+    if (toolCalls.length) {
+      message.content = content || null;
+      message.tool_calls = toolCalls;
+    }
+    return {
+      index: candidate.index ?? i,
+      message,
+      finish_reason: finishReason(candidate.finishReason, toolCalls.length > 0),
+    };
+  });
+
   return {
     id: `chatcmpl-${Date.now()}`,
     object: 'chat.completion',
     created: Math.floor(Date.now() / 1000),
-    model: getModel(),
-    choices: [
-      {
-        index: 0,
-        message: { role: 'assistant', content: content },
-        finish_reason: 'stop',
-      },
-    ],
-    usage: {
-      prompt_tokens: usage.promptTokens ?? 0,
-      completion_tokens: usage.candidatesTokens ?? 0,
-      total_tokens: usage.totalTokens ?? 0,
-    },
+    model,
+    choices: choices.sort((a, b) => a.index - b.index),
+    usage: mapUsage(usage),
   };
 }
 
+/** Gemini finishReason ➞ OpenAI finish_reason. */
+function finishReason(reason: string | undefined, toolCalls: boolean) {
+  if (toolCalls) return 'tool_calls';
+  if (reason === 'MAX_TOKENS') return 'length';
+  if (reason === 'SAFETY' || reason === 'RECITATION' || reason === 'PROHIBITED_CONTENT') {
+    return 'content_filter';
+  }
+  return 'stop';
+}
+
 /* ================================================================== */
 /* Stream chunk mapper: Gemini ➞ OpenAI                                */
 /* ================================================================== */
+/** Per-stream state: tool call indexes continue across chunks, per choice. */
+export interface StreamState {
+  toolCalls: number[];
+}
 
-export function mapStreamChunk(chunk: any) {
-  const part = chunk?.candidates?.[0]?.content?.parts?.[0] ?? {};
-  const delta: any = { role: 'assistant' };
-
-  if (part.thought === true) {
-    delta.content = `<think>${part.text ?? ''}`;  // ST renders grey bubble
-  } else if (typeof part.text === 'string') {
-    delta.content = part.text;
-  }
-  return { choices: [ { delta, index: 0 } ] };
+export function newStreamState(): StreamState {
+  return { toolCalls: [] };
 }
 
+/** One chunk ➞ one OpenAI choice delta per candidate it carries (maybe none). */
+export function mapStreamChunk(chunk: any, state: StreamState = newStreamState()) {
+  const choices = (chunk?.candidates ?? []).map((candidate: any) => {
+    // protobuf JSON leaves out index 0
+    const index: number = candidate.index ?? 0;
+    const parts: any[] = candidate?.content?.parts ?? [];
+    const delta: any = { role: 'assistant' };
+
+    let text: string | undefined;
+    for (const part of parts) {
+      if (part.thought === true) {
+        text = `${text ?? ''}<think>${part.text ?? ''}`;  // ST renders grey bubble
+      } else if (typeof part.text === 'string') {
+        text = (text ?? '') + part.text;
+      } else if (part.functionCall) {
+        // Gemini sends each call whole, so one delta carries all of it
+        const calls = state.toolCalls[index] ?? 0;
+        state.toolCalls[index] = calls + 1;
+        delta.tool_calls ??= [];
+        delta.tool_calls.push({ index: calls, ...toToolCall(part.functionCall) });
+      }
+    }
+    if (text !== undefined) delta.content = text;
+
+    const choice: any = { delta, index };
+    if (candidate?.finishReason) {
+      choice.finish_reason = finishReason(candidate.finishReason, (state.toolCalls[index] ?? 0) > 0);
+    }
+    return choice;
+  });
+  return { choices };
+}
 
+/* ================================================================== */
+/* Replay a finished completion as stream chunks (cache hits)          */
+/* ================================================================== */
+export function completionToChunks(completion: any) {
+  return completion.choices.flatMap((choice: any) => {
+    const delta = { ...choice.message };
+    // streamed tool calls carry their position in the list
+    if (delta.tool_calls) {
+      delta.tool_calls = delta.tool_calls.map((c: any, i: number) => ({ index: i, ...c }));
+    }
+    return [
+      { choices: [{ index: choice.index, delta }] },
+      { choices: [{ index: choice.index, delta: {}, finish_reason: choice.finish_reason }] },
+    ];
+  });
+}
@@ -0,0 +1,266 @@
+// src/metrics.ts
+/* ------------------------------------------------------------------ */
+/*  Prometheus metrics – fixed-bucket histograms, labelled counters   */
+/* ------------------------------------------------------------------ */
+import { counterSnapshot } from './stats';
+
+/* ------------------------------------------------------------------ */
+/* 1.  Label handling                                                  */
+/* ------------------------------------------------------------------ */
+// Children are looked up through nested maps keyed by each label value.
+// Lookups take the values as fixed positional arguments (at most three
+// labels), so recording a sample allocates no array and builds no key.
+const MAX_LABELS = 3;
+
+class Family<T> {
+  private root = new Map<string, any>();
+
+  constructor(
+    private readonly labelNames: string[],
+    private readonly make: () => T,
+  ) {
+    if (labelNames.length > MAX_LABELS) throw new Error(`At most ${MAX_LABELS} labels per metric`);
+  }
+
+  get(a = '', b = '', c = ''): T {
+    const depth = this.labelNames.length;
+    let node = this.root;
+    if (depth > 1) node = branch(node, a);
+    if (depth > 2) node = branch(node, b);
+    const leaf = depth === 3 ? c : depth === 2 ? b : a;
+    let child = node.get(leaf);
+    if (!child) node.set(leaf, (child = this.make()));
+    return child;
+  }
+
+  /** Every child with its rendered label set, e.g. `{model="x"}`. */
+  entries(): [string, T][] {
+    const out: [string, T][] = [];
+    const walk = (node: Map<string, any>, values: string[]) => {
+      for (const [k, v] of node) {
+        const vals = this.labelNames.length ? [...values, k] : values;
+        if (vals.length === this.labelNames.length) out.push([this.render(vals), v]);
+        else walk(v, vals);
+      }
+    };
+    walk(this.root, []);
+    return out;
+  }
+
+  private render(values: string[]) {
+    if (!values.length) return '';
+    const pairs = values.map((v, i) => `${this.labelNames[i]}="${v.replace(/["\\\n]/g, '_')}"`);
+    return `{${pairs.join(',')}}`;
+  }
+}
+
+function branch(node: Map<string, any>, key: string): Map<string, any> {
+  let next = node.get(key);
+  if (!next) node.set(key, (next = new Map()));
+  return next;
+}
+
+interface Metric {
+  render(): string;
+}
+
+const registry: Metric[] = [];
+
+/* ------------------------------------------------------------------ */
+/* 2.  Metric types                                                    */
+/* ------------------------------------------------------------------ */
+class CounterChild {
+  value = 0;
+  inc(by = 1) {
+    this.value += by;
+  }
+}
+
+export class Counter implements Metric {
+  private family: Family<CounterChild>;
+
+  constructor(private readonly name: string, private readonly help: string, labelNames: string[] = []) {
+    this.family = new Family(labelNames, () => new CounterChild());
+    registry.push(this);
+  }
+
+  labels(a?: string, b?: string, c?: string) {
+    return this.family.get(a, b, c);
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} counter`];
+    for (const [labels, c] of this.family.entries()) lines.push(`${this.name}${labels} ${c.value}`);
+    return lines.join('\n');
+  }
+}
+
+export class Gauge implements Metric {
+  constructor(
+    private readonly name: string,
+    private readonly help: string,
+    private readonly collect: () => number,
+  ) {
+    registry.push(this);
+  }
+
+  render() {
+    return [
+      `# HELP ${this.name} ${this.help}`,
+      `# TYPE ${this.name} gauge`,
+      `${this.name} ${this.collect()}`,
+    ].join('\n');
+  }
+}
+
+class HistogramChild {
+  readonly counts: Float64Array;     // per bucket, not cumulative
+  sum = 0;
+  count = 0;
+
+  constructor(private readonly bounds: number[]) {
+    this.counts = new Float64Array(bounds.length);
+  }
+
+  observe(value: number) {
+    this.sum += value;
+    this.count++;
+    const b = this.bounds;
+    for (let i = 0; i < b.length; i++) {
+      if (value <= b[i]) {
+        this.counts[i]++;
+        return;
+      }
+    }
+  }
+}
+
+// seconds, from a few ms (mapping) up to multi-minute reasoning streams
+export const LATENCY_BUCKETS = [
+  0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+];
+
+export class Histogram implements Metric {
+  private family: Family<HistogramChild>;
+
+  constructor(
+    private readonly name: string,
+    private readonly help: string,
+    labelNames: string[] = [],
+    private readonly bounds: number[] = LATENCY_BUCKETS,
+  ) {
+    this.family = new Family(labelNames, () => new HistogramChild(bounds));
+    registry.push(this);
+  }
+
+  labels(a?: string, b?: string, c?: string) {
+    return this.family.get(a, b, c);
+  }
+
+  observe(value: number) {
+    this.family.get().observe(value);
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+    for (const [labels, h] of this.family.entries()) {
+      const inner = labels ? `${labels.slice(1, -1)},` : '';
+      let cumulative = 0;
+      this.bounds.forEach((le, i) => {
+        cumulative += h.counts[i];
+        lines.push(`${this.name}_bucket{${inner}le="${le}"} ${cumulative}`);
+      });
+      lines.push(`${this.name}_bucket{${inner}le="+Inf"} ${h.count}`);
+      lines.push(`${this.name}_sum${labels} ${h.sum}`);
+      lines.push(`${this.name}_count${labels} ${h.count}`);
+    }
+    return lines.join('\n');
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Proxy metrics                                                   */
+/* ------------------------------------------------------------------ */
+export const bodyParseSeconds = new Histogram(
+  'proxy_body_parse_seconds', 'Time to read and parse the request body');
+export const mapRequestSeconds = new Histogram(
+  'proxy_map_request_seconds', 'Time spent in mapRequest (incl. image fetches)');
+export const upstreamTtfbSeconds = new Histogram(
+  'proxy_upstream_ttfb_seconds', 'Upstream call start to first response byte/chunk', ['model']);
+export const ttftSeconds = new Histogram(
+  'proxy_ttft_seconds', 'Request start to first content token sent to the client', ['model']);
+export const streamSeconds = new Histogram(
+  'proxy_stream_duration_seconds', 'Total duration of streamed responses', ['model']);
+export const requestSeconds = new Histogram(
+  'proxy_request_duration_seconds', 'Total chat completion request duration', ['model']);
+
+export const tokensTotal = new Counter(
+  'proxy_tokens_total', 'Tokens reported by usageMetadata', ['model', 'credential', 'type']);
+export const errorsTotal = new Counter(
+  'proxy_errors_total', 'Failed requests by class (4xx, 429, 5xx, abort)', ['class']);
+
+/** Register gauges whose values live elsewhere (scheduler, pool, …). */
+export function gauge(name: string, help: string, collect: () => number) {
+  return new Gauge(name, help, collect);
+}
+
+/** Record prompt/completion tokens from a usageMetadata block. */
+export function recordUsage(model: string, credential: string, usage: any) {
+  if (!usage) return;
+  tokensTotal.labels(model, credential, 'prompt').inc(usage.promptTokenCount ?? 0);
+  tokensTotal.labels(model, credential, 'completion').inc(usage.candidatesTokenCount ?? 0);
+  // served from explicit or implicit context caching (part of prompt)
+  if (usage.cachedContentTokenCount) {
+    tokensTotal.labels(model, credential, 'cached').inc(usage.cachedContentTokenCount);
+  }
+}
+
+export function errorClass(status: number, aborted: boolean) {
+  if (aborted) return 'abort';
+  if (status === 429) return '429';
+  return status >= 500 ? '5xx' : '4xx';
+}
+
+/** Prometheus text exposition of every metric plus the /stats counters. */
+export function renderMetrics() {
+  const events = Object.entries(counterSnapshot())
+    .map(([name, v]) => `proxy_events_total{event="${name}"} ${v}`);
+  return [
+    ...registry.map((m) => m.render()),
+    '# HELP proxy_events_total Process event counters (requests, cancellations, cache hits, …)',
+    '# TYPE proxy_events_total counter',
+    ...events,
+  ].join('\n') + '\n';
+}
+
+/**
+ * Several workers' expositions as one, summed series by series: counters,
+ * histogram buckets and the queue gauges all add up across a cluster.
+ */
+export function mergeMetrics(texts: string[]) {
+  if (texts.length === 1) return texts[0];
+  const families = new Map<string, { header: string[]; series: Map<string, number> }>();
+  for (const text of texts) {
+    let family: { header: string[]; series: Map<string, number> } | undefined;
+    for (const line of text.split('\n')) {
+      if (!line) continue;
+      if (line.startsWith('# HELP ')) {
+        const name = line.split(' ', 3)[2];
+        family = families.get(name);
+        if (!family) families.set(name, (family = { header: [line], series: new Map() }));
+      } else if (line.startsWith('#')) {
+        if (family && !family.header.includes(line)) family.header.push(line);
+      } else if (family) {
+        const cut = line.lastIndexOf(' ');
+        const key = line.slice(0, cut);
+        family.series.set(key, (family.series.get(key) ?? 0) + Number(line.slice(cut + 1)));
+      }
+    }
+  }
+  const lines: string[] = [];
+  for (const { header, series } of families.values()) {
+    lines.push(...header);
+    for (const [key, value] of series) lines.push(`${key} ${value}`);
+  }
+  return lines.join('\n') + '\n';
+}
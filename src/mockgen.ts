@@ -0,0 +1,240 @@
+// src/mockgen.ts
+/* ------------------------------------------------------------------ */
+/*  Mock content generator (AUTH_TYPE=mock) – offline, deterministic  */
+/* ------------------------------------------------------------------ */
+import { sleep, throwIfAborted } from './retry';
+import { estimateTokens } from './tokens';
+
+const env = (name: string, fallback: number) => Number(process.env[name] ?? fallback);
+
+const TTFB_MS = env('MOCK_TTFB_MS', 200);
+const TOKENS_PER_SEC = env('MOCK_TOKENS_PER_SEC', 50);      // 0 = no pacing
+const CHUNK_TOKENS = Math.max(1, env('MOCK_CHUNK_TOKENS', 5));
+const OUTPUT_TOKENS = env('MOCK_OUTPUT_TOKENS', 100);
+const THOUGHT_TOKENS = env('MOCK_THOUGHT_TOKENS', 0);
+const USAGE = process.env.MOCK_USAGE !== '0' && process.env.MOCK_USAGE !== 'false';
+const RATE_LIMIT_RATE = env('MOCK_429_RATE', 0);
+const ERROR_RATE = env('MOCK_5XX_RATE', 0);
+const SEED = env('MOCK_SEED', 1);
+const EMBED_DIMENSIONS = 3072;      // gemini-embedding-001 default
+
+const WORDS = (
+  'the quick brown fox jumps over a lazy dog while gemini streams tokens ' +
+  'through the proxy and every chunk arrives right on time for the client'
+).split(' ');
+
+export class MockApiError extends Error {
+  constructor(public status: number, message: string) {
+    super(message);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Determinism                                                     */
+/* ------------------------------------------------------------------ */
+// mulberry32: tiny, fast, good enough for picking words and failures
+function prng(seed: number) {
+  let a = seed >>> 0;
+  return () => {
+    a = (a + 0x6d2b79f5) >>> 0;
+    let t = a;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+// FNV-1a over the request, so the same request always gets the same answer
+// no matter how many others run concurrently
+function hash(text: string) {
+  let h = 0x811c9dc5;
+  for (let i = 0; i < text.length; i++) {
+    h ^= text.charCodeAt(i);
+    h = Math.imul(h, 0x01000193);
+  }
+  return h >>> 0;
+}
+
+// request hash ➞ failures so far: each retry of a request rolls anew, so
+// MOCK_429_RATE fails a share of attempts instead of the same prompts forever
+const failures = new Map<number, number>();
+
+/* ------------------------------------------------------------------ */
+/* 2.  Generator                                                       */
+/* ------------------------------------------------------------------ */
+interface Request {
+  model: string;
+  contents: any[];
+  config?: Record<string, any>;
+}
+
+interface Plan {
+  key: number;             // hash of the request contents
+  random: () => number;
+  candidates: (() => number)[];   // word picks per candidate (candidateCount)
+  output: number;          // answer tokens
+  thoughts: number;
+  prompt: { total: number; cached: number };
+}
+
+/** Drop-in for the gemini-cli-core ContentGenerator, no network involved. */
+export class MockGenerator {
+  private cached = new Map<string, { tokens: number; expires: number }>();
+  private nextCache = 0;
+
+  constructor(readonly model: string) {}
+
+  async generateContent(req: Request) {
+    const signal = req.config?.abortSignal;
+    const plan = this.plan(req);
+    await this.fail(plan.key, signal);
+    await sleep(TTFB_MS + this.pace(plan.output + plan.thoughts), signal);
+    return this.response(req, plan, this.parts(plan, plan.output, plan.thoughts), true);
+  }
+
+  async generateContentStream(req: Request) {
+    const signal = req.config?.abortSignal;
+    const plan = this.plan(req);
+    await this.fail(plan.key, signal);
+    const self = this;
+
+    return (async function* () {
+      await sleep(TTFB_MS, signal);
+      if (plan.thoughts) {
+        await sleep(self.pace(plan.thoughts), signal);
+        yield self.response(req, plan, self.parts(plan, 0, plan.thoughts), false);
+      }
+      for (let sent = 0; sent < plan.output; sent += CHUNK_TOKENS) {
+        const n = Math.min(CHUNK_TOKENS, plan.output - sent);
+        if (sent) await sleep(self.pace(n), signal);
+        const last = sent + n >= plan.output;
+        yield self.response(req, plan, self.parts(plan, n, 0), last);
+      }
+      if (!plan.output) yield self.response(req, plan, self.parts(plan, 0, 0), true);
+    })();
+  }
+
+  async countTokens(req: Request) {
+    return { totalTokens: estimateTokens(req.contents, req.config?.systemInstruction) };
+  }
+
+  /** Unit vectors seeded by each text, so equal inputs embed equally. */
+  async embedContent(req: { model: string; contents: string[]; config?: Record<string, any> }) {
+    const signal = req.config?.abortSignal;
+    await this.fail(hash(JSON.stringify(req.contents)), signal);
+    await sleep(TTFB_MS / 4, signal);
+    const dims = req.config?.outputDimensionality ?? EMBED_DIMENSIONS;
+    const embeddings = req.contents.map((text) => {
+      const next = prng(SEED ^ hash(text));
+      const values = Array.from({ length: dims }, () => next() * 2 - 1);
+      const norm = Math.hypot(...values) || 1;
+      return { values: values.map((v) => v / norm) };
+    });
+    return { embeddings };
+  }
+
+  /** Cached-content backend, so context caching can be exercised offline. */
+  readonly caches = {
+    create: async (req: { contents: any[]; systemInstruction?: any; ttlSeconds: number }) => {
+      const name = `cachedContents/mock-${++this.nextCache}`;
+      const tokens = estimateTokens(req.contents, req.systemInstruction);
+      this.cached.set(name, { tokens, expires: Date.now() + req.ttlSeconds * 1000 });
+      return { name, tokens };
+    },
+    update: async (name: string, ttlSeconds: number) => {
+      const entry = this.cached.get(name);
+      if (!entry) throw new MockApiError(404, `${name} not found`);
+      entry.expires = Date.now() + ttlSeconds * 1000;
+    },
+    delete: async (name: string) => {
+      this.cached.delete(name);
+    },
+  };
+
+  /* ---------------------------------------------------------------- */
+  private plan(req: Request): Plan {
+    const key = hash(JSON.stringify(req.contents));
+    const seed = SEED ^ key;
+    const random = prng(seed);
+    const max = req.config?.maxOutputTokens;
+    const output = typeof max === 'number' ? Math.min(OUTPUT_TOKENS, max) : OUTPUT_TOKENS;
+    const count = Math.max(1, req.config?.candidateCount ?? 1);
+    const candidates = Array.from({ length: count }, (_, i) => (i ? prng(seed + i) : random));
+    return { key, random, candidates, output, thoughts: THOUGHT_TOKENS, prompt: this.promptTokens(req) };
+  }
+
+  private promptTokens(req: Request) {
+    const name = req.config?.cachedContent;
+    const entry = name && this.cached.get(name);
+    if (name && (!entry || entry.expires < Date.now())) {
+      throw new MockApiError(404, `CachedContent ${name} not found`);
+    }
+    const sent = estimateTokens(req.contents, req.config?.systemInstruction);
+    return { total: sent + (entry ? entry.tokens : 0), cached: entry ? entry.tokens : 0 };
+  }
+
+  /** Roll for an injected failure; seeded by the request and its attempt number. */
+  private async fail(key: number, signal?: AbortSignal) {
+    throwIfAborted(signal);
+    const attempt = failures.get(key) ?? 0;
+    const roll = prng(SEED ^ key ^ Math.imul(attempt + 1, 0x9e3779b1))();
+    if (roll >= RATE_LIMIT_RATE + ERROR_RATE) {
+      failures.delete(key);
+      return;
+    }
+    failures.set(key, attempt + 1);
+    await sleep(Math.min(TTFB_MS, 50), signal);
+    if (roll < RATE_LIMIT_RATE) {
+      throw new MockApiError(429, 'RESOURCE_EXHAUSTED (mock): Please retry in 1s');
+    }
+    throw new MockApiError(503, 'UNAVAILABLE (mock): The model is overloaded');
+  }
+
+  /** Time the real backend would need for `tokens` at MOCK_TOKENS_PER_SEC. */
+  private pace(tokens: number) {
+    return TOKENS_PER_SEC > 0 ? (tokens / TOKENS_PER_SEC) * 1000 : 0;
+  }
+
+  private words(random: () => number, n: number) {
+    let text = '';
+    for (let i = 0; i < n; i++) text += `${WORDS[Math.floor(random() * WORDS.length)]} `;
+    return text;
+  }
+
+  /** Parts of every candidate for the next `n` answer / `thoughts` tokens. */
+  private parts(plan: Plan, n: number, thoughts: number) {
+    return plan.candidates.map((random) => {
+      const parts: any[] = [];
+      if (thoughts) parts.push({ text: this.words(random, thoughts), thought: true });
+      if (n) parts.push({ text: this.words(random, n) });
+      return parts;
+    });
+  }
+
+  private response(req: Request, plan: Plan, parts: any[][], last: boolean) {
+    // a forced function call (tool_choice "required" / named) answers with a call
+    const mode = req.config?.toolConfig?.functionCallingConfig;
+    const decl = req.config?.tools?.[0]?.functionDeclarations?.[0];
+    if (last && mode?.mode === 'ANY' && decl) {
+      parts = parts.map(() => [{ functionCall: { name: mode.allowedFunctionNames?.[0] ?? decl.name, args: {} } }]);
+    }
+    const resp: any = {
+      candidates: parts.map((p, index) => ({
+        index,
+        content: { role: 'model', parts: p },
+        ...(last ? { finishReason: 'STOP' } : {}),
+      })),
+    };
+    if (USAGE && last) {
+      const output = (plan.output + plan.thoughts) * parts.length;
+      resp.usageMetadata = {
+        promptTokenCount: plan.prompt.total,
+        candidatesTokenCount: plan.output * parts.length,
+        thoughtsTokenCount: plan.thoughts * parts.length || undefined,
+        cachedContentTokenCount: plan.prompt.cached || undefined,
+        totalTokenCount: plan.prompt.total + output,
+      };
+    }
+    return resp;
+  }
+}
@@ -0,0 +1,303 @@
+// src/pool.ts
+/* ------------------------------------------------------------------ */
+/*  Generator pool – spreads traffic over several Gemini credentials  */
+/* ------------------------------------------------------------------ */
+import { classifyError, retryDelayMs } from './retry';
+import { log } from './logger';
+
+/* ------------------------------------------------------------------ */
+/* 1.  Credential spec                                                 */
+/* ------------------------------------------------------------------ */
+export interface Credential {
+  id: string;            // label used in logs, never the secret itself
+  authType: string;      // 'oauth-personal' | 'gemini-api-key' | 'vertex-ai' | 'mock'
+  apiKey?: string;       // only for gemini-api-key
+  credsFile?: string;    // only for oauth-personal
+}
+
+const AUTH_ALIASES: Record<string, string> = {
+  oauth: 'oauth-personal',
+  'oauth-personal': 'oauth-personal',
+  key: 'gemini-api-key',
+  'gemini-api-key': 'gemini-api-key',
+  vertex: 'vertex-ai',
+  'vertex-ai': 'vertex-ai',
+  mock: 'mock',
+};
+
+/**
+ * Parse GEMINI_CREDENTIALS, a comma-separated list such as
+ *   oauth:/home/me/.gemini/oauth_creds.json,key:AIza...,vertex
+ * When empty, a single credential is built from AUTH_TYPE so existing
+ * single-account setups keep working unchanged.
+ */
+export function parseCredentials(
+  spec: string | undefined,
+  fallbackAuthType: string,
+): Credential[] {
+  const entries = (spec ?? '')
+    .split(',')
+    .map((s) => s.trim())
+    .filter(Boolean);
+
+  if (!entries.length) {
+    return [{
+      id: fallbackAuthType,
+      authType: fallbackAuthType,
+      apiKey: process.env.GEMINI_API_KEY || undefined,
+      credsFile: process.env.GOOGLE_APPLICATION_CREDENTIALS || undefined,
+    }];
+  }
+
+  return entries.map((entry, i) => {
+    const sep = entry.indexOf(':');
+    const kind = sep === -1 ? entry : entry.slice(0, sep);
+    const value = sep === -1 ? '' : entry.slice(sep + 1);
+    const authType = AUTH_ALIASES[kind];
+    if (!authType) {
+      throw new Error(`Unknown credential type "${kind}" in GEMINI_CREDENTIALS`);
+    }
+    const cred: Credential = { id: `${kind}#${i + 1}`, authType };
+    if (authType === 'gemini-api-key') {
+      cred.apiKey = value;
+      cred.id += `(…${value.slice(-4)})`;
+    } else if (authType === 'oauth-personal' && value) {
+      cred.credsFile = value;
+    }
+    return cred;
+  });
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Errors                                                          */
+/* ------------------------------------------------------------------ */
+export class PoolExhaustedError extends Error {
+  status = 429;
+  constructor(public retryAfter: number) {
+    super(`All credentials are cooling down or over budget; retry in ${retryAfter}s`);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Pool members                                                    */
+/* ------------------------------------------------------------------ */
+export interface PoolOptions {
+  rpm: number;           // requests per minute per credential (0 = unlimited)
+  tpd: number;           // tokens per day per credential (0 = unlimited)
+  cooldownMs: number;    // how long a member rests after a 429
+  publish?: (event: PoolEvent) => void;   // share quota use with other workers
+}
+
+/** Quota bookkeeping that other processes replay via applyRemote(). */
+export type PoolEvent =
+  | { kind: 'start'; id: string; at: number }
+  | { kind: 'tokens'; id: string; tokens: number }
+  | { kind: 'cooldown'; id: string; model: string; until: number };
+
+const MINUTE = 60_000;
+
+function dayStamp(now: number) {
+  return Math.floor(now / 86_400_000);
+}
+
+export type GeneratorFactory = (cred: Credential, model: string) => Promise<any>;
+
+export class PoolMember {
+  inFlight = 0;
+  tokensToday = 0;
+  private day = dayStamp(Date.now());
+  private recent: number[] = [];          // request start times, last minute
+  private cooldowns = new Map<string, number>();       // model -> until
+  private generators = new Map<string, Promise<any>>(); // model -> generator
+
+  constructor(
+    public readonly cred: Credential,
+    private readonly factory: GeneratorFactory,
+  ) {}
+
+  /** Lazily create (and cache) this credential's generator for a model. */
+  getGenerator(model: string): Promise<any> {
+    let generator = this.generators.get(model);
+    if (!generator) {
+      generator = this.factory(this.cred, model).catch((err) => {
+        this.generators.delete(model);  // try again on the next request
+        throw err;
+      });
+      this.generators.set(model, generator);
+    }
+    return generator;
+  }
+
+  /** Quotas are per model, so a 429 only rests this credential for that model. */
+  coolDown(model: string, until: number) {
+    this.cooldowns.set(model, until);
+  }
+
+  cooldownLeft(model: string, now: number) {
+    return Math.max(0, (this.cooldowns.get(model) ?? 0) - now);
+  }
+
+  /** Drop timestamps older than a minute and reset the daily counter. */
+  refresh(now: number) {
+    while (this.recent.length && this.recent[0] <= now - MINUTE) this.recent.shift();
+    const today = dayStamp(now);
+    if (today !== this.day) {
+      this.day = today;
+      this.tokensToday = 0;
+    }
+  }
+
+  requestsLastMinute() {
+    return this.recent.length;
+  }
+
+  /** Milliseconds until this member can take a request for `model` (0 = now). */
+  waitTime(model: string, now: number, opts: PoolOptions): number {
+    this.refresh(now);
+    let wait = this.cooldownLeft(model, now);
+    if (opts.rpm > 0 && this.recent.length >= opts.rpm) {
+      wait = Math.max(wait, this.recent[this.recent.length - opts.rpm] + MINUTE - now);
+    }
+    if (opts.tpd > 0 && this.tokensToday >= opts.tpd) {
+      wait = Math.max(wait, (this.day + 1) * 86_400_000 - now);
+    }
+    return wait;
+  }
+
+  markStart(now: number) {
+    this.inFlight++;
+    this.noteStart(now);
+  }
+
+  /** Count a request against the RPM budget without holding a slot here. */
+  noteStart(at: number) {
+    this.recent.push(at);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 4.  Lease – one upstream call on one member                         */
+/* ------------------------------------------------------------------ */
+export class Lease {
+  private done = false;
+
+  constructor(
+    public readonly member: PoolMember,
+    public readonly model: string,
+    private readonly pool: GeneratorPool,
+  ) {}
+
+  generator() {
+    return this.member.getGenerator(this.model);
+  }
+
+  release(outcome: { tokens?: number; error?: unknown } = {}) {
+    if (this.done) return;
+    this.done = true;
+    this.pool.settle(this.member, this.model, outcome);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 5.  The pool                                                        */
+/* ------------------------------------------------------------------ */
+export class GeneratorPool {
+  readonly members: PoolMember[];
+
+  constructor(
+    creds: Credential[],
+    factory: GeneratorFactory,
+    private readonly opts: PoolOptions,
+  ) {
+    if (!creds.length) throw new Error('Generator pool needs at least one credential');
+    this.members = creds.map((c) => new PoolMember(c, factory));
+  }
+
+  /** Pick the least-loaded healthy member for `model` or throw PoolExhaustedError. */
+  acquire(model: string): Lease {
+    const now = Date.now();
+    let best: PoolMember | undefined;
+    let soonest = Infinity;
+
+    for (const m of this.members) {
+      const wait = m.waitTime(model, now, this.opts);
+      if (wait > 0) {
+        soonest = Math.min(soonest, wait);
+        continue;
+      }
+      if (
+        !best ||
+        m.inFlight < best.inFlight ||
+        (m.inFlight === best.inFlight && m.requestsLastMinute() < best.requestsLastMinute())
+      ) {
+        best = m;
+      }
+    }
+
+    if (!best) throw new PoolExhaustedError(Math.ceil(soonest / 1000));
+    best.markStart(now);
+    this.opts.publish?.({ kind: 'start', id: best.cred.id, at: now });
+    return new Lease(best, model, this);
+  }
+
+  settle(
+    member: PoolMember,
+    model: string,
+    { tokens, error }: { tokens?: number; error?: unknown },
+  ) {
+    member.inFlight = Math.max(0, member.inFlight - 1);
+    if (tokens) {
+      member.tokensToday += tokens;
+      this.opts.publish?.({ kind: 'tokens', id: member.cred.id, tokens });
+    }
+    if (error && classifyError(error) === 'rate_limit') {
+      const cooldown = retryDelayMs(error) ?? this.opts.cooldownMs;
+      const until = Date.now() + cooldown;
+      member.coolDown(model, until);
+      this.opts.publish?.({ kind: 'cooldown', id: member.cred.id, model, until });
+      log.warn('Credential hit quota, cooling down', {
+        credential: member.cred.id,
+        model,
+        cooldown_ms: cooldown,
+      });
+    }
+  }
+
+  /** Replay quota use reported by another worker. */
+  applyRemote(event: PoolEvent) {
+    const member = this.members.find((m) => m.cred.id === event.id);
+    if (!member) return;
+    if (event.kind === 'start') member.noteStart(event.at);
+    else if (event.kind === 'tokens') member.tokensToday += event.tokens;
+    else member.coolDown(event.model, event.until);
+  }
+
+  /** Initialise every member; resolves with how many succeeded. */
+  async warmup(model: string) {
+    const results = await Promise.all(
+      this.members.map((m) =>
+        m.getGenerator(model).then(
+          () => true,
+          (err) => {
+            log.error('Credential failed to initialise', { credential: m.cred.id, err });
+            return false;
+          },
+        ),
+      ),
+    );
+    return results.filter(Boolean).length;
+  }
+
+  snapshot() {
+    const now = Date.now();
+    return this.members.map((m) => {
+      m.refresh(now);
+      return {
+        id: m.cred.id,
+        in_flight: m.inFlight,
+        requests_last_minute: m.requestsLastMinute(),
+        tokens_today: m.tokensToday,
+      };
+    });
+  }
+}
@@ -1,9 +1,131 @@
-import { fetch } from 'undici';     // Node ≥18 has global fetch; otherwise add undici
-
-export async function fetchAndEncode(url: string) {
-  const res = await fetch(url);
-  if (!res.ok) throw new Error(`Failed to fetch image: ${url}`);
-  const buf = Buffer.from(await res.arrayBuffer());
-  const mimeType = res.headers.get('content-type') || 'image/png';
-  return { mimeType, data: buf.toString('base64') };
+// uses the global fetch (Node ≥18), no extra HTTP client to load at startup
+import { LruCache } from './cache';
+
+/* ── limits ───────────────────────────────────────────────────────── */
+const MAX_BYTES = Number(process.env.IMAGE_MAX_BYTES ?? 20 * 1024 * 1024);
+const FETCH_TIMEOUT_MS = Number(process.env.IMAGE_FETCH_TIMEOUT_MS ?? 15_000);
+const FETCH_CONCURRENCY = Number(process.env.IMAGE_FETCH_CONCURRENCY ?? 8);
+// cached images are reused without asking the origin for this long,
+// then revalidated with If-None-Match / If-Modified-Since
+const FRESH_MS = Number(process.env.IMAGE_CACHE_FRESH_MS ?? 60_000);
+
+export class ImageFetchError extends Error {
+  status = 400;
+}
+
+type Encoded = { mimeType: string; data: string };
+
+interface CachedImage extends Encoded {
+  etag?: string;
+  lastModified?: string;
+  checkedAt: number;
+}
+
+const cache = new LruCache<CachedImage>({
+  maxEntries: Number(process.env.IMAGE_CACHE_MAX_ENTRIES ?? 256),
+  maxBytes: Number(process.env.IMAGE_CACHE_MAX_BYTES ?? 128 * 1024 * 1024),
+  ttlMs: Number(process.env.IMAGE_CACHE_TTL_MS ?? 30 * 60_000),
+});
+
+// the same URL requested twice at once is only downloaded once
+const inflight = new Map<string, Promise<Encoded>>();
+
+/* ── global fetch concurrency bound ───────────────────────────────── */
+let active = 0;
+const waiting: (() => void)[] = [];
+
+async function withSlot<T>(fn: () => Promise<T>): Promise<T> {
+  if (active < FETCH_CONCURRENCY) active++;
+  else await new Promise<void>((r) => waiting.push(r));
+  try {
+    return await fn();
+  } finally {
+    const next = waiting.shift();
+    if (next) next();              // hand the slot over
+    else active--;
+  }
+}
+
+/* ── data: URIs never touch the network ───────────────────────────── */
+function decodeDataUrl(url: string): Encoded {
+  const comma = url.indexOf(',');
+  if (comma === -1) throw new ImageFetchError('Malformed data: URL');
+  const meta = url.slice(5, comma);                 // after "data:"
+  const payload = url.slice(comma + 1);
+  const isBase64 = /;base64$/i.test(meta);
+  const mimeType = meta.replace(/;base64$/i, '').split(';')[0] || 'image/png';
+  const data = isBase64
+    ? payload
+    : Buffer.from(decodeURIComponent(payload)).toString('base64');
+  if ((data.length * 3) / 4 > MAX_BYTES) {
+    throw new ImageFetchError(`Image exceeds ${MAX_BYTES} bytes`);
+  }
+  return { mimeType, data };
+}
+
+/* ── download with size guard + conditional revalidation ──────────── */
+async function download(url: string, cached?: CachedImage): Promise<Encoded> {
+  const headers: Record<string, string> = {};
+  if (cached?.etag) headers['If-None-Match'] = cached.etag;
+  if (cached?.lastModified) headers['If-Modified-Since'] = cached.lastModified;
+
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), FETCH_TIMEOUT_MS);
+  try {
+    const res = await fetch(url, { headers, signal: controller.signal });
+
+    if (res.status === 304 && cached) {
+      cached.checkedAt = Date.now();
+      return cached;
+    }
+    if (!res.ok) throw new ImageFetchError(`Failed to fetch image: ${url}`);
+    if (Number(res.headers.get('content-length') ?? 0) > MAX_BYTES) {
+      throw new ImageFetchError(`Image exceeds ${MAX_BYTES} bytes: ${url}`);
+    }
+
+    const chunks: Buffer[] = [];
+    let size = 0;
+    for await (const chunk of res.body ?? []) {
+      size += chunk.length;
+      if (size > MAX_BYTES) {
+        controller.abort();          // stop downloading right away
+        throw new ImageFetchError(`Image exceeds ${MAX_BYTES} bytes: ${url}`);
+      }
+      chunks.push(Buffer.from(chunk));
+    }
+
+    const image: CachedImage = {
+      mimeType: res.headers.get('content-type') || 'image/png',
+      data: Buffer.concat(chunks, size).toString('base64'),
+      etag: res.headers.get('etag') ?? undefined,
+      lastModified: res.headers.get('last-modified') ?? undefined,
+      checkedAt: Date.now(),
+    };
+    cache.set(url, image, image.data.length);
+    return image;
+  } catch (err: any) {
+    if (controller.signal.aborted && !(err instanceof ImageFetchError)) {
+      throw new ImageFetchError(`Timed out fetching image: ${url}`);
+    }
+    throw err;
+  } finally {
+    clearTimeout(timer);
+  }
+}
+
+export async function fetchAndEncode(url: string): Promise<Encoded> {
+  if (url.startsWith('data:')) return decodeDataUrl(url);
+
+  const cached = cache.get(url);
+  if (cached && Date.now() - cached.checkedAt < FRESH_MS) {
+    return { mimeType: cached.mimeType, data: cached.data };
+  }
+
+  let pending = inflight.get(url);
+  if (!pending) {
+    pending = withSlot(() => download(url, cached)).finally(() => inflight.delete(url));
+    inflight.set(url, pending);
+  }
+  const { mimeType, data } = await pending;
+  return { mimeType, data };
 }
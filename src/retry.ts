@@ -0,0 +1,259 @@
+// src/retry.ts
+/* ------------------------------------------------------------------ */
+/*  Upstream retry policy – classify, back off with jitter, hedge     */
+/* ------------------------------------------------------------------ */
+
+import { log } from './logger';
+
+/* ------------------------------------------------------------------ */
+/* 1.  Error classification                                            */
+/* ------------------------------------------------------------------ */
+export type ErrorClass = 'rate_limit' | 'unavailable' | 'abort' | 'client' | 'fatal';
+
+/** The client went away before we finished. */
+export class RequestAbortedError extends Error {
+  name = 'AbortError';
+  status = 499;
+  constructor() {
+    super('Client closed the request');
+  }
+}
+
+/** The per-request deadline (REQUEST_TIMEOUT_MS) expired. */
+export class DeadlineExceededError extends Error {
+  name = 'TimeoutError';
+  status = 504;
+  constructor(ms: number) {
+    super(`Request exceeded its ${ms} ms deadline`);
+  }
+}
+
+export function throwIfAborted(signal?: AbortSignal) {
+  if (signal?.aborted) throw signal.reason;
+}
+
+/** Child controller that follows `parent`; call dispose() when done with it. */
+export function linkedAbort(parent?: AbortSignal) {
+  const controller = new AbortController();
+  const onAbort = () => controller.abort(parent?.reason);
+  if (parent?.aborted) onAbort();
+  else parent?.addEventListener('abort', onAbort, { once: true });
+  return {
+    controller,
+    signal: controller.signal,
+    dispose: () => parent?.removeEventListener('abort', onAbort),
+  };
+}
+
+// Where upstream errors spell their status out in the message only:
+// "[GoogleGenerativeAI Error]: … [429 Too Many Requests]", "got status: 503
+// Service Unavailable", gaxios' "Request failed with status code 500" and
+// a JSON error body's "code": 429. Any other number in a message (an image
+// URL, a token count) says nothing about the status.
+const STATUS_IN_MESSAGE = [
+  /\[([45]\d\d)(?: [A-Za-z ]+)?\]/,
+  /got status: ([45]\d\d)\b/,
+  /status code ([45]\d\d)\b/,
+  /"code"\s*:\s*([45]\d\d)\b/,
+];
+
+/** HTTP-ish status carried by genai, gaxios or our own errors. */
+export function errorStatus(err: any): number | undefined {
+  for (const s of [err?.status, err?.code, err?.response?.status]) {
+    if (typeof s === 'number' && s >= 400 && s < 600) return s;
+  }
+  const message = String(err?.message ?? '');
+  for (const pattern of STATUS_IN_MESSAGE) {
+    const m = pattern.exec(message);
+    if (m) return Number(m[1]);
+  }
+  return undefined;
+}
+
+export function classifyError(err: any): ErrorClass {
+  if (err?.name === 'AbortError' || err?.name === 'TimeoutError') return 'abort';
+  const status = errorStatus(err);
+  if (status === 429 || /quota|RESOURCE_EXHAUSTED/i.test(String(err?.message ?? ''))) {
+    return 'rate_limit';
+  }
+  if (status === 408 || (status !== undefined && status >= 500)) return 'unavailable';
+  if (['ECONNRESET', 'ETIMEDOUT', 'ECONNREFUSED', 'EAI_AGAIN'].includes(err?.code)) {
+    return 'unavailable';
+  }
+  if (status !== undefined) return 'client';
+  return 'fatal';
+}
+
+export function isRetryable(err: any) {
+  const cls = classifyError(err);
+  return cls === 'rate_limit' || cls === 'unavailable';
+}
+
+/**
+ * Delay the server asked for, in ms: our own `retryAfter` (seconds),
+ * a google.rpc.RetryInfo `retryDelay: "12s"`, or "Please retry in 12.3s".
+ */
+export function retryDelayMs(err: any): number | undefined {
+  if (typeof err?.retryAfter === 'number') return err.retryAfter * 1000;
+  const text = `${err?.message ?? ''} ${JSON.stringify(err?.errorDetails ?? err?.response?.data ?? '')}`;
+  const m =
+    /retryDelay"?\s*:\s*"(\d+(?:\.\d+)?)s"/.exec(text) ??
+    /retry in (\d+(?:\.\d+)?)\s*s/i.exec(text);
+  return m ? Math.ceil(Number(m[1]) * 1000) : undefined;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Retry with exponential backoff + full jitter                    */
+/* ------------------------------------------------------------------ */
+export interface RetryOptions {
+  maxAttempts: number;
+  baseDelayMs: number;
+  maxDelayMs: number;
+  deadlineMs: number;      // overall budget across all attempts
+}
+
+export function sleep(ms: number, signal?: AbortSignal) {
+  return new Promise<void>((resolve, reject) => {
+    const onAbort = () => {
+      clearTimeout(timer);
+      reject(signal?.reason);
+    };
+    const timer = setTimeout(() => {
+      signal?.removeEventListener('abort', onAbort);
+      resolve();
+    }, ms);
+    signal?.addEventListener('abort', onAbort, { once: true });
+  });
+}
+
+/**
+ * Run `fn` until it succeeds, a non-retryable error comes back or the
+ * attempts run out. `deadlineMs` bounds the whole thing: the signal given
+ * to `fn` aborts with a DeadlineExceededError once it passes, so a hung
+ * attempt is cut short too. That signal keeps following `signal` after a
+ * success, since the result (an open stream) may still be using it.
+ */
+export async function withRetry<T>(
+  fn: (attempt: number, signal: AbortSignal) => Promise<T>,
+  opts: RetryOptions,
+  signal?: AbortSignal,
+): Promise<T> {
+  const deadline = Date.now() + opts.deadlineMs;
+  const bounded = linkedAbort(signal);
+  const timer = setTimeout(
+    () => bounded.controller.abort(new DeadlineExceededError(opts.deadlineMs)),
+    opts.deadlineMs,
+  );
+  try {
+    for (let attempt = 0; ; attempt++) {
+      throwIfAborted(bounded.signal);
+      try {
+        return await fn(attempt, bounded.signal);
+      } catch (err) {
+        throwIfAborted(bounded.signal);   // report the cancellation, not its fallout
+        if (!isRetryable(err) || attempt + 1 >= opts.maxAttempts) throw err;
+        const backoff = Math.random() * Math.min(opts.maxDelayMs, opts.baseDelayMs * 2 ** attempt);
+        const delay = Math.max(backoff, retryDelayMs(err) ?? 0);
+        if (Date.now() + delay >= deadline) throw err;
+        log.warn('Retrying upstream call', {
+          class: classifyError(err),
+          attempt: attempt + 1,
+          delay_ms: Math.round(delay),
+        });
+        await sleep(delay, bounded.signal);
+      }
+    }
+  } catch (err) {
+    bounded.dispose();
+    throw err;
+  } finally {
+    clearTimeout(timer);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Hedged requests                                                 */
+/* ------------------------------------------------------------------ */
+/** Ring buffer of recent latencies with a cheap, lazily refreshed p95. */
+export class LatencyTracker {
+  private samples: Float64Array;
+  private count = 0;
+  private cachedP95 = 0;
+  private dirty = 0;
+
+  constructor(size = 200, private readonly minSamples = 20) {
+    this.samples = new Float64Array(size);
+  }
+
+  record(ms: number) {
+    this.samples[this.count++ % this.samples.length] = ms;
+    this.dirty++;
+  }
+
+  /** p95 of the window, or undefined until enough samples were seen. */
+  p95(): number | undefined {
+    const n = Math.min(this.count, this.samples.length);
+    if (n < this.minSamples) return undefined;
+    if (this.dirty >= 10 || !this.cachedP95) {
+      const sorted = this.samples.slice(0, n).sort();
+      this.cachedP95 = sorted[Math.floor(n * 0.95)];
+      this.dirty = 0;
+    }
+    return this.cachedP95;
+  }
+}
+
+/**
+ * Run `fn`; if it has not settled after `delayMs`, start a second attempt
+ * and return whichever succeeds first. Fails only when both attempts fail.
+ * The losing attempt is aborted through the signal it was given.
+ */
+export function hedged<T>(
+  fn: (signal: AbortSignal) => Promise<T>,
+  delayMs: number,
+  parent?: AbortSignal,
+): Promise<T> {
+  return new Promise<T>((resolve, reject) => {
+    let pending = 1;
+    let settled = false;
+    let fired = false;
+    let lastErr: unknown;
+    const attempts: ReturnType<typeof linkedAbort>[] = [];
+
+    const launch = () => {
+      const attempt = linkedAbort(parent);
+      attempts.push(attempt);
+      fn(attempt.signal).finally(attempt.dispose).then(
+        (v) => {
+          if (!settled) {
+            settled = true;
+            clearTimeout(timer);
+            for (const a of attempts) if (a !== attempt) a.controller.abort();
+            resolve(v);
+          }
+        },
+        (err) => {
+          lastErr = err;
+          if (--pending === 0 && !settled && fired) {
+            settled = true;
+            reject(lastErr);
+          } else if (!fired) {
+            // first attempt failed before the hedge fired: fail fast
+            settled = true;
+            clearTimeout(timer);
+            reject(err);
+          }
+        },
+      );
+    };
+
+    const timer = setTimeout(() => {
+      if (settled) return;
+      fired = true;
+      pending++;
+      launch();
+    }, delayMs);
+
+    launch();
+  });
+}
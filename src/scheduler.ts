@@ -0,0 +1,162 @@
+// src/scheduler.ts
+/* ------------------------------------------------------------------ */
+/*  Admission control – bounded concurrency + prioritised wait queue  */
+/* ------------------------------------------------------------------ */
+import http from 'http';
+
+export class QueueFullError extends Error {
+  status = 429;
+  constructor(public retryAfter: number) {
+    super('Too many requests queued, try again later');
+  }
+}
+
+export class QueueTimeoutError extends Error {
+  status = 429;
+  constructor(public retryAfter: number) {
+    super('Request waited too long in the queue');
+  }
+}
+
+export interface SchedulerOptions {
+  maxConcurrent: number;   // upstream calls allowed in flight
+  maxQueue: number;        // requests allowed to wait for a slot
+  queueTimeoutMs: number;  // max time a request may wait for a slot
+}
+
+type Release = () => void;
+
+interface Waiter {
+  priority: number;
+  weight: number;
+  grant: (release: Release) => void;
+  timer: NodeJS.Timeout;
+}
+
+export class Scheduler {
+  private active = 0;
+  private queue: Waiter[] = [];      // highest priority first, FIFO within
+  private avgHoldMs = 1000;          // EWMA of slot hold time, for Retry-After
+
+  constructor(private readonly opts: SchedulerOptions) {}
+
+  get inFlight() {
+    return this.active;
+  }
+
+  get queued() {
+    return this.queue.length;
+  }
+
+  /**
+   * Wait for an upstream slot. Resolves with a release callback that must
+   * be called exactly once; rejects straight away when the queue is full
+   * and leaves the queue as soon as `signal` aborts. A request that makes
+   * several upstream calls at once (n > 1 fan-out) takes `weight` slots,
+   * capped at maxConcurrent so it can always be admitted eventually.
+   */
+  acquire(priority = 0, signal?: AbortSignal, weight = 1): Promise<Release> {
+    if (signal?.aborted) return Promise.reject(signal.reason);
+    weight = Math.min(Math.max(1, weight), this.opts.maxConcurrent);
+    if (this.active + weight <= this.opts.maxConcurrent && !this.queue.length) {
+      this.active += weight;
+      return Promise.resolve(this.releaser(weight));
+    }
+    if (this.queue.length >= this.opts.maxQueue) {
+      return Promise.reject(new QueueFullError(this.retryAfter()));
+    }
+
+    return new Promise<Release>((resolve, reject) => {
+      const leave = (reason: unknown) => {
+        const i = this.queue.indexOf(waiter);
+        if (i !== -1) this.queue.splice(i, 1);
+        clearTimeout(waiter.timer);
+        signal?.removeEventListener('abort', onAbort);
+        reject(reason);
+        this.admit();                    // a heavy head may have held others back
+      };
+      const onAbort = () => leave(signal?.reason);
+      const waiter: Waiter = {
+        priority,
+        weight,
+        grant: (release) => {
+          signal?.removeEventListener('abort', onAbort);
+          resolve(release);
+        },
+        timer: setTimeout(
+          () => leave(new QueueTimeoutError(this.retryAfter())),
+          this.opts.queueTimeoutMs,
+        ),
+      };
+      signal?.addEventListener('abort', onAbort, { once: true });
+      // insert after every waiter with the same or higher priority
+      let i = this.queue.length;
+      while (i > 0 && this.queue[i - 1].priority < priority) i--;
+      this.queue.splice(i, 0, waiter);
+    });
+  }
+
+  private releaser(weight: number): Release {
+    const started = Date.now();
+    let released = false;
+    return () => {
+      if (released) return;
+      released = true;
+      this.avgHoldMs = this.avgHoldMs * 0.9 + (Date.now() - started) * 0.1;
+      this.active -= weight;
+      this.admit();
+    };
+  }
+
+  /** Hand free slots to waiters in queue order, while the next one fits. */
+  private admit() {
+    while (this.queue.length && this.active + this.queue[0].weight <= this.opts.maxConcurrent) {
+      const next = this.queue.shift()!;
+      clearTimeout(next.timer);
+      this.active += next.weight;
+      next.grant(this.releaser(next.weight));
+    }
+  }
+
+  /** Rough seconds until a new request would get a slot. */
+  private retryAfter() {
+    const waves = (this.queue.length + 1) / Math.max(1, this.opts.maxConcurrent);
+    return Math.max(1, Math.ceil((waves * this.avgHoldMs) / 1000));
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* Request priority: X-Priority header or per-API-key mapping          */
+/* ------------------------------------------------------------------ */
+const NAMED_PRIORITIES: Record<string, number> = { low: -1, normal: 0, high: 1 };
+
+function parsePriority(value: string | undefined): number | undefined {
+  if (!value) return undefined;
+  const v = value.trim().toLowerCase();
+  if (v in NAMED_PRIORITIES) return NAMED_PRIORITIES[v];
+  const n = Number(v);
+  return Number.isFinite(n) ? n : undefined;
+}
+
+// PRIORITY_KEYS="sk-batch:low,sk-interactive:high"
+const keyPriorities = new Map<string, number>();
+for (const entry of (process.env.PRIORITY_KEYS ?? '').split(',')) {
+  const sep = entry.lastIndexOf(':');
+  const prio = parsePriority(entry.slice(sep + 1));
+  if (sep > 0 && prio !== undefined) keyPriorities.set(entry.slice(0, sep).trim(), prio);
+}
+
+const MIN_HEADER_PRIORITY = NAMED_PRIORITIES.low;
+const MAX_HEADER_PRIORITY = NAMED_PRIORITIES.high;
+
+/**
+ * A mapped API key wins, so clients cannot promote themselves by header;
+ * a header may only pick from low..high, whatever number it sends.
+ */
+export function requestPriority(headers: http.IncomingHttpHeaders): number {
+  const key = (headers.authorization ?? '').replace(/^Bearer\s+/i, '');
+  const mapped = keyPriorities.get(key);
+  if (mapped !== undefined) return mapped;
+  const asked = parsePriority(headers['x-priority'] as string | undefined) ?? 0;
+  return Math.min(MAX_HEADER_PRIORITY, Math.max(MIN_HEADER_PRIORITY, asked));
+}
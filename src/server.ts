@@ -1,126 +1,462 @@
 import 'dotenv/config';
+import cluster from 'cluster';
 import http from 'http';
-import { sendChat, sendChatStream, listModels } from './chatwrapper';
-import { mapRequest, mapResponse, mapStreamChunk } from './mapper';
+import {
+  embedTexts,
+  isReady,
+  listModels,
+  poolStatus,
+  resolveEmbeddingModel,
+  sendChat,
+  sendChatStream,
+  warmup,
+} from './chatwrapper';
+import {
+  completionToChunks,
+  mapRequest,
+  mapResponse,
+  mapStreamChunk,
+  mapUsage,
+  newStreamState,
+} from './mapper';
+import { Scheduler, requestPriority } from './scheduler';
+import { DeadlineExceededError, RequestAbortedError, errorStatus } from './retry';
+import { count, counterSnapshot } from './stats';
+import { SseWriter } from './sse';
+import { LruCache, canonicalKey } from './cache';
+import { SingleFlight } from './singleflight';
+import { log, requestLogger } from './logger';
+import {
+  bodyParseSeconds,
+  errorClass,
+  errorsTotal,
+  gauge,
+  mapRequestSeconds,
+  mergeMetrics,
+  renderMetrics,
+  requestSeconds,
+  streamSeconds,
+  ttftSeconds,
+} from './metrics';
+import { gather, provide, publish, runPrimary, subscribe, workerCount } from './cluster';
+import { readJSON } from './body';
+import { contextCacheStatus } from './contextcache';
+import { budgetPrompt, estimateTextTokens } from './tokens';
+import { mark, startupReport } from './startup';
+import { batchStatus, handleBatchApi, startBatchRunner } from './batch';
+import { EmbeddingBatcher, EmbeddingInputError, embeddingInputs, embeddingResponse } from './embeddings';
+import { createServer, listenerScheme, sendJSON, sseEncoding } from './transport';
+
+mark('modules_loaded');
 
 /* ── basic config ─────────────────────────────────────────────────── */
 const PORT = Number(process.env.PORT ?? 11434);
+const REQUEST_TIMEOUT_MS = Number(process.env.REQUEST_TIMEOUT_MS ?? 300_000);
+const SSE_COALESCE_MS = Number(process.env.SSE_COALESCE_MS ?? 0);
+const BATCH_PRIORITY = Number(process.env.BATCH_PRIORITY ?? -1);   // below interactive traffic
+const WORKERS = workerCount();
+
+/* ── admission control ────────────────────────────────────────────── */
+const scheduler = new Scheduler({
+  maxConcurrent: Number(process.env.MAX_CONCURRENCY ?? 16),
+  maxQueue: Number(process.env.MAX_QUEUE ?? 100),
+  queueTimeoutMs: Number(process.env.QUEUE_TIMEOUT_MS ?? 30_000),
+});
+gauge('proxy_in_flight_requests', 'Upstream calls currently in flight', () => scheduler.inFlight);
+gauge('proxy_queued_requests', 'Requests waiting for an upstream slot', () => scheduler.queued);
+
+/** Slots a request holds: n > 1 may fan out into one upstream call per choice. */
+function choices(geminiReq: any) {
+  return Number(geminiReq.generationConfig?.candidateCount ?? 1);
+}
+
+/* ── response cache (deterministic, non-streamed completions) ─────── */
+const responseCache = process.env.RESPONSE_CACHE === '1' || process.env.RESPONSE_CACHE === 'true'
+  ? new LruCache<any>({
+    maxEntries: Number(process.env.RESPONSE_CACHE_MAX_ENTRIES ?? 1000),
+    maxBytes: Number(process.env.RESPONSE_CACHE_MAX_BYTES ?? 64 * 1024 * 1024),
+    ttlMs: Number(process.env.RESPONSE_CACHE_TTL_MS ?? 10 * 60_000),
+  })
+  : undefined;
+
+// entries cached by one worker are replicated to the others
+subscribe('response-cache', ({ key, value, size }) => responseCache?.set(key, value, size));
+
+/* ── single-flight: identical concurrent requests share one call ──── */
+const flights = process.env.SINGLEFLIGHT === '1' || process.env.SINGLEFLIGHT === 'true'
+  ? new SingleFlight()
+  : undefined;
+
+/** Canonical hash of the mapped request, unless the client opted out. */
+function requestKeyFor(req: http.IncomingMessage, geminiReq: any): string | undefined {
+  if (!responseCache && !flights) return undefined;
+  const cc = String(req.headers['cache-control'] ?? '');
+  if (/no-cache|no-store/i.test(cc) || req.headers['x-cache-bypass']) return undefined;
+  const { model, contents, generationConfig } = geminiReq;
+  return canonicalKey({ model, contents, generationConfig });
+}
+
+/* ── embeddings: concurrent inputs share upstream calls ───────────── */
+const embeddings = new EmbeddingBatcher(async (model, texts, dimensions) => {
+  const release = await scheduler.acquire(0);
+  try {
+    return await embedTexts(model, texts, dimensions);
+  } finally {
+    release();
+  }
+});
+
+/* ── /stats and /metrics, answered for the whole cluster ──────────── */
+function stats() {
+  return {
+    pid: process.pid,
+    counters: counterSnapshot(),
+    singleflight: flights && { in_flight: flights.inFlight },
+    response_cache: responseCache && {
+      entries: responseCache.size,
+      bytes: responseCache.byteSize,
+    },
+    scheduler: { in_flight: scheduler.inFlight, queued: scheduler.queued },
+    context_cache: contextCacheStatus(),
+    batches: batchStatus(),
+    pool: poolStatus(),
+  };
+}
+
+/** Counters and queue depths summed over workers, plus each worker's own view. */
+function clusterStats(all: ReturnType<typeof stats>[]) {
+  const counters: Record<string, number> = {};
+  for (const s of all) {
+    for (const [name, v] of Object.entries(s.counters)) counters[name] = (counters[name] ?? 0) + v;
+  }
+  return {
+    counters,
+    scheduler: {
+      in_flight: all.reduce((n, s) => n + s.scheduler.in_flight, 0),
+      queued: all.reduce((n, s) => n + s.scheduler.queued, 0),
+    },
+    workers: all.sort((a, b) => a.pid - b.pid),
+  };
+}
+
+provide('stats', stats);
+provide('metrics', renderMetrics);
 
 /* ── CORS helper ──────────────────────────────────────────────────── */
 function allowCors(res: http.ServerResponse) {
   res.setHeader('Access-Control-Allow-Origin', '*');
   res.setHeader('Access-Control-Allow-Headers', '*');
-  res.setHeader('Access-Control-Allow-Methods', 'GET,POST,OPTIONS');
+  res.setHeader('Access-Control-Allow-Methods', 'GET,POST,DELETE,OPTIONS');
 }
 
-/* ── JSON body helper ─────────────────────────────────────────────── */
-function readJSON(
-  req: http.IncomingMessage,
-  res: http.ServerResponse,
-): Promise<any | null> {
-  return new Promise((resolve) => {
-    let data = '';
-    req.on('data', (c) => (data += c));
-    req.on('end', () => {
-      try {
-        resolve(data ? JSON.parse(data) : {});
-      } catch {
-        res.writeHead(400).end(); // malformed JSON
-        resolve(null);
-      }
-    });
+/* ── cancellation: client disconnect + per-request deadline ──────── */
+function requestSignal(res: http.ServerResponse) {
+  const controller = new AbortController();
+  const timer = REQUEST_TIMEOUT_MS > 0
+    ? setTimeout(() => controller.abort(new DeadlineExceededError(REQUEST_TIMEOUT_MS)), REQUEST_TIMEOUT_MS)
+    : undefined;
+  res.on('close', () => {
+    clearTimeout(timer);
+    if (!res.writableEnded) controller.abort(new RequestAbortedError());
   });
+  return controller.signal;
+}
+
+/** Count a cancelled request separately from real errors. */
+function countAbort(signal: AbortSignal) {
+  count(signal.reason instanceof DeadlineExceededError ? 'timed_out' : 'cancelled');
 }
 
 /* ── server ───────────────────────────────────────────────────────── */
-http
-  .createServer(async (req, res) => {
-    allowCors(res);
+const server = createServer(async (req, res) => {
+  allowCors(res);
 
-    console.log('➜', req.method, req.url);
+  const rlog = requestLogger(req.url ?? '');
+  rlog.info(`➜ ${req.method} ${req.url}`);
 
-    /* -------- pre-flight ---------- */
-    if (req.method === 'OPTIONS') {
-      res.writeHead(204).end();
-      return;
-    }
+  /* -------- pre-flight ---------- */
+  if (req.method === 'OPTIONS') {
+    res.writeHead(204).end();
+    return;
+  }
 
-    /* -------- /v1/models ---------- */
-    if (req.url === '/v1/models') {
-      res.writeHead(200, { 'Content-Type': 'application/json' });
-      res.end(
-        JSON.stringify({
-          data: listModels(),
-        }),
-      );
-      return;
-    }
+  /* -------- health probes ------- */
+  // liveness: the event loop answers; readiness: a credential is usable
+  if (req.url === '/healthz') {
+    res.writeHead(200, { 'Content-Type': 'application/json' });
+    res.end(JSON.stringify({ status: 'ok' }));
+    return;
+  }
+  if (req.url === '/readyz') {
+    const ready = isReady();
+    if (!ready) warm();              // retries a failed warmup
+    res.writeHead(ready ? 200 : 503, { 'Content-Type': 'application/json' });
+    res.end(JSON.stringify({ ready, startup: startupReport() }));
+    return;
+  }
 
-    /* ---- /v1/chat/completions ---- */
-    if (req.url === '/v1/chat/completions' && req.method === 'POST') {
-      const body = await readJSON(req, res);
-      if (!body) {
-        return; // readJSON already handled the response
-      }
+  /* -------- /v1/models ---------- */
+  if (req.url === '/v1/models') {
+    await sendJSON(req, res, 200, JSON.stringify({ data: listModels() }));
+    return;
+  }
+
+  /* -------- /metrics ------------ */
+  // with WORKERS>1 every worker is asked, so a scrape sees the whole cluster
+  if (req.url === '/metrics' && req.method === 'GET') {
+    const texts = await gather<string>('metrics');
+    res.writeHead(200, { 'Content-Type': 'text/plain; version=0.0.4' });
+    res.end(texts.length ? mergeMetrics(texts) : renderMetrics());
+    return;
+  }
 
-      try {
-        const { geminiReq, tools } = await mapRequest(body);
+  /* -------- /stats -------------- */
+  if (req.url === '/stats' && req.method === 'GET') {
+    const all = await gather<ReturnType<typeof stats>>('stats');
+    await sendJSON(req, res, 200, JSON.stringify(all.length > 1 ? clusterStats(all) : stats()));
+    return;
+  }
 
+  /* ---- /v1/files, /v1/batches -- */
+  if (/^\/v1\/(files|batches)(\/|\?|$)/.test(req.url ?? '')) {
+    await handleBatchApi(req, res);
+    return;
+  }
+
+  /* ---- /v1/chat/completions ---- */
+  if (req.url === '/v1/chat/completions' && req.method === 'POST') {
+    const started = performance.now();
+    const body = await readJSON(req, res);
+    if (!body) {
+      errorsTotal.labels('4xx').inc();
+      return; // readJSON already handled the response
+    }
+    bodyParseSeconds.observe((performance.now() - started) / 1000);
+
+    count('requests');
+    const signal = requestSignal(res);
+    try {
+      const mapStarted = performance.now();
+      const { geminiReq } = await mapRequest(body);
+      mapRequestSeconds.observe((performance.now() - mapStarted) / 1000);
+      // too large: reject (or truncate) before any upstream call
+      const promptTokens = await budgetPrompt(geminiReq);
+      res.setHeader('X-Prompt-Tokens-Estimate', String(promptTokens));
+      const priority = requestPriority(req.headers);
+
+      const requestKey = requestKeyFor(req, geminiReq);
+      // only temperature-0 completions are deterministic enough to cache
+      const cacheKey = responseCache && geminiReq.generationConfig.temperature === 0
+        ? requestKey
+        : undefined;
+      const cached = cacheKey ? responseCache?.get(cacheKey) : undefined;
+      if (cacheKey) count(cached ? 'cache_hits' : 'cache_misses');
+      if (cached) {
         if (body.stream) {
-          // Check if headers were already sent
-          if (!res.headersSent) {
-            res.writeHead(200, {
-              'Content-Type': 'text/event-stream',
-              'Cache-Control': 'no-cache',
-              Connection: 'keep-alive',
-            });
+          const sse = new SseWriter(res, {
+            coalesceMs: 0,
+            id: cached.id,
+            model: cached.model,
+            compress: sseEncoding(req),
+          });
+          res.setHeader('X-Cache', 'HIT');
+          for (const chunk of completionToChunks(cached)) await sse.send(chunk);
+          if (body.stream_options?.include_usage) {
+            await sse.send({ choices: [], usage: cached.usage });
           }
+          await sse.done();
+        } else {
+          await sendJSON(req, res, 200, JSON.stringify(cached), { 'X-Cache': 'HIT' });
+        }
+        rlog.info('✅ Replied from response cache');
+        return;
+      }
 
-          console.log('➜ sending HTTP 200 streamed response');
-
+      if (body.stream) {
+        // the upstream slot is held for as long as the stream runs
+        const upstream = async function* (s: AbortSignal) {
+          const release = await scheduler.acquire(priority, s, choices(geminiReq));
           try {
-            for await (const chunk of sendChatStream({ ...geminiReq, tools })) {
-              if (!res.destroyed) {
-                res.write(`data: ${JSON.stringify(mapStreamChunk(chunk))}\n\n`);
-              }
-            }
-            if (!res.destroyed) {
-              res.end('data: [DONE]\n\n');
-            }
-          } catch (streamErr: any) {
-            console.error('Streaming error:', streamErr);
-            if (!res.destroyed && !res.headersSent) {
-              res.writeHead(500, { 'Content-Type': 'application/json' });
-              res.end(JSON.stringify({ error: { message: streamErr.message } }));
-            }
+            yield* sendChatStream({ ...geminiReq, signal: s });
+          } finally {
+            release();
           }
+        };
+        const sse = new SseWriter(res, {
+          coalesceMs: SSE_COALESCE_MS,
+          id: `chatcmpl-${Date.now()}`,
+          model: geminiReq.model,
+          compress: sseEncoding(req),
+        });
 
-          console.log('➜ done sending streamed response');
-        } else {
-          const gResp = await sendChat({ ...geminiReq, tools });
-          const mapped = mapResponse(gResp);
-          const code = 200;
-          
-          if (!res.headersSent) {
-            res.writeHead(code, { 'Content-Type': 'application/json' });
-            res.end(JSON.stringify(mapped));
-          }
+        rlog.info('➜ sending HTTP 200 streamed response');
 
-          console.log('✅ Replied HTTP ' + code + ' response', mapped);
+        const streamStarted = performance.now();
+        try {
+          let usage: unknown;
+          let firstToken = true;
+          const state = newStreamState();
+          const chunks = flights && requestKey
+            ? flights.stream(requestKey, upstream, signal)
+            : upstream(signal);
+          for await (const chunk of chunks) {
+            usage = chunk?.usageMetadata ?? usage;
+            const mappedChunk = mapStreamChunk(chunk, state);
+            if (!mappedChunk.choices.length) continue;      // usage-only chunk
+            const produced = mappedChunk.choices.some(
+              (c: any) => c.delta.content !== undefined || c.delta.tool_calls,
+            );
+            if (firstToken && produced) {
+              firstToken = false;
+              ttftSeconds.labels(geminiReq.model).observe((performance.now() - started) / 1000);
+            }
+            await sse.send(mappedChunk);
+          }
+          if (body.stream_options?.include_usage) {
+            // fall back to the local estimate if upstream sent no usage
+            const mappedUsage = usage
+              ? mapUsage(usage)
+              : { prompt_tokens: promptTokens, completion_tokens: 0, total_tokens: promptTokens };
+            await sse.send({ choices: [], usage: mappedUsage });
+          }
+          await sse.done();
+        } catch (streamErr: any) {
+          // nothing sent yet: answer with a proper status code below
+          if (!res.headersSent) throw streamErr;
+          errorsTotal.labels(errorClass(errorStatus(streamErr) ?? 500, signal.aborted)).inc();
+          if (signal.aborted) {
+            countAbort(signal);
+            rlog.info(`➜ stream stopped: ${signal.reason.message}`);
+          } else {
+            count('errors');
+            rlog.error('Streaming error', { err: streamErr });
+          }
+          // headers are out, so report the failure in-band and close
+          sse.fail(streamErr.message);
         }
-      } catch (err: any) {
-        console.error('HTTP 500 Proxy error ➜', err);
-        if (!res.headersSent) {
-          res.writeHead(500, { 'Content-Type': 'application/json' });
-          res.end(JSON.stringify({ error: { message: err.message } }));
+        streamSeconds.labels(geminiReq.model).observe((performance.now() - streamStarted) / 1000);
+
+        rlog.info('➜ done sending streamed response');
+      } else {
+        const upstream = async (s: AbortSignal) => {
+          const release = await scheduler.acquire(priority, s, choices(geminiReq));
+          try {
+            return await sendChat({ ...geminiReq, signal: s });
+          } finally {
+            release();
+          }
+        };
+        const gResp = flights && requestKey
+          ? await flights.do(requestKey, upstream, signal)
+          : await upstream(signal);
+        const mapped = mapResponse(gResp, geminiReq.model);
+        const code = 200;
+        const json = JSON.stringify(mapped);
+        if (responseCache && cacheKey && !('error' in mapped)) {
+          responseCache.set(cacheKey, mapped, json.length);
+          publish('response-cache', { key: cacheKey, value: mapped, size: json.length });
         }
+
+        await sendJSON(req, res, code, json, cacheKey ? { 'X-Cache': 'MISS' } : {});
+
+        rlog.info(`✅ Replied HTTP ${code} response`);
+        rlog.debug('Mapped response', { mapped });
       }
+      requestSeconds.labels(geminiReq.model).observe((performance.now() - started) / 1000);
+    } catch (err: any) {
+      replyError(res, err, signal, rlog);
+    }
+
+    return;
+  }
 
-      return;
+  /* ---- /v1/embeddings ---------- */
+  if (req.url === '/v1/embeddings' && req.method === 'POST') {
+    const body = await readJSON(req, res);
+    if (!body) {
+      errorsTotal.labels('4xx').inc();
+      return; // readJSON already handled the response
     }
 
-    console.log('➜ unknown request, returning HTTP 404');
-    /* ---- anything else ---------- */
-    res.writeHead(404).end();
-  })
-  .listen(PORT, () => console.log(`OpenAI proxy listening on http://localhost:${PORT}`));
+    count('embedding_requests');
+    const signal = requestSignal(res);
+    try {
+      const texts = embeddingInputs(body);
+      const format = body.encoding_format ?? 'float';
+      if (format !== 'float' && format !== 'base64') {
+        throw new EmbeddingInputError("'encoding_format' must be 'float' or 'base64'");
+      }
+      const model = resolveEmbeddingModel(body.model);
+      const vectors = await embeddings.add(model, texts, body.dimensions, signal);
+      const tokens = texts.reduce((n, text) => n + estimateTextTokens(text), 0);
+      await sendJSON(req, res, 200, embeddingResponse(vectors, model, tokens, format));
+      rlog.info(`✅ Replied with ${vectors.length} embeddings`);
+    } catch (err: any) {
+      replyError(res, err, signal, rlog);
+    }
+    return;
+  }
+
+  rlog.info('➜ unknown request, returning HTTP 404');
+  /* ---- anything else ---------- */
+  res.writeHead(404).end();
+});
+
+/** Answer a failed request with its status, unless headers are already out. */
+function replyError(
+  res: http.ServerResponse,
+  err: any,
+  signal: AbortSignal,
+  rlog: ReturnType<typeof requestLogger>,
+) {
+  const status = errorStatus(err) ?? 500;
+  errorsTotal.labels(errorClass(status, signal.aborted)).inc();
+  if (signal.aborted) {
+    countAbort(signal);
+    rlog.info(`➜ request stopped: ${signal.reason.message}`);
+  } else {
+    count('errors');
+    rlog.error(`HTTP ${status} Proxy error ➜`, { err });
+  }
+  if (!res.headersSent) {
+    const headers: http.OutgoingHttpHeaders = { 'Content-Type': 'application/json' };
+    if (err.retryAfter) headers['Retry-After'] = String(err.retryAfter);
+    res.writeHead(status, headers);
+    res.end(JSON.stringify({ error: { message: err.message } }));
+  }
+}
+
+/** One line of a batch: same mapping and budgeting, admitted at batch priority. */
+async function runBatchRequest(body: any, signal: AbortSignal) {
+  const { geminiReq } = await mapRequest({ ...body, stream: false });
+  await budgetPrompt(geminiReq);
+  const release = await scheduler.acquire(BATCH_PRIORITY, signal, choices(geminiReq));
+  try {
+    const mapped = mapResponse(await sendChat({ ...geminiReq, signal }), geminiReq.model);
+    if ('error' in mapped) throw new Error(mapped.error.message);
+    return mapped;
+  } finally {
+    release();
+  }
+}
+
+/** Authenticate credentials; the first success marks the worker ready. */
+function warm() {
+  return warmup().then((ready) => {
+    if (!ready || startupReport().marks_ms.ready !== undefined) return;
+    mark('ready');
+    log.info('Proxy ready', startupReport());
+  });
+}
+
+/* ── start: single process, or a primary forking WORKERS workers ──── */
+if (WORKERS > 1 && cluster.isPrimary) {
+  runPrimary(WORKERS);
+} else {
+  server.listen(PORT, () => {
+    mark('listening');
+    log.info(`OpenAI proxy listening on port ${PORT}`, { pid: process.pid, scheme: listenerScheme() });
+    warm();
+    startBatchRunner(runBatchRequest);
+  });
+}
@@ -0,0 +1,153 @@
+// src/singleflight.ts
+/* ------------------------------------------------------------------ */
+/*  Single-flight – identical in-flight requests share one upstream   */
+/* ------------------------------------------------------------------ */
+import { count } from './stats';
+
+/** Resolves on `wake`, rejects if `signal` aborts first. */
+function waitFor(wake: Promise<void>, signal?: AbortSignal) {
+  if (!signal) return wake;
+  return new Promise<void>((resolve, reject) => {
+    if (signal.aborted) return reject(signal.reason);
+    const onAbort = () => reject(signal.reason);
+    signal.addEventListener('abort', onAbort, { once: true });
+    wake.then(() => {
+      signal.removeEventListener('abort', onAbort);
+      resolve();
+    });
+  });
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Shared state of one upstream call                               */
+/* ------------------------------------------------------------------ */
+class Flight {
+  readonly controller = new AbortController();
+  subscribers = 0;
+  chunks: any[] = [];              // stream flights: every chunk so far
+  done = false;
+  error?: unknown;
+  private notify!: () => void;
+  changed!: Promise<void>;
+
+  constructor(private readonly forget: () => void) {
+    this.reset();
+  }
+
+  wake() {
+    this.notify();
+    this.reset();
+  }
+
+  /** A subscriber left; cancel upstream once nobody is listening. */
+  leave() {
+    if (--this.subscribers === 0 && !this.done) {
+      this.forget();               // later duplicates must not join a dying call
+      this.controller.abort();
+    }
+  }
+
+  private reset() {
+    this.changed = new Promise<void>((r) => (this.notify = r));
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  The coalescer                                                   */
+/* ------------------------------------------------------------------ */
+export class SingleFlight {
+  private calls = new Map<string, { flight: Flight; result: Promise<any> }>();
+  private streams = new Map<string, Flight>();
+
+  get inFlight() {
+    return this.calls.size + this.streams.size;
+  }
+
+  /** Run `fn` once per key; concurrent callers with that key share the result. */
+  async do<T>(
+    key: string,
+    fn: (signal: AbortSignal) => Promise<T>,
+    signal?: AbortSignal,
+  ): Promise<T> {
+    let call = this.calls.get(key);
+    if (call) {
+      count('singleflight_shared');
+    } else {
+      const forget = () => {
+        if (this.calls.get(key) === created) this.calls.delete(key);
+      };
+      const flight = new Flight(forget);
+      const result = fn(flight.controller.signal).finally(() => {
+        flight.done = true;
+        forget();
+      });
+      result.catch(() => undefined);
+      const created = { flight, result };
+      this.calls.set(key, (call = created));
+    }
+
+    const { flight, result } = call;
+    flight.subscribers++;
+    try {
+      await waitFor(result.then(() => undefined, () => undefined), signal);
+      return await result;
+    } finally {
+      flight.leave();
+    }
+  }
+
+  /**
+   * Stream variant: one upstream iterator per key, each subscriber reads
+   * the shared chunk log at its own pace, so a slow one stalls nobody.
+   */
+  async *stream<T>(
+    key: string,
+    fn: (signal: AbortSignal) => AsyncIterable<T>,
+    signal?: AbortSignal,
+  ): AsyncGenerator<T> {
+    let flight = this.streams.get(key);
+    if (flight) {
+      count('singleflight_shared');
+    } else {
+      flight = this.pump(key, fn);
+    }
+
+    flight.subscribers++;
+    let i = 0;
+    try {
+      for (;;) {
+        if (i < flight.chunks.length) {
+          yield flight.chunks[i++];
+          continue;
+        }
+        if (flight.error !== undefined) throw flight.error;
+        if (flight.done) return;
+        await waitFor(flight.changed, signal);
+      }
+    } finally {
+      flight.leave();
+    }
+  }
+
+  private pump<T>(key: string, fn: (signal: AbortSignal) => AsyncIterable<T>) {
+    const flight: Flight = new Flight(() => {
+      if (this.streams.get(key) === flight) this.streams.delete(key);
+    });
+    this.streams.set(key, flight);
+    (async () => {
+      try {
+        for await (const chunk of fn(flight.controller.signal)) {
+          flight.chunks.push(chunk);
+          flight.wake();
+        }
+      } catch (err) {
+        flight.error = err ?? new Error('Upstream stream failed');
+      } finally {
+        flight.done = true;
+        if (this.streams.get(key) === flight) this.streams.delete(key);
+        flight.wake();
+      }
+    })();
+    return flight;
+  }
+}
@@ -0,0 +1,149 @@
+// src/sse.ts
+/* ------------------------------------------------------------------ */
+/*  SSE writer – honours backpressure and coalesces small deltas      */
+/* ------------------------------------------------------------------ */
+import http from 'http';
+import { Writable } from 'stream';
+import { Encoding, createCompressor, isHttp2 } from './transport';
+
+export interface SseOptions {
+  coalesceMs: number;      // 0 = send every chunk as soon as it arrives
+  id: string;              // chat.completion.chunk envelope
+  model: string;
+  compress?: Encoding;     // negotiated per request; flushed after each event
+}
+
+type Chunk = { choices: any[]; usage?: unknown };
+
+/** True when `next` only adds text to the same choice and can be merged. */
+function mergeable(prev: Chunk, next: Chunk) {
+  if (prev.choices.length !== 1 || next.choices.length !== 1) return false;
+  const a = prev.choices[0];
+  const b = next.choices[0];
+  if (a.index !== b.index || a.finish_reason || b.finish_reason) return false;
+  for (const key of Object.keys(b.delta)) {
+    if (key !== 'role' && key !== 'content') return false;
+  }
+  for (const key of Object.keys(a.delta)) {
+    if (key !== 'role' && key !== 'content') return false;
+  }
+  return true;
+}
+
+export class SseWriter {
+  private pending?: Chunk;
+  private timer?: NodeJS.Timeout;
+  private drain?: Promise<void>;
+  private out?: Writable;
+  private compressor?: ReturnType<typeof createCompressor>;
+  private closed = false;
+  private readonly created = Math.floor(Date.now() / 1000);
+
+  constructor(
+    private readonly res: http.ServerResponse,
+    private readonly opts: SseOptions,
+  ) {
+    res.on('close', () => {
+      this.closed = true;
+      this.compressor?.destroy();
+    });
+  }
+
+  open() {
+    if (this.res.headersSent) return;
+    const headers: http.OutgoingHttpHeaders = {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache',
+    };
+    // connection-specific headers are not allowed on HTTP/2
+    if (!isHttp2(this.res)) headers.Connection = 'keep-alive';
+    if (this.opts.compress) {
+      headers['Content-Encoding'] = this.opts.compress;
+      headers.Vary = 'Accept-Encoding';
+      this.compressor = createCompressor(this.opts.compress);
+      this.compressor.pipe(this.res);
+    }
+    this.res.writeHead(200, headers);
+    this.out = this.compressor ?? this.res;
+  }
+
+  private get writable() {
+    return !this.closed && !this.res.destroyed && !this.res.writableEnded;
+  }
+
+  /**
+   * Queue one OpenAI chunk. Resolves once the socket can take more, so a
+   * slow client slows down how fast we pull from upstream.
+   */
+  async send(chunk: Chunk) {
+    if (this.drain) await this.drain;
+
+    if (this.opts.coalesceMs <= 0) {
+      this.write(chunk);
+      return;
+    }
+    if (this.pending && mergeable(this.pending, chunk)) {
+      const delta = this.pending.choices[0].delta;
+      const text = chunk.choices[0].delta.content;
+      if (typeof text === 'string') delta.content = (delta.content ?? '') + text;
+      return;
+    }
+    this.flush();
+    this.pending = chunk;
+    this.timer = setTimeout(() => this.flush(), this.opts.coalesceMs);
+  }
+
+  /** Flush what is left, send [DONE] and close the response. */
+  async done() {
+    this.flush();
+    if (this.drain) await this.drain;
+    if (this.writable) {
+      this.open();
+      this.out!.end('data: [DONE]\n\n');
+    }
+  }
+
+  /** Report an error in-band (headers are already out) and close. */
+  fail(message: string) {
+    this.flush();
+    if (this.writable) {
+      this.open();
+      this.out!.end(`data: ${JSON.stringify({ error: { message } })}\n\n`);
+    }
+  }
+
+  private flush() {
+    clearTimeout(this.timer);
+    this.timer = undefined;
+    if (this.pending) {
+      const chunk = this.pending;
+      this.pending = undefined;
+      this.write(chunk);
+    }
+  }
+
+  private write(chunk: Chunk) {
+    if (!this.writable) return;
+    this.open();                   // headers go out with the first event
+    const event = {
+      id: this.opts.id,
+      object: 'chat.completion.chunk',
+      created: this.created,
+      model: this.opts.model,
+      ...chunk,
+    };
+    const out = this.out!;
+    if (!out.write(`data: ${JSON.stringify(event)}\n\n`) && !this.drain) {
+      this.drain = new Promise<void>((resolve) => {
+        const done = () => {
+          out.off('drain', done);
+          this.res.off('close', done);
+          this.drain = undefined;
+          resolve();
+        };
+        out.on('drain', done);
+        this.res.on('close', done);
+      });
+    }
+  }
+}
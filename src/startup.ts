@@ -0,0 +1,20 @@
+// src/startup.ts
+/* ------------------------------------------------------------------ */
+/*  Cold-start instrumentation – where the startup milliseconds go    */
+/* ------------------------------------------------------------------ */
+// performance.now() counts from process start, so the first mark already
+// includes Node's own boot and module loading.
+const marks: Record<string, number> = {};
+let cpuMs: number | undefined;
+
+export function mark(name: string) {
+  marks[name] = Math.round(performance.now());
+  if (name === 'ready') {
+    const { user, system } = process.cpuUsage();
+    cpuMs = Math.round((user + system) / 1000);
+  }
+}
+
+export function startupReport() {
+  return { marks_ms: { ...marks }, cpu_ms: cpuMs };
+}
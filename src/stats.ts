@@ -0,0 +1,13 @@
+// src/stats.ts
+/* ------------------------------------------------------------------ */
+/*  Process-wide counters (requests, errors, cancellations, …)         */
+/* ------------------------------------------------------------------ */
+const counters: Record<string, number> = {};
+
+export function count(name: string, by = 1) {
+  counters[name] = (counters[name] ?? 0) + by;
+}
+
+export function counterSnapshot(): Record<string, number> {
+  return { ...counters };
+}
@@ -0,0 +1,144 @@
+// src/tokens.ts
+/* ------------------------------------------------------------------ */
+/*  Prompt token estimation and context-window budgeting              */
+/* ------------------------------------------------------------------ */
+import { countTokens } from './chatwrapper';
+import { count } from './stats';
+import { log } from './logger';
+
+const MAX_PROMPT_TOKENS = Number(process.env.MAX_PROMPT_TOKENS ?? 1_048_576);
+// reject | sliding (drop oldest turns) | middle (keep first + latest turns)
+const TRUNCATION = process.env.PROMPT_TRUNCATION ?? 'reject';
+// estimate | exact (ask countTokens when the estimate is close to the limit)
+const COUNT_MODE = process.env.TOKEN_COUNT_MODE ?? 'estimate';
+
+const BYTES_PER_TOKEN = 4;
+const IMAGE_TOKENS = 258;          // Gemini bills an inline image as a fixed cost
+const TURN_OVERHEAD = 4;           // role markers etc.
+const EXACT_THRESHOLD = 0.8;       // only pay for countTokens near the limit
+
+export class PromptTooLargeError extends Error {
+  status = 400;
+  constructor(public tokens: number, public limit: number) {
+    super(`Prompt is ~${tokens} tokens, over the ${limit}-token context window`);
+  }
+}
+
+/* ------------------------------------------------------------------ */
+/* 1.  Estimator                                                       */
+/* ------------------------------------------------------------------ */
+/** Estimated tokens of a parts array (one pass, no serialisation of text). */
+function partsTokens(parts: any[] = []): number {
+  let bytes = 0;
+  let fixed = 0;
+  for (const part of parts) {
+    if (typeof part.text === 'string') bytes += Buffer.byteLength(part.text);
+    else if (part.inlineData) fixed += IMAGE_TOKENS;
+    else if (part.functionCall || part.functionResponse) {
+      bytes += Buffer.byteLength(JSON.stringify(part.functionCall ?? part.functionResponse));
+    }
+  }
+  return Math.ceil(bytes / BYTES_PER_TOKEN) + fixed;
+}
+
+/** Per-turn estimates, so truncation only needs arithmetic afterwards. */
+export function estimateTurns(contents: any[]): number[] {
+  return contents.map((turn) => partsTokens(turn.parts) + TURN_OVERHEAD);
+}
+
+/** Estimated tokens of plain text, e.g. an embedding input. */
+export function estimateTextTokens(text: string): number {
+  return Math.ceil(Buffer.byteLength(text) / BYTES_PER_TOKEN);
+}
+
+export function estimateTokens(contents: any[], systemInstruction?: any): number {
+  let total = systemInstruction ? partsTokens(systemInstruction.parts) : 0;
+  for (const n of estimateTurns(contents)) total += n;
+  return total;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Truncation policies                                             */
+/* ------------------------------------------------------------------ */
+/**
+ * Drop whole turns until the prompt fits. The latest turn always stays,
+ * roles keep alternating where the history was cut, and the history never
+ * resumes on a functionResponse whose functionCall was dropped.
+ */
+function truncate(contents: any[], turns: number[], budget: number, policy: string) {
+  const sum = (from: number, to: number) => turns.slice(from, to).reduce((a, b) => a + b, 0);
+  let total = sum(0, turns.length);
+  const last = contents.length - 1;
+  // sliding drops from the start; middle keeps the first turn as an anchor
+  const anchor = policy === 'middle' ? 1 : 0;
+  let cut = anchor;
+  while (cut < last && total > budget) total -= turns[cut++];
+  // the turn after the cut must not repeat the role before it, nor answer
+  // a call that is gone (Gemini rejects that with a 400)
+  const before = anchor ? contents[0].role : 'model';
+  const clean = (i: number) =>
+    contents[i].role !== before && !contents[i].parts?.some((p: any) => p.functionResponse);
+  let start = cut;
+  while (start <= last && !clean(start)) start++;
+  if (start > last) {
+    // the latest turns are all tool traffic: keep their calls too
+    start = cut;
+    while (start > anchor && !clean(start)) start--;
+  }
+  return {
+    contents: [...contents.slice(0, anchor), ...contents.slice(start)],
+    total: sum(0, anchor) + sum(start, turns.length),
+  };
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Budgeting stage                                                 */
+/* ------------------------------------------------------------------ */
+/**
+ * Estimate the prompt, then trim or reject it before any network I/O.
+ * Mutates `geminiReq.contents` when a truncation policy applies; returns
+ * the estimated prompt tokens of what will actually be sent.
+ */
+export async function budgetPrompt(geminiReq: any): Promise<number> {
+  const { model, generationConfig } = geminiReq;
+  const system = generationConfig?.systemInstruction;
+  const systemTokens = system ? partsTokens(system.parts) : 0;
+  const turns = estimateTurns(geminiReq.contents);
+  let tokens = systemTokens + turns.reduce((a, b) => a + b, 0);
+
+  if (!MAX_PROMPT_TOKENS) return tokens;
+
+  // the estimate is rough; near the limit ask upstream for the real count
+  if (COUNT_MODE === 'exact' && tokens >= MAX_PROMPT_TOKENS * EXACT_THRESHOLD) {
+    try {
+      tokens = await countTokens(model, geminiReq.contents, system);
+    } catch (err) {
+      log.warn('countTokens failed, using estimate', { err });
+    }
+  }
+  if (tokens <= MAX_PROMPT_TOKENS) return tokens;
+
+  if (TRUNCATION !== 'sliding' && TRUNCATION !== 'middle') {
+    count('prompt_rejected');
+    throw new PromptTooLargeError(tokens, MAX_PROMPT_TOKENS);
+  }
+
+  // scale the per-turn estimates if an exact count disagreed with them
+  const scale = tokens / Math.max(1, systemTokens + turns.reduce((a, b) => a + b, 0));
+  const budget = (MAX_PROMPT_TOKENS - systemTokens * scale) / scale;
+  const result = truncate(geminiReq.contents, turns, budget, TRUNCATION);
+  const fitted = Math.ceil((systemTokens + result.total) * scale);
+  if (fitted > MAX_PROMPT_TOKENS) {
+    count('prompt_rejected');
+    throw new PromptTooLargeError(fitted, MAX_PROMPT_TOKENS);
+  }
+
+  count('prompt_truncated');
+  log.info('Prompt truncated to fit the context window', {
+    policy: TRUNCATION,
+    turnsDropped: geminiReq.contents.length - result.contents.length,
+    tokens: fitted,
+  });
+  geminiReq.contents = result.contents;
+  return fitted;
+}
@@ -0,0 +1,111 @@
+// src/tools.ts
+/* ------------------------------------------------------------------ */
+/*  OpenAI tools / functions ➞ Gemini functionDeclarations (cached)   */
+/* ------------------------------------------------------------------ */
+import { randomBytes } from 'crypto';
+import { LruCache, canonicalKey } from './cache';
+
+// Agents resend the same tool list every turn: map it once per content hash
+const declarations = new LruCache<any[]>({
+  maxEntries: Number(process.env.TOOL_CACHE_MAX_ENTRIES ?? 256),
+  maxBytes: 0,
+  ttlMs: 0,
+});
+
+/* ------------------------------------------------------------------ */
+/* 1.  JSON Schema ➞ Gemini Schema                                     */
+/* ------------------------------------------------------------------ */
+// Gemini accepts an OpenAPI subset and rejects unknown keywords
+// ($schema, additionalProperties, strict, …), so keep only these.
+const SCHEMA_KEYS = new Set([
+  'type', 'format', 'title', 'description', 'nullable', 'enum', 'items',
+  'properties', 'required', 'anyOf', 'minItems', 'maxItems', 'minimum',
+  'maximum', 'minLength', 'maxLength', 'pattern', 'default',
+]);
+
+function toSchema(schema: any): any {
+  if (!schema || typeof schema !== 'object' || Array.isArray(schema)) return schema;
+  const out: any = {};
+  for (const [key, value] of Object.entries(schema)) {
+    if (!SCHEMA_KEYS.has(key)) continue;
+    if (key === 'properties') {
+      out.properties = {};
+      for (const [name, prop] of Object.entries(value as object)) {
+        out.properties[name] = toSchema(prop);
+      }
+    } else if (key === 'items') {
+      out.items = toSchema(value);
+    } else if (key === 'anyOf') {
+      out.anyOf = (value as any[]).map(toSchema);
+    } else if (key === 'type' && Array.isArray(value)) {
+      // ["string", "null"] ➞ type: string, nullable: true
+      const types = value.filter((t) => t !== 'null');
+      out.type = types[0] ?? 'string';
+      if (types.length < value.length) out.nullable = true;
+    } else {
+      out[key] = value;
+    }
+  }
+  return out;
+}
+
+function declare(fn: any) {
+  const decl: any = { name: fn.name, description: fn.description ?? '' };
+  // a function without parameters must not send an empty object schema
+  if (fn.parameters && Object.keys(fn.parameters.properties ?? {}).length) {
+    decl.parameters = toSchema(fn.parameters);
+  }
+  return decl;
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Request side                                                    */
+/* ------------------------------------------------------------------ */
+function toolChoice(choice: any) {
+  if (choice === undefined) return undefined;
+  if (choice === 'none') return { functionCallingConfig: { mode: 'NONE' } };
+  if (choice === 'auto') return { functionCallingConfig: { mode: 'AUTO' } };
+  if (choice === 'required') return { functionCallingConfig: { mode: 'ANY' } };
+  // { type: 'function', function: { name } } or legacy { name }
+  const name = choice?.function?.name ?? choice?.name;
+  return name
+    ? { functionCallingConfig: { mode: 'ANY', allowedFunctionNames: [name] } }
+    : undefined;
+}
+
+/**
+ * `tools` / legacy `functions` plus `tool_choice` / `function_call` ➞ the
+ * `tools` and `toolConfig` entries of the Gemini request config.
+ */
+export function mapTools(body: any) {
+  const fns = [
+    ...(body.tools ?? []).filter((t: any) => t.type === 'function').map((t: any) => t.function),
+    ...(body.functions ?? []),
+  ];
+  const out: { tools?: unknown[]; toolConfig?: unknown } = {};
+  if (!fns.length) return out;
+
+  const key = canonicalKey(fns);
+  let decls = declarations.get(key);
+  if (!decls) {
+    decls = fns.map(declare);
+    declarations.set(key, decls);
+  }
+  out.tools = [{ functionDeclarations: decls }];
+
+  const toolConfig = toolChoice(body.tool_choice ?? body.function_call);
+  if (toolConfig) out.toolConfig = toolConfig;
+  return out;
+}
+
+/* ------------------------------------------------------------------ */
+/* 3.  Response side                                                   */
+/* ------------------------------------------------------------------ */
+/** Gemini functionCall part ➞ OpenAI tool call (arguments as a JSON string). */
+export function toToolCall(call: any) {
+  return {
+    id: call.id ?? `call_${randomBytes(12).toString('hex')}`,
+    type: 'function',
+    function: { name: call.name, arguments: JSON.stringify(call.args ?? {}) },
+  };
+}
@@ -0,0 +1,137 @@
+// src/transport.ts
+/* ------------------------------------------------------------------ */
+/*  Listener setup (HTTP/1.1 or HTTP/2) and response compression      */
+/* ------------------------------------------------------------------ */
+import fs from 'fs';
+import http from 'http';
+import http2 from 'http2';
+import zlib from 'zlib';
+import { promisify } from 'util';
+
+const COMPRESS = (process.env.COMPRESS ?? 'true') !== '0' && process.env.COMPRESS !== 'false';
+const COMPRESS_MIN_BYTES = Number(process.env.COMPRESS_MIN_BYTES ?? 1024);
+const KEEP_ALIVE_TIMEOUT_MS = Number(process.env.KEEP_ALIVE_TIMEOUT_MS ?? 65_000);
+const HEADERS_TIMEOUT_MS = Number(process.env.HEADERS_TIMEOUT_MS ?? 66_000);
+const SSE_COMPRESS = process.env.SSE_COMPRESS === '1' || process.env.SSE_COMPRESS === 'true';
+const HTTP2 = process.env.HTTP2 === '1' || process.env.HTTP2 === 'true';
+const HTTP2_MAX_STREAMS = Number(process.env.HTTP2_MAX_STREAMS ?? 256);
+
+export type Encoding = 'br' | 'gzip';
+
+const brotli = promisify(zlib.brotliCompress);
+const gzip = promisify(zlib.gzip);
+
+// favour latency: these bodies are built per request, never stored compressed
+const BROTLI_OPTIONS = { params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 4 } };
+const GZIP_OPTIONS = { level: 5 };
+
+/* ------------------------------------------------------------------ */
+/* 1.  Content negotiation                                             */
+/* ------------------------------------------------------------------ */
+/** Pick br or gzip from an Accept-Encoding header (q=0 means "no"). */
+export function negotiateEncoding(accept: string | string[] | undefined): Encoding | undefined {
+  if (!COMPRESS || !accept) return undefined;
+  const accepted = new Set<string>();
+  for (const part of String(accept).split(',')) {
+    const [name, ...params] = part.trim().toLowerCase().split(';');
+    const q = params.map((p) => p.trim()).find((p) => p.startsWith('q='));
+    if (q && Number(q.slice(2)) === 0) continue;
+    accepted.add(name);
+  }
+  if (accepted.has('br')) return 'br';
+  if (accepted.has('gzip') || accepted.has('*')) return 'gzip';
+  return undefined;
+}
+
+/** Encoding for an event stream; off unless SSE_COMPRESS is set. */
+export function sseEncoding(req: http.IncomingMessage): Encoding | undefined {
+  return SSE_COMPRESS ? negotiateEncoding(req.headers['accept-encoding']) : undefined;
+}
+
+/** True when the response goes out over an HTTP/2 stream. */
+export function isHttp2(res: http.ServerResponse) {
+  return (res.req?.httpVersionMajor ?? 1) >= 2;
+}
+
+/**
+ * Send a JSON body, compressed when the client accepts it and the body is
+ * big enough to be worth it. Compression runs on the zlib thread pool.
+ */
+export async function sendJSON(
+  req: http.IncomingMessage,
+  res: http.ServerResponse,
+  status: number,
+  json: string,
+  headers: http.OutgoingHttpHeaders = {},
+) {
+  let body: string | Buffer = json;
+  const encoding = json.length >= COMPRESS_MIN_BYTES
+    ? negotiateEncoding(req.headers['accept-encoding'])
+    : undefined;
+  if (encoding) {
+    body = encoding === 'br'
+      ? await brotli(json, BROTLI_OPTIONS)
+      : await gzip(json, GZIP_OPTIONS);
+    headers = { ...headers, 'Content-Encoding': encoding, Vary: 'Accept-Encoding' };
+  }
+  if (res.headersSent || res.writableEnded) return;
+  res.writeHead(status, {
+    'Content-Type': 'application/json',
+    'Content-Length': Buffer.byteLength(body),
+    ...headers,
+  });
+  res.end(body);
+}
+
+/**
+ * Streaming compressor for SSE. Every write is flushed, so each event
+ * reaches the client as soon as it is written instead of sitting in the
+ * compressor's window.
+ */
+export function createCompressor(encoding: Encoding): zlib.Gzip | zlib.BrotliCompress {
+  return encoding === 'br'
+    ? zlib.createBrotliCompress({ ...BROTLI_OPTIONS, flush: zlib.constants.BROTLI_OPERATION_FLUSH })
+    : zlib.createGzip({ ...GZIP_OPTIONS, flush: zlib.constants.Z_SYNC_FLUSH });
+}
+
+/* ------------------------------------------------------------------ */
+/* 2.  Listener                                                        */
+/* ------------------------------------------------------------------ */
+type Handler = (req: http.IncomingMessage, res: http.ServerResponse) => void;
+
+/**
+ * HTTP/1.1 by default. With HTTP2=1 the listener speaks h2 over TLS (with
+ * HTTP/1.1 fallback) when TLS_KEY/TLS_CERT are set, or cleartext h2c with
+ * prior knowledge otherwise.
+ */
+export function createServer(handler: Handler): http.Server | http2.Http2Server {
+  if (HTTP2) {
+    const settings = { maxConcurrentStreams: HTTP2_MAX_STREAMS };
+    const { TLS_KEY, TLS_CERT } = process.env;
+    if (TLS_KEY && TLS_CERT) {
+      return http2.createSecureServer(
+        {
+          key: fs.readFileSync(TLS_KEY),
+          cert: fs.readFileSync(TLS_CERT),
+          allowHTTP1: true,
+          settings,
+        },
+        handler as any,
+      );
+    }
+    return http2.createServer({ settings }, handler as any);
+  }
+
+  const server = http.createServer(handler);
+  // keep idle sockets open longer than a typical load balancer does, and
+  // give headers a little longer still so the two timers never race
+  server.keepAliveTimeout = KEEP_ALIVE_TIMEOUT_MS;
+  server.headersTimeout = Math.max(HEADERS_TIMEOUT_MS, KEEP_ALIVE_TIMEOUT_MS + 1_000);
+  return server;
+}
+
+/** Human-readable scheme for the startup log line. */
+export function listenerScheme() {
+  if (!HTTP2) return 'http';
+  return process.env.TLS_KEY && process.env.TLS_CERT ? 'https (h2)' : 'http (h2c)';
+}
@@ -7,37 +7,25 @@ import requests
 import json
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
 
 def test_concurrent_requests():
     """Testa requisições concorrentes para verificar se o erro de headers foi corrigido"""
     print("🔄 Testando requisições concorrentes...")
-    
-    def make_request(i):
-        try:
-            response = requests.post(
-                "http://localhost:11434/v1/chat/completions",
-                json={
-                    "model": "gemini-2.5-pro",
-                    "messages": [{"role": "user", "content": f"Diga apenas: Teste {i}"}],
-                    "stream": False,
-                    "max_tokens": 50
-                },
-                timeout=10
-            )
-            return f"Request {i}: Status {response.status_code}"
-        except Exception as e:
-            return f"Request {i}: Error {e}"
-    
-    # Fazer 5 requisições simultâneas
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(make_request, i) for i in range(1, 6)]
-        results = [future.result() for future in futures]
-    
-    for result in results:
-        print(f"  {result}")
-    
-    return all("Status 200" in result for result in results)
+
+    # importado aqui: bench.py depende de httpx, que os outros testes não usam
+    import bench
+
+    # 5 clientes com conexões reaproveitadas, metade em stream (ver bench.py)
+    args = bench.parse_args([
+        "--concurrency", "5", "--requests", "10", "--stream-ratio", "0.5",
+        "--max-tokens", "50", "--timeout", "10", "--validate-rate", "1",
+    ])
+    report = asyncio.run(bench.run(args))
+    bench.print_summary(report["summary"])
+
+    summary = report["summary"]
+    return summary["ok"] == summary["requests"] and summary["invalid"] == 0
 
 def test_content_field():
     """Testa se o campo content está presente na resposta não-streaming"""
@@ -4,11 +4,15 @@ Script de teste para o proxy Gemini-OpenAI
 Testa diferentes cenários para identificar problemas no mapeamento
 """
 
+import argparse
+import os
+import socket
+import subprocess
 import requests
 import json
 import time
 import sys
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 
 class ProxyTester:
     def __init__(self, base_url: str = "http://localhost:11434"):
@@ -333,16 +337,64 @@ class ProxyTester:
         
         return results
 
-def main():
-    if len(sys.argv) > 1:
-        base_url = sys.argv[1]
+def start_proxy(env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    """Sobe o proxy numa porta livre e espera /readyz responder"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    if os.path.exists(os.path.join(root, "dist", "server.js")):
+        cmd = ["node", "dist/server.js"]
     else:
-        base_url = "http://localhost:11434"
-    
+        cmd = ["npx", "ts-node", "src/server.ts"]
+    proc = subprocess.Popen(cmd, cwd=root, env={**os.environ, **env, "PORT": str(port)},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://localhost:{port}"
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Proxy terminou com código {proc.returncode}")
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return proc, base_url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Proxy não ficou pronto em 60s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Testes do proxy Gemini-OpenAI")
+    parser.add_argument("base_url", nargs="?", default="http://localhost:11434")
+    parser.add_argument("--record", metavar="CASSETTE",
+                        help="sobe o proxy gravando o tráfego upstream neste arquivo JSONL")
+    parser.add_argument("--offline", metavar="CASSETTE",
+                        help="sobe o proxy reproduzindo uma gravação, sem acessar o Gemini")
+    parser.add_argument("--replay-speed", default="0",
+                        help="1 = tempos originais, 10 = 10x mais rápido, 0 = sem esperas")
+    args = parser.parse_args()
+
+    proxy, base_url = None, args.base_url
+    if args.offline:
+        proxy, base_url = start_proxy({
+            "REPLAY_CASSETTE": args.offline,
+            "REPLAY_SPEED": args.replay_speed,
+            "RESPONSE_CACHE": "0",
+        })
+    elif args.record:
+        proxy, base_url = start_proxy({"RECORD_CASSETTE": args.record, "RESPONSE_CACHE": "0"})
+
     print(f"Testando proxy em: {base_url}")
     
     tester = ProxyTester(base_url)
-    results = tester.run_all_tests()
+    try:
+        results = tester.run_all_tests()
+    finally:
+        if proxy:
+            proxy.terminate()
+            proxy.wait()
     
     # Exit code baseado nos resultados
     if all(results.values()):